@@ -0,0 +1,374 @@
+"""
+    Ingests the articles of the source csv (or JSONL) file into an article store, a Parquet file
+    that keeps the row and metadata of every article next to its text:
+
+        <name>.articles.parquet -> the columns id (hash of the text, as in packed_corpus.py), row
+                                   (row of the article in the source file), text, and one string
+                                   column per metadata column of the source (e.g. date, source)
+
+    The source is read in chunks of rows and the store written one row group per chunk, so memory
+    stays flat however large the source is: only the IDs of the articles written so far are kept,
+    to skip the cells whose text was already written. Empty cells (NaN in pandas) are skipped, and
+    any set of row ranges can be ingested, not only one slice:
+
+        python article_store.py <source.csv|source.jsonl> <column> <directory> [--name NAME]
+                                [--metadata date source] [--rows 0-999 5000-]
+
+    The similarity and extraction scripts accept the path to the store wherever they accept a
+    directory (see packed_corpus.py). Each article is then referred to by a document path
+    "<name>.articles.parquet#<id>". Only the id column is read to list the articles, and the text
+    of an article is read with the text column of its row group, a few row groups being cached,
+    so the metadata columns are never read unless document_metadata() asks for them.
+"""
+
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+from collections import OrderedDict
+import argparse
+import json
+import math
+import os
+import threading
+import packed_corpus
+
+STORE_EXTENSION = ".articles.parquet"
+
+# columns written for every article, before the metadata columns
+COLUMNS = ["id", "row", "text"]
+
+# number of row groups whose text is kept in memory by each process
+CACHED_ROW_GROUPS = 4
+
+# article stores opened by this process, by path
+open_stores = {}
+
+# reading the stores is shared by the reader threads of prefetch.py
+lock = threading.Lock()
+
+# Function to read a range of rows such as "0-999"
+def parse_rows(text: str) -> Tuple[int, float]:
+    """
+    Reads a range of rows, used as the type of the --rows argument
+
+    Args:
+        text (str): "FIRST-LAST", "FIRST-" (to the end of the file) or "ROW", rows counted from 0
+
+    Returns:
+        first, last (tuple): the first and last row of the range, last is math.inf for "FIRST-"
+    """
+    first, separator, last = text.strip().partition("-")
+    try:
+        rows = (int(first), int(last) if last else math.inf) if separator else (int(first), int(first))
+    except ValueError:
+        raise ValueError(f"not a range of rows: {text}") from None
+    if rows[0] < 0 or rows[1] < rows[0]:
+        raise ValueError(f"not a range of rows: {text}")
+    return rows
+
+# Create an argument parser
+parser = argparse.ArgumentParser()
+
+# Add the positional arguments
+parser.add_argument("filepath", help="filepath to the csv or JSONL file with the articles")
+parser.add_argument("column_name", help="name of the column (or JSONL field) with the text of the articles")
+parser.add_argument("directory", help="directory/folder to save the article store to")
+
+# Add the optional arguments
+parser.add_argument("--name", default="articles", help=f"write <directory>/<NAME>{STORE_EXTENSION} (default NAME: articles)")
+parser.add_argument("--metadata", nargs="+", default=[], metavar="COLUMN",
+                    help="columns (or JSONL fields) of the source kept with each article, e.g. date source")
+parser.add_argument("--rows", type=parse_rows, nargs="+", metavar="FIRST-LAST",
+                    help="ranges of rows to ingest, e.g. 0-999 5000- (default: all rows)")
+parser.add_argument("--input-format", choices=["csv", "jsonl"],
+                    help="format of the source file (default: jsonl for .jsonl and .ndjson files, csv otherwise)")
+parser.add_argument("--chunksize", type=int, default=10000, help="number of rows read, and articles written, at a time")
+
+# Function to check if a cell has the text of an article
+def is_text(value: Any) -> bool:
+    """
+    Returns:
+        True if the value is a string that is not only whitespace. NaN, None and numbers are not
+    """
+    return isinstance(value, str) and not value.isspace() and value != ""
+
+# Function to read the articles of the source file
+def read_records(filepath: str, column_name: str, metadata: Sequence[str] = (), rows: List[Tuple[int, float]] = None,
+                 input_format: str = None, chunksize: int = 10000) -> Iterator[Dict[str, Any]]:
+    """
+    Reads the articles of a csv or JSONL file in chunks of rows, loading only the columns needed
+
+    Args:
+        filepath (str): filepath to the csv or JSONL file
+        column_name (str): name of the column (or JSONL field) with the text
+        metadata (list): names of the columns (or JSONL fields) kept with each article
+        rows (list): (first, last) ranges of rows to read, from parse_rows(). All rows if None
+        input_format (str): 'csv' or 'jsonl', from the extension of the file if None
+        chunksize (int): number of csv rows to read at a time
+
+    Yields:
+        record (dict): the keys "row" (row number, from 0, not counting the csv header), "text"
+                       and the metadata columns, None for empty metadata cells. Rows with an
+                       empty text cell are skipped
+    """
+    if input_format is None:
+        input_format = "jsonl" if filepath.endswith((".jsonl", ".ndjson")) else "csv"
+    last_row = max(last for _, last in rows) if rows else math.inf
+
+    def wanted(row):
+        return rows is None or any(first <= row <= last for first, last in rows)
+
+    if input_format == "jsonl":
+        with open(filepath, encoding="utf-8") as filehandle:
+            row = 0
+            for line in filehandle:
+                if not line.strip():
+                    continue
+                if row > last_row:
+                    break
+                if wanted(row):
+                    item = json.loads(line)
+                    text = item.get(column_name)
+                    if is_text(text):
+                        record = {"row": row, "text": text}
+                        for column in metadata:
+                            value = item.get(column)
+                            record[column] = None if value is None else str(value)
+                        yield record
+                row += 1
+        return
+
+    # pandas takes a while to import, so it is only imported once it is needed
+    import pandas as pd
+
+    # the metadata is read as strings, so every chunk has the same column types
+    for chunk in pd.read_csv(filepath, usecols=[column_name, *metadata], dtype=str, chunksize=chunksize):
+        # the row labels of each chunk continue from the previous chunk
+        for row, values in zip(chunk.index.tolist(), chunk.itertuples(index=False, name=None)):
+            if not wanted(row):
+                continue
+            cells = dict(zip(chunk.columns, values))
+            if is_text(cells[column_name]):
+                record = {"row": row, "text": cells[column_name]}
+                for column in metadata:
+                    record[column] = cells[column] if isinstance(cells[column], str) else None
+                yield record
+        # stop reading once the last row has been read
+        if len(chunk) and chunk.index[-1] >= last_row:
+            break
+
+class ArticleStoreWriter:
+    """
+    Streams articles to an article store, one row group at a time. The store is written to a
+    temporary file that replaces <store_path> once closed, so a store is never read half written
+
+    Args:
+        store_path (str): path to the .articles.parquet file to create
+        metadata (list): names of the metadata columns
+        row_group_size (int): number of articles of a row group
+    """
+
+    def __init__(self, store_path: str, metadata: Sequence[str] = (), row_group_size: int = 10000):
+        import pyarrow
+        import pyarrow.parquet
+
+        clashes = set(COLUMNS) & set(metadata)
+        if clashes:
+            raise ValueError(f"metadata columns cannot be named {', '.join(sorted(clashes))}")
+
+        self.pyarrow = pyarrow
+        self.store_path = store_path
+        self.metadata = list(metadata)
+        self.row_group_size = max(row_group_size, 1)
+        self.schema = pyarrow.schema([("id", pyarrow.string()), ("row", pyarrow.int64()), ("text", pyarrow.string())]
+                                     + [(column, pyarrow.string()) for column in self.metadata])
+        self.writer = pyarrow.parquet.ParquetWriter(f"{store_path}.tmp", self.schema, compression="zstd")
+        self.written = set()
+        self.batch = {column: [] for column in self.schema.names}
+        self.duplicates = 0
+
+    def write(self, record: Dict[str, Any]) -> bool:
+        """
+        Adds an article, unless an article with the same text was already written
+
+        Args:
+            record (dict): the keys "row", "text" and the metadata columns, from read_records()
+
+        Returns:
+            True if the article was written
+        """
+        doc_id = packed_corpus.document_id(record["text"].encode("utf-8"))
+        if doc_id in self.written:
+            self.duplicates += 1
+            return False
+        self.written.add(doc_id)
+
+        self.batch["id"].append(doc_id)
+        for column in self.schema.names[1:]:
+            self.batch[column].append(record.get(column))
+        if len(self.batch["id"]) >= self.row_group_size:
+            self.flush()
+        return True
+
+    def flush(self) -> None:
+        """
+        Writes the batched articles as a row group
+        """
+        if self.batch["id"]:
+            self.writer.write_table(self.pyarrow.Table.from_pydict(self.batch, schema=self.schema))
+            self.batch = {column: [] for column in self.schema.names}
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+        os.replace(f"{self.store_path}.tmp", self.store_path)
+        open_stores.pop(self.store_path, None)
+
+# Function to check if a path is an article store
+def is_article_store(path: str) -> bool:
+    """
+    Checks if a path is an article store
+
+    Args:
+        path (str): path to a directory or file
+
+    Returns:
+        True if the path is a .articles.parquet file
+    """
+    # stores opened by this process are not looked up on disk again
+    return path in open_stores or (path.endswith(STORE_EXTENSION) and os.path.isfile(path))
+
+# Function to open an article store
+def open_article_store(store_path: str) -> dict:
+    """
+    Reads the IDs of the articles of a store, without their text or metadata. Stores are opened
+    once per process.
+
+    Args:
+        store_path (str): path to the .articles.parquet file
+
+    Returns:
+        store (dict): with the keys "file" (pyarrow.parquet.ParquetFile), "ids" (article IDs in
+                      the order they were written), "positions" ((row group, index) of each article
+                      by ID) and "cache" (text of the most recently read row groups)
+    """
+    with lock:
+        if store_path not in open_stores:
+            import pyarrow.parquet
+
+            parquet_file = pyarrow.parquet.ParquetFile(store_path)
+            ids = []
+            positions = {}
+            for group in range(parquet_file.num_row_groups):
+                group_ids = parquet_file.read_row_group(group, columns=["id"]).column("id").to_pylist()
+                for index, doc_id in enumerate(group_ids):
+                    positions[doc_id] = (group, index)
+                ids.extend(group_ids)
+
+            open_stores[store_path] = {"file": parquet_file, "ids": ids, "positions": positions, "cache": OrderedDict()}
+
+    return open_stores[store_path]
+
+# Function to list the articles of an article store
+def document_paths(store_path: str) -> List[str]:
+    """
+    Lists the document paths of the articles in an article store
+
+    Args:
+        store_path (str): path to the .articles.parquet file
+
+    Returns:
+        paths (list): "<store_path>#<id>" for each article
+    """
+    return [f"{store_path}#{doc_id}" for doc_id in open_article_store(store_path)["ids"]]
+
+# Function to read the stored text of an article
+def document_text(document_path: str) -> str:
+    """
+    Reads the text of an article from the text column of its row group
+
+    Args:
+        document_path (str): "<name>.articles.parquet#<id>"
+
+    Returns:
+        text (str): the text of the article, as it was in the source file
+    """
+    store_path, _, doc_id = document_path.rpartition("#")
+    store = open_article_store(store_path)
+    group, index = store["positions"][doc_id]
+
+    with lock:
+        texts = store["cache"].get(group)
+        if texts is None:
+            texts = store["file"].read_row_group(group, columns=["text"]).column("text").to_pylist()
+            store["cache"][group] = texts
+            if len(store["cache"]) > CACHED_ROW_GROUPS:
+                store["cache"].popitem(last=False)
+        else:
+            store["cache"].move_to_end(group)
+
+    return texts[index]
+
+# Function to get the bytes of an article
+def document_bytes(document_path: str) -> bytes:
+    """
+    Returns:
+        data (bytes): the UTF-8 encoded text of the article, as packed_corpus.document_bytes()
+    """
+    return document_text(document_path).encode("utf-8")
+
+# Function to read the text of an article
+def read_document(document_path: str) -> str:
+    """
+    Reads the text of an article in an article store
+
+    Args:
+        document_path (str): "<name>.articles.parquet#<id>"
+
+    Returns:
+        text (str): the text of the article, with the same newlines as reading a text file
+    """
+    return document_text(document_path).replace("\r\n", "\n").replace("\r", "\n")
+
+# Function to read the row and metadata of an article
+def document_metadata(document_path: str, columns: Sequence[str] = None) -> Dict[str, Any]:
+    """
+    Reads the row and metadata of an article, without reading the text of its row group
+
+    Args:
+        document_path (str): "<name>.articles.parquet#<id>"
+        columns (list): the columns to read. The row and every metadata column if None
+
+    Returns:
+        metadata (dict): the value of each column
+    """
+    store_path, _, doc_id = document_path.rpartition("#")
+    store = open_article_store(store_path)
+    group, index = store["positions"][doc_id]
+    if columns is None:
+        columns = [column for column in store["file"].schema_arrow.names if column not in ("id", "text")]
+
+    with lock:
+        table = store["file"].read_row_group(group, columns=list(columns))
+    return {column: table.column(column)[index].as_py() for column in columns}
+
+def main(filepath, column_name, directory, name="articles", metadata=(), rows=None, input_format=None, chunksize=10000):
+
+    store_path = os.path.join(directory, f"{name}{STORE_EXTENSION}")
+    writer = ArticleStoreWriter(store_path, metadata, chunksize)
+
+    read = 0
+    for record in read_records(filepath, column_name, metadata, rows, input_format, chunksize):
+        writer.write(record)
+        read += 1
+    writer.close()
+
+    print(f"Wrote {read - writer.duplicates} articles to {store_path}, skipped {writer.duplicates} duplicates")
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    try:
+        main(args.filepath, args.column_name, args.directory, args.name, args.metadata, args.rows, args.input_format,
+             args.chunksize)
+    except ValueError as error:
+        parser.error(str(error))
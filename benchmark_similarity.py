@@ -0,0 +1,321 @@
+"""
+    Benchmarks the similarity scripts on synthetic corpora of increasing size, so changes can be
+    checked for regressions and the scripts compared on equal footing.
+
+    For every corpus size a deterministic synthetic corpus is generated (see synthetic_corpus.py)
+    and each scorer is run on it in a fresh process, which records:
+
+        wall_seconds      -> time taken by main(), without loading the NLP models
+        load_seconds      -> time taken to import the script and load its NLP models
+        pairs             -> number of pairs scored (rows of the results file)
+        pairs_per_second  -> pairs / wall_seconds
+        peak_rss_mb       -> peak resident memory of the process
+        stages            -> wall and CPU time and calls of each stage of the script, and
+        counters             the counters of the run, as recorded by stage_profiler.py
+
+    Once a scorer takes longer than the time limit, it is not run on the larger corpora.
+
+    The results are written to a JSON file. Given a baseline (a JSON file written by an earlier
+    run), the wall time and peak memory of every run are compared to the baseline and the script
+    exits with status 1 if any of them regressed by more than the tolerance.
+
+    With --stand-ins the NLP models are replaced by the small local stand-ins in offline_models.py,
+    so the benchmark runs offline without the spaCy and NLTK model data.
+
+    Usage:
+        python benchmark_similarity.py results.json --sizes 10 100 1000 --stand-ins
+        python benchmark_similarity.py results.json --baseline baseline.json
+        python benchmark_similarity.py results.json --baseline baseline.json --compare-only
+"""
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import shutil
+import sys
+import tempfile
+import time
+from synthetic_corpus import generate_articles, write_corpus
+import stage_profiler
+
+# Create an argument parser
+parser = argparse.ArgumentParser()
+
+# Add the positional arguments
+parser.add_argument("output", help="JSON file to write the results to")
+
+# Add the optional arguments
+parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="numbers of articles to benchmark")
+parser.add_argument("--scorers", nargs="+", help="scorers to benchmark (default: all)")
+parser.add_argument("--time-limit", type=float, default=600,
+                    help="seconds after which a run is stopped. The scorer is not run on larger corpora")
+parser.add_argument("--repeat", type=int, default=1, help="number of runs of each scorer and size. The fastest run is kept")
+parser.add_argument("--workers", type=int, default=1, help="number of processes used by the scripts to score pairs")
+parser.add_argument("--stand-ins", action="store_true", help="use the offline stand-ins for the spaCy and NLTK models")
+parser.add_argument("--spacy-model", default="en_core_web_lg", help="spaCy pipeline loaded without --stand-ins")
+parser.add_argument("--workdir", help="directory for the corpora and the results of the scripts (default: a temporary directory)")
+parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic corpus generator")
+parser.add_argument("--reprint-rate", type=float, default=0.1, help="share of articles that are exact reprints")
+parser.add_argument("--near-duplicate-rate", type=float, default=0.1, help="share of articles that are edited reprints")
+parser.add_argument("--min-sentences", type=int, default=5, help="least number of sentences of an article")
+parser.add_argument("--max-sentences", type=int, default=25, help="largest number of sentences of an article")
+parser.add_argument("--baseline", help="JSON file of an earlier run to compare the results to")
+parser.add_argument("--tolerance", type=float, default=0.1,
+                    help="relative increase in wall time or peak memory over the baseline reported as a regression")
+parser.add_argument("--compare-only", action="store_true", help="compare the existing output file to the baseline without running")
+
+# scorer name -> (script module, keyword arguments of its main() function)
+SCORERS = {
+    "check_document": ("check_document_similarity", {}),
+    "check_document_sentences": ("check_document_similarity", {"mode": "sentences"}),
+    "common_words": ("common_words_similarity", {}),
+    "common_words_pairwise": ("common_words_similarity", {"engine": "pairwise"}),
+    "common_words_semantic": ("common_words_similarity", {"semantic": True}),
+    "tf_idf": ("tf_idf_document_similarity", {}),
+    "tf_idf_corpus": ("tf_idf_document_similarity", {"mode": "corpus"}),
+}
+
+# wall time differences below this many seconds are not reported as regressions
+NOISE_SECONDS = 0.05
+
+# Function that runs one scorer in a fresh process
+def run_scorer(results_queue, scorer, corpus, run_directory, stand_ins, spacy_model, workers):
+    """
+    Runs a scorer on a corpus and puts its measurements on the queue
+
+    Args:
+        results_queue (multiprocessing.Queue): queue to put the measurements on
+        scorer (str): name of the scorer in SCORERS
+        corpus (str): directory or packed corpus to score
+        run_directory (str): directory to write the results and the gensim shards to
+        stand_ins (bool): use the offline stand-ins for the NLP models
+        spacy_model (str): spaCy pipeline to load when not using the stand-ins
+        workers (int): number of processes used to score pairs
+    """
+    try:
+        module_name, options = SCORERS[scorer]
+        os.chdir(run_directory)
+
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        if stand_ins:
+            import offline_models
+            offline_models.install(module)
+        elif hasattr(module, "filter_tokens"):
+            module.nlp_lg = module.load_pipeline(spacy_model)
+        load_seconds = time.perf_counter() - started
+
+        stage_profiler.configure()
+
+        started = time.perf_counter()
+        module.main(corpus, "results", workers=workers, **options)
+        wall_seconds = time.perf_counter() - started
+        profile = stage_profiler.report()
+
+        with open("results.csv") as results_file:
+            pairs = sum(1 for _ in results_file) - 1
+
+        results_queue.put({"status": "ok", "wall_seconds": round(wall_seconds, 6), "load_seconds": round(load_seconds, 6),
+                           "pairs": pairs, "pairs_per_second": round(pairs / wall_seconds, 3) if wall_seconds else None,
+                           "peak_rss_mb": profile["peak_rss_mb"], "stages": profile["stages"],
+                           "counters": profile["counters"]})
+    except Exception as error:
+        results_queue.put({"status": "error", "error": repr(error)})
+
+# Function to run a scorer in a fresh process with a time limit
+def run_isolated(scorer, corpus, run_directory, stand_ins, spacy_model, workers, time_limit):
+    """
+    Runs a scorer in a new process, so that its peak memory and imports are its own
+
+    Args:
+        scorer (str): name of the scorer in SCORERS
+        corpus (str): directory or packed corpus to score
+        run_directory (str): directory to run the scorer in
+        stand_ins (bool): use the offline stand-ins for the NLP models
+        spacy_model (str): spaCy pipeline to load when not using the stand-ins
+        workers (int): number of processes used to score pairs
+        time_limit (float): seconds after which the process is stopped
+
+    Returns:
+        measurements (dict): as put on the queue by run_scorer(), or the status "timeout"/"error"
+    """
+    # spawn, so the new process does not inherit the memory of this one
+    context = multiprocessing.get_context("spawn")
+    results_queue = context.Queue()
+    process = context.Process(target=run_scorer, args=(results_queue, scorer, corpus, run_directory,
+                                                       stand_ins, spacy_model, workers))
+    process.start()
+
+    deadline = time.monotonic() + time_limit
+    measurements = None
+    while measurements is None:
+        try:
+            measurements = results_queue.get(timeout=1)
+        except queue.Empty:
+            if time.monotonic() > deadline:
+                process.terminate()
+                measurements = {"status": "timeout", "error": f"stopped after {time_limit}s"}
+            elif not process.is_alive() and results_queue.empty():
+                measurements = {"status": "error", "error": f"process exited with code {process.exitcode}"}
+
+    process.join()
+
+    return measurements
+
+# Function to run the benchmarks
+def run_benchmarks(sizes, scorers, workdir, generator_options, stand_ins=False, spacy_model="en_core_web_lg",
+                   workers=1, time_limit=600, repeat=1):
+    """
+    Runs every scorer on a synthetic corpus of each size
+
+    Args:
+        sizes (list): numbers of articles
+        scorers (list): names of the scorers in SCORERS
+        workdir (str): directory for the corpora and the results of the scripts
+        generator_options (dict): keyword arguments of synthetic_corpus.generate_articles()
+        stand_ins (bool): use the offline stand-ins for the NLP models
+        spacy_model (str): spaCy pipeline to load when not using the stand-ins
+        workers (int): number of processes used to score pairs
+        time_limit (float): seconds after which a run is stopped
+        repeat (int): number of runs of each scorer and size. The fastest run is kept
+
+    Returns:
+        results (list): the measurements of each scorer and size
+    """
+    results = []
+    # scorers that timed out or failed on a smaller corpus
+    stopped = {}
+
+    for size in sorted(sizes):
+        corpus = write_corpus(os.path.join(workdir, f"corpus-{size}"), generate_articles(size, **generator_options))
+
+        for scorer in scorers:
+            result = {"scorer": scorer, "documents": size}
+
+            if scorer in stopped:
+                result.update({"status": "skipped", "error": f"{stopped[scorer]} on a smaller corpus"})
+            else:
+                runs = []
+                for number in range(repeat):
+                    run_directory = os.path.join(workdir, f"{scorer}-{size}-{number}")
+                    os.makedirs(run_directory, exist_ok=True)
+                    runs.append(run_isolated(scorer, corpus, run_directory, stand_ins, spacy_model, workers, time_limit))
+                    shutil.rmtree(run_directory)
+                    if runs[-1]["status"] != "ok":
+                        stopped[scorer] = runs[-1]["status"]
+                        break
+                ok_runs = [run for run in runs if run["status"] == "ok"]
+                result.update(min(ok_runs, key=lambda run: run["wall_seconds"]) if len(ok_runs) == len(runs) else runs[-1])
+
+            print(f"{scorer:>24} {size:>6} docs: " + (
+                f"{result['wall_seconds']:.3f}s, {result['pairs_per_second']} pairs/s, {result['peak_rss_mb']:.1f} MB"
+                if result["status"] == "ok" else f"{result['status']} ({result['error']})"), flush=True)
+            results.append(result)
+
+    return results
+
+# Function to compare results to a baseline
+def compare(results, baseline, tolerance):
+    """
+    Compares the wall time and peak memory of each run to the same scorer and size in a baseline
+
+    Args:
+        results (dict): benchmark results with the keys "settings" and "results"
+        baseline (dict): benchmark results of an earlier run
+        tolerance (float): relative increase reported as a regression
+
+    Returns:
+        regressions (list): descriptions of the regressions
+    """
+    if results["settings"] != baseline["settings"]:
+        print("Warning: the results and the baseline were run with different settings")
+
+    baseline_runs = {(run["scorer"], run["documents"]): run for run in baseline["results"] if run["status"] == "ok"}
+    regressions = []
+
+    print(f"{'scorer':>24} {'docs':>6} {'wall':>10} {'baseline':>10} {'ratio':>7} {'rss MB':>9} {'baseline':>9} {'ratio':>7}")
+    for run in results["results"]:
+        base = baseline_runs.get((run["scorer"], run["documents"]))
+        if run["status"] != "ok" or base is None:
+            continue
+
+        time_ratio = run["wall_seconds"] / base["wall_seconds"] if base["wall_seconds"] else 1.0
+        rss_ratio = run["peak_rss_mb"] / base["peak_rss_mb"] if base["peak_rss_mb"] else 1.0
+        print(f"{run['scorer']:>24} {run['documents']:>6} {run['wall_seconds']:>9.3f}s {base['wall_seconds']:>9.3f}s "
+              f"{time_ratio:>6.2f}x {run['peak_rss_mb']:>9.1f} {base['peak_rss_mb']:>9.1f} {rss_ratio:>6.2f}x")
+
+        if time_ratio > 1 + tolerance and run["wall_seconds"] - base["wall_seconds"] > NOISE_SECONDS:
+            regressions.append(f"{run['scorer']} on {run['documents']} documents: wall time {time_ratio:.2f}x the baseline")
+        if rss_ratio > 1 + tolerance:
+            regressions.append(f"{run['scorer']} on {run['documents']} documents: peak memory {rss_ratio:.2f}x the baseline")
+
+    # runs of the benchmarked scorers that no longer complete
+    benchmarked = set(run["scorer"] for run in results["results"])
+    for run in baseline["results"]:
+        if run["status"] == "ok" and run["scorer"] in benchmarked and not any(r["scorer"] == run["scorer"] and r["documents"] == run["documents"]
+                                             and r["status"] == "ok" for r in results["results"]):
+            regressions.append(f"{run['scorer']} on {run['documents']} documents: ran in the baseline but not now")
+
+    return regressions
+
+def main(output, sizes, scorers, workdir, generator_options, stand_ins=False, spacy_model="en_core_web_lg",
+         workers=1, time_limit=600, repeat=1):
+
+    temporary = workdir is None
+    if temporary:
+        workdir = tempfile.mkdtemp(prefix="similarity-benchmark-")
+
+    try:
+        results = run_benchmarks(sizes, scorers, os.path.abspath(workdir), generator_options, stand_ins,
+                                 spacy_model, workers, time_limit, repeat)
+    finally:
+        if temporary:
+            shutil.rmtree(workdir)
+
+    report = {
+        "settings": {"generator": generator_options, "stand_ins": stand_ins,
+                     "spacy_model": None if stand_ins else spacy_model, "workers": workers},
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "processor": platform.processor(), "cpus": os.cpu_count()},
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+
+    return report
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    scorers = args.scorers or list(SCORERS)
+    for scorer in scorers:
+        if scorer not in SCORERS:
+            parser.error(f"unknown scorer {scorer}, choose from {', '.join(SCORERS)}")
+
+    generator_options = {"seed": args.seed, "reprint_rate": args.reprint_rate,
+                         "near_duplicate_rate": args.near_duplicate_rate,
+                         "min_sentences": args.min_sentences, "max_sentences": args.max_sentences}
+
+    if args.compare_only:
+        if args.baseline is None:
+            parser.error("--compare-only needs --baseline")
+        with open(args.output) as output_file:
+            report = json.load(output_file)
+    else:
+        report = main(args.output, args.sizes, scorers, args.workdir, generator_options, args.stand_ins,
+                      args.spacy_model, args.workers, args.time_limit, args.repeat)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1 if regressions else 0)
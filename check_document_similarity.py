@@ -4,6 +4,12 @@
     be saved to a CSV file. It is up to the user to then determine what value to use as the cut-off 
     index to determine if two documents are similar or not. 
 
+    With --mode sentences, every sentence of the second file is queried against the sentences of
+    the first file in one batch, and a pair is scored by the average similarity of each sentence
+    of the second file to its best matching sentence of the first file. --alignments writes these
+    best matching sentences to a second CSV file. The default mode, last-sentence, scores a pair
+    with the last sentence of the second file only, as earlier versions of this script did.
+
     Tip: If you have a lot of files to compare e.g 100 or more, you might want to check how many file handlers
          have been set on your operating system. This might need changing otherwise you will get an error. 
          On Linux use: "cat /proc/sys/fs/inotify/max_user_watches" to find the default no. of file handlers.
@@ -24,33 +30,73 @@
 """
 
 import argparse
+import csv
 import os
-import pandas as pd
-import gensim
-import nltk
 import numpy as np
-from nltk.tokenize import word_tokenize, sent_tokenize
+from lazy_nltk import word_tokenize, sent_tokenize, NLTK_VERSION
+import nlp_cache
+import stage_profiler
+from pair_scheduler import run_pair_chunks
+from pair_shards import parse_shard, shard_range, open_shard, write_manifest
+from result_sink import ResultSink
+from packed_corpus import is_packed_corpus, is_document_path, document_paths, read_document
+from vocabulary import Vocabulary, LocalDictionary
+import prefetch
 
 # Create an argument parser
 parser = argparse.ArgumentParser()
 
 # Add the positional arguments
-parser.add_argument("directory", help="path to directory with files to compare")
+parser.add_argument("directory", help="path to directory with files to compare, or to a packed corpus (.pack file) or article store (.articles.parquet file)")
 parser.add_argument("filename", help="name of csv file (without .csv extension) to use for the similarity indices")
 
-args = parser.parse_args()
+# Add the optional arguments
+parser.add_argument("--mode", choices=["last-sentence", "sentences"], default="last-sentence",
+                    help="'last-sentence' scores a pair with the last sentence of the second file, 'sentences' queries "
+                         "every sentence of the second file in one batch and averages their best matches")
+parser.add_argument("--max-files", type=int, help="only compare the first MAX_FILES files (default: all files)")
+parser.add_argument("--alignments", metavar="FILENAME",
+                    help="with --mode sentences, write the best matching sentence of each sentence to FILENAME.csv")
+parser.add_argument("--alignment-threshold", type=int, default=50,
+                    help="least similarity (%%) of the sentence alignments written to the alignments file")
+parser.add_argument("--read-threads", type=int, default=8,
+                    help="number of threads reading the files ahead of the tokenizer (0 reads them one at a time)")
+parser.add_argument("--read-ahead", type=int, default=64, help="number of files read ahead of the tokenizer")
+parser.add_argument("--cache-dir", help="directory of the NLP cache shared by the similarity scripts (disabled if not given)")
+parser.add_argument("--cache-size", type=float, default=1024, help="size limit of the NLP cache in megabytes")
+parser.add_argument("--shard", type=parse_shard, metavar="I/N",
+                    help="only score the I-th of N ranges of the pairs (1 <= I <= N), for runs split over N machines. "
+                         "Writes FILENAME.shard-I-of-N.csv and a manifest, merged with pair_shards.py merge")
+parser.add_argument("--workers", type=int, default=1, help="number of processes used to score the pairs of files")
+parser.add_argument("--format", dest="output_format", choices=["csv", "parquet", "npz"], default="csv",
+                    help="format of the results file (the filename argument is used without its extension). npz needs --min-similarity")
+parser.add_argument("--min-similarity", type=int, help="only write pairs with at least this similarity (%%)")
+parser.add_argument("--profile", metavar="FILE", help="write the time spent in each stage and the counters of the run to FILE")
+parser.add_argument("--profile-format", choices=["json", "chrome"], default="json",
+                    help="'json' for the totals of each stage, 'chrome' for a Chrome trace of every stage call")
+parser.add_argument("--profile-sample", type=float, default=0, metavar="HZ",
+                    help="also sample the Python stack HZ times per second of CPU time, written to FILE.folded")
+
+# column names of the sentence alignments file. Sentences are numbered from 0 in each file
+ALIGNMENT_COLUMNS = ["File_1", "File_2", "Sentence_2", "Sentence_1", "Similarity (%)"]
+
+# namespace of the NLTK sentence and word tokens in the NLP cache
+NLTK_TOKENS = nlp_cache.cache_namespace("nltk-tokens", NLTK_VERSION)
 
 # Get full file paths
 def filePaths(directory_with_files):
   """
-  Gets the full path of each file in a directory
+  Gets the full path of each file in a directory, or the document path of each article
+  in a packed corpus (see packed_corpus.py)
 
     Args:
-      directory_with_files (str): path to directory that holds files
+      directory_with_files (str): path to directory that holds files, or to a .pack file
 
     Returns:
       filepaths (list): a list of full file paths 
   """
+  if is_packed_corpus(directory_with_files):
+    return document_paths(directory_with_files)
 
   # get a list of file names in directory
   list_of_files = os.listdir(directory_with_files) 
@@ -60,35 +106,128 @@ def filePaths(directory_with_files):
 
   return filepaths
 
-# Compute how similar two files are as a percentage
-def similarity(file_1, file_2):
-    
-    file1_docs = []
+# Function to read the contents of a file
+def get_file_contents(filename):
+    """
+    Reads the contents of a file
+
+    Args:
+      filename (str): full path to file, or document path of an article in a packed corpus
+
+    Returns:
+      filecontent (str): contents of file 
+    """
+    with stage_profiler.stage("read"):
+        # articles in a packed corpus are sliced out of its memory map
+        if is_document_path(filename):
+            filecontent = read_document(filename)
+        else:
+            with open(filename, "r") as filehandle:
+                filecontent = filehandle.read()
+
+    if stage_profiler.enabled:
+        stage_profiler.count("bytes_read", len(filecontent.encode("utf-8")))
+    return filecontent
+
+# Split text into sentences and words, reusing the results of previous runs
+def sentence_words(text):
+    """
+    Splits text into sentences and each sentence into words. The result is kept in the NLP
+    cache, where tf_idf_document_similarity.py finds it too.
+
+    Args:
+      text (str): contents of a file
+
+    Returns:
+      sentences (list): a list of word lists, one for each sentence in the text
+    """
+    with stage_profiler.stage("tokenize"):
+        sentences = nlp_cache.cached(NLTK_TOKENS, text, lambda: [word_tokenize(line) for line in sent_tokenize(text)])
+
+    if stage_profiler.enabled:
+        stage_profiler.count("sentences", len(sentences))
+        stage_profiler.count("tokens", sum(len(words) for words in sentences))
+    return sentences
+
+# Split a file into sentences of lower case token IDs
+def encode_file(filename, vocabulary):
+    """
+    Splits a file into sentences and each sentence into the token IDs of its lower case words
+
+    Args:
+      filename (str): full path to file
+      vocabulary (vocabulary.Vocabulary): vocabulary the words are interned into
+
+    Returns:
+      sentences (list): a numpy.int32 array of token IDs for each sentence in the file
+    """
+    return encode_text(get_file_contents(filename), vocabulary)
+
+# Split text into sentences of lower case token IDs
+def encode_text(text, vocabulary):
+    """
+    Splits text into sentences of token IDs, see encode_file()
+
+    Args:
+      text (str): contents of a file
+      vocabulary (vocabulary.Vocabulary): vocabulary the words are interned into
+
+    Returns:
+      sentences (list): a numpy.int32 array of token IDs for each sentence in the text
+    """
+    sentences = vocabulary.intern_sentences(sentence_words(text))
+
+    return [vocabulary.normalize(ids, drop_stop_words=False) for ids in sentences]
+
+# Tokenize every file once
+def encode_files(files):
+    """
+    Splits every file into sentences of token IDs over one vocabulary
+
+    Args:
+      files (list): full paths to the files to compare
+
+    Returns:
+      encoded_files, ranks (tuple): the sentences of each file as returned by encode_file() and
+                                    the ranks of the tokens, from Vocabulary.ranks()
+    """
+    vocabulary = Vocabulary()
+    # the files are read ahead on other threads while the previous ones are tokenized
+    encoded_files = [encode_text(text, vocabulary) for text in prefetch.prefetch(files, get_file_contents, len)]
 
-    file2_docs = []
+    return encoded_files, vocabulary.ranks()
 
-    # open file and tokenize into Sentences
-    with open (file_1, "r") as f:
-        tokens = sent_tokenize(f.read())
-        for line in tokens:
-            file1_docs.append(line)
+# Build the TF-IDF model and similarity index of the sentences of a file
+def sentence_index(gen_docs, ranks):
+    """
+    Builds a dictionary, a TF-IDF model and a gensim Similarity index over the sentences of a file
 
-    # tokenize each sentence into words        
-    gen_docs = [[w.lower() for w in word_tokenize(text)] 
-                for text in file1_docs]
+    Args:
+      gen_docs (list): token ID arrays of the sentences of the file whose sentences are queried
+      ranks (list): ranks of the tokens in string order, from Vocabulary.ranks()
+
+    Returns:
+      dictionary, tf_idf, sims (tuple): the dictionary of the words of the file, the TF-IDF model
+                                        and the similarity index of its sentences
+    """
+    # gensim takes a while to import, so it is only imported once it is needed
+    import gensim
 
-    # create a dictionary - each word will be given a unique Index
-    dictionary = gensim.corpora.Dictionary(gen_docs)
+    with stage_profiler.stage("dictionary"):
+        # create a dictionary - each word will be given a unique Index, in the same order
+        # gensim.corpora.Dictionary gives them to the words
+        dictionary = LocalDictionary(ranks, gen_docs)
 
-    # Create a Bag of Words - this is an object that contains the word ID and its frequency in each document.
-    # Document can refer to a sentence or paragraph
-    # Corpus is typically a 'collection of documents as a bag of words'
-    corpus = [dictionary.doc2bow(gen_doc) for gen_doc in gen_docs]
+        # Create a Bag of Words - this is an object that contains the word ID and its frequency in each document.
+        # Document can refer to a sentence or paragraph
+        # Corpus is typically a 'collection of documents as a bag of words'
+        corpus = [dictionary.doc2bow(gen_doc) for gen_doc in gen_docs]
 
-    # TF-IDF (Term Frequency - Inverse Document Frequency) --> is also a bag of words, however it 
-    # calculates the weight of words that appear frequently across documents. Words that appear more 
-    # frequently across a document get smaller weights.
-    tf_idf = gensim.models.TfidfModel(corpus)
+    with stage_profiler.stage("tfidf"):
+        # TF-IDF (Term Frequency - Inverse Document Frequency) --> is also a bag of words, however it 
+        # calculates the weight of words that appear frequently across documents. Words that appear more 
+        # frequently across a document get smaller weights.
+        tf_idf = gensim.models.TfidfModel(corpus)
 
     # make sure you do not have another folder/directory named "sims-workdir" in your workspace
     temp_directory = "sims-workdir/"
@@ -99,60 +238,263 @@ def similarity(file_1, file_2):
 
     # Create a Similarity measure object --> The Similarity class builds an index for a given set of 
     # documents. The Similarity class splits the index into several smaller sub-indexes, which are 
-    # disk-based.
-    sims = gensim.similarities.Similarity(temp_directory, tf_idf[corpus],
-                                        num_features=len(dictionary))
-
-    # open second file/document and tokenize
-    with open (file_2, "r") as f:
-        tokens = sent_tokenize(f.read())
-        for line in tokens:
-            file2_docs.append(line)
-            
-    for line in file2_docs:
-        # tokenize each word in a sentence
-        query_doc = [w.lower() for w in word_tokenize(line)]
-        # update the existing dictionary and create Bag of Words
+    # disk-based. The shards are prefixed with the process ID so parallel workers do not share them.
+    with stage_profiler.stage("similarity_index"):
+        sims = gensim.similarities.Similarity(os.path.join(temp_directory, str(os.getpid())), tf_idf[corpus],
+                                            num_features=len(dictionary))
+
+    return dictionary, tf_idf, sims
+
+# Count the bytes of the shards of a similarity index written to disk
+def count_shard_bytes(sims):
+    """
+    Adds the size of the shards of a similarity index to the profiler counters. The shards are
+    written to disk on the first query.
+
+    Args:
+      sims (gensim.similarities.Similarity): the queried index
+    """
+    if stage_profiler.enabled:
+        stage_profiler.count("shard_bytes_written", sum(os.path.getsize(shard.fullname()) for shard in sims.shards
+                                                        if os.path.exists(shard.fullname())))
+
+# Compute how similar two files are as a percentage
+def similarity(file_1, file_2):
+    vocabulary = Vocabulary()
+    file1_docs, file2_docs = encode_file(file_1, vocabulary), encode_file(file_2, vocabulary)
+
+    return encoded_similarity(file1_docs, file2_docs, vocabulary.ranks())
+
+# Compute how similar two tokenized files are as a percentage
+def encoded_similarity(file1_docs, file2_docs, ranks):
+    """
+    Queries the last sentence of the second file against the sentences of the first file
+
+    Args:
+      file1_docs (list): token ID arrays of the sentences of the first file, from encode_file()
+      file2_docs (list): token ID arrays of the sentences of the second file
+      ranks (list): ranks of the tokens in string order, from Vocabulary.ranks()
+
+    Returns:
+      percentage_of_similarity (int): average similarity of the query to the sentences of the
+                                      first file, as a percentage
+    """
+    dictionary, tf_idf, sims = sentence_index(file1_docs, ranks)
+
+    for query_doc in file2_docs:
+        # create the Bag of Words of the sentence, leaving out the words file_1 does not have
         query_doc_bow = dictionary.doc2bow(query_doc)
     
-    # perform a similarity query (file_2) against the corpus (created from file_1)
-    query_doc_tf_idf = tf_idf[query_doc_bow]
-    
-    # compute average of the similarities
-    average_similarity_index = sum(sims[query_doc_tf_idf]) / len(sims[query_doc_tf_idf])
+    with stage_profiler.stage("query"):
+        # perform a similarity query (file_2) against the corpus (created from file_1)
+        query_doc_tf_idf = tf_idf[query_doc_bow]
+
+        # compute average of the similarities
+        average_similarity_index = sum(sims[query_doc_tf_idf]) / len(sims[query_doc_tf_idf])
+
+    count_shard_bytes(sims)
     
     # convert similarity to a percentage
     percentage_of_similarity = round(average_similarity_index * 100)
     
     return percentage_of_similarity
-     
-def main(directory, csv_filename):
 
-    d = []
+# Compute how similar two files are, sentence by sentence
+def sentence_similarity(file_1, file_2):
+    """
+    Tokenizes two files and compares them with encoded_sentence_similarity()
+
+    Args:
+      file_1 (str): full path to the file whose sentences are indexed
+      file_2 (str): full path to the file whose sentences are queried
+
+    Returns:
+      percentage_of_similarity, alignments (tuple): see encoded_sentence_similarity()
+    """
+    vocabulary = Vocabulary()
+    file1_docs, file2_docs = encode_file(file_1, vocabulary), encode_file(file_2, vocabulary)
+
+    return encoded_sentence_similarity(file1_docs, file2_docs, vocabulary.ranks())
+
+# Compute how similar two tokenized files are, sentence by sentence
+def encoded_sentence_similarity(file1_docs, file2_docs, ranks):
+    """
+    Queries every sentence of file_2 against the sentences of file_1 in one batched query, which
+    gives the (file_2 sentences x file_1 sentences) block of sentence similarities, and aligns each
+    sentence of file_2 with its best matching sentence of file_1.
+
+    Args:
+      file1_docs (list): token ID arrays of the sentences of the file that is indexed, from encode_file()
+      file2_docs (list): token ID arrays of the sentences of the file that is queried
+      ranks (list): ranks of the tokens in string order, from Vocabulary.ranks()
+
+    Returns:
+      percentage_of_similarity (int): average similarity of the sentences of file_2 to their best
+                                      matching sentence of file_1, as a percentage
+      alignments (numpy.ndarray): (file_2 sentences x 2) array with the index of the best matching
+                                  sentence of file_1 and its similarity as a percentage, for each
+                                  sentence of file_2
+    """
+    if len(file2_docs) == 0:
+        return 0, np.zeros((0, 2), dtype=np.int64)
+
+    dictionary, tf_idf, sims = sentence_index(file1_docs, ranks)
+    if len(sims) == 0:
+        return 0, np.zeros((0, 2), dtype=np.int64)
+
+    with stage_profiler.stage("query"):
+        # the TF-IDF vectors of all the sentences of file_2, queried as one corpus
+        query_corpus = [tf_idf[dictionary.doc2bow(query_doc)] for query_doc in file2_docs]
+        block = np.asarray(sims[query_corpus], dtype=np.float32).reshape(len(query_corpus), len(sims))
+    stage_profiler.count("queries", len(query_corpus))
+
+    count_shard_bytes(sims)
+
+    best_sentences = block.argmax(axis=1)
+    best_scores = np.minimum(block.max(axis=1), 1)
+    best_percentages = np.rint(best_scores * 100).astype(np.int64)
+
+    # round the average and convert it to a percentage
+    percentage_of_similarity = round(float(best_scores.mean()) * 100)
+
+    return percentage_of_similarity, np.stack([best_sentences, best_percentages], axis=1)
+
+# Score pairs of files, used by the worker processes
+def score_pairs(data, pairs):
+    """
+    Scores pairs of files with encoded_similarity()
+
+    Args:
+      data (tuple): the tokenized files and the ranks of the tokens, as returned by encode_files()
+      pairs (numpy.ndarray): (pairs x 2) array of file indices
+
+    Returns:
+      percentages (list): similarity of each pair as a percentage
+    """
+    encoded_files, ranks = data
+    return [encoded_similarity(encoded_files[idx], encoded_files[jdx], ranks) for idx, jdx in pairs]
+
+# Score pairs of files sentence by sentence, used by the worker processes
+def score_pairs_sentences(data, pairs):
+    """
+    Scores pairs of files with encoded_sentence_similarity()
+
+    Args:
+      data (tuple): the tokenized files and the ranks of the tokens, as returned by encode_files()
+      pairs (numpy.ndarray): (pairs x 2) array of file indices
+
+    Returns:
+      results (list): (percentage, alignments) of each pair, as returned by encoded_sentence_similarity()
+    """
+    encoded_files, ranks = data
+    return [encoded_sentence_similarity(encoded_files[idx], encoded_files[jdx], ranks) for idx, jdx in pairs]
+
+# Write the sentence alignments of pairs of files
+def write_alignments(writer, files, pairs, results, threshold):
+    """
+    Writes the sentences of file_2 whose best matching sentence of file_1 is at least as similar
+    as the threshold
+
+    Args:
+      writer (csv.writer): writer of the alignments file
+      files (list): full paths to the files
+      pairs (numpy.ndarray): (pairs x 2) array of file indices
+      results (list): (percentage, alignments) of each pair, as returned by sentence_similarity()
+      threshold (int): least similarity (%) of the alignments to write
+    """
+    for (idx, jdx), (_, alignments) in zip(pairs, results):
+        for sentence_2, (sentence_1, percentage) in enumerate(alignments.tolist()):
+            if percentage >= threshold:
+                writer.writerow([files[idx], files[jdx], sentence_2, sentence_1, percentage])
+
+def main(directory, csv_filename, workers=1, output_format="csv", min_similarity=None, mode="last-sentence",
+         max_files=None, alignments_filename=None, alignment_threshold=50, shard=None):
+
     files = []
 
     # List containing full paths to our files to compare
     files = filePaths(directory)
+    if shard is not None:
+        # every machine of a sharded run must number the files the same way
+        files = sorted(files)
+    if max_files is not None:
+        files = files[:max_files]
+    stage_profiler.count("documents", len(files))
 
-    # Loop through all files and compare each file to every other file
-    for idx, file_1 in enumerate(files[:10]):
-        for file_2 in files[idx + 1: 10]:  
-            # compute similarity
-            similarity_percentage = similarity(file_1, file_2)
-            # append data to a List of dictionaries
-            d.append({"File_1": file_1, "File_2": file_2, "Similarity (%)": similarity_percentage})
+    # Tokenize every file once into arrays of token IDs over one vocabulary
+    data = encode_files(files)
+    encoded_files, ranks = data
 
-    # Create a temporary Pandas DataFrame from our List of dictionaries
-    temp_dataframe = pd.DataFrame(d)
+    # A shard only scores its range of the pair index space
+    pair_range = None
+    if shard is not None:
+        pair_range = shard_range(len(files), *shard)
+        sink = open_shard(csv_filename, files, shard, min_similarity)
+    else:
+        # Write the results to disk as the pairs are scored
+        sink = ResultSink(csv_filename, files, output_format, min_similarity)
 
-    # save DataFrame to CSV file
-    temp_dataframe.to_csv(f"{csv_filename}.csv")
+    with stage_profiler.stage("score"):
+        if mode == "sentences":
+            alignments_file = open(f"{alignments_filename}.csv", "w", newline="") if alignments_filename else None
+            if alignments_file is not None:
+                alignments_writer = csv.writer(alignments_file, lineterminator=os.linesep)
+                alignments_writer.writerow(ALIGNMENT_COLUMNS)
+
+            # compute similarity, in chunks of pairs returned in order
+            for chunk_pairs, results in run_pair_chunks(score_pairs_sentences, data, len(files), None, workers,
+                                                         pair_range=pair_range):
+                sink.write(chunk_pairs[:, 0], chunk_pairs[:, 1], [percentage for percentage, _ in results])
+                if alignments_file is not None:
+                    write_alignments(alignments_writer, files, chunk_pairs, results, alignment_threshold)
+
+            if alignments_file is not None:
+                alignments_file.close()
+        elif workers > 1 or shard is not None:
+            # compute similarity with worker processes, in chunks of pairs returned in order
+            for chunk_pairs, percentages in run_pair_chunks(score_pairs, data, len(files), None, workers,
+                                                            pair_range=pair_range):
+                sink.write(chunk_pairs[:, 0], chunk_pairs[:, 1], percentages)
+        else:
+            # Loop through all files and compare each file to every other file
+            for idx in range(len(files)):
+                for jdx in range(idx + 1, len(files)):
+                    # compute similarity
+                    similarity_percentage = encoded_similarity(encoded_files[idx], encoded_files[jdx], ranks)
+                    sink.write([idx], [jdx], [similarity_percentage])
+
+    sink.close()
+    if shard is not None:
+        write_manifest(csv_filename, f"check_document-{mode}", files, shard, sink.rows, min_similarity)
 
 if __name__ == "__main__":
 
+    args = parser.parse_args()
+
+    if args.alignments is not None and args.mode != "sentences":
+        parser.error("--alignments writes the sentence alignments of --mode sentences, add --mode sentences")
+
+    if args.shard is not None and (args.alignments is not None or args.output_format != "csv"):
+        parser.error("--shard writes csv results for a range of pairs, it cannot be combined with --alignments or --format")
+
+    if args.output_format == "npz" and args.min_similarity is None:
+        parser.error("--format npz holds every written pair in memory until the end of the run, it needs --min-similarity")
+
+    prefetch.configure(args.read_threads, args.read_ahead)
+
+    if args.cache_dir is not None:
+        nlp_cache.configure(args.cache_dir, args.cache_size)
+
+    if args.profile is not None:
+        stage_profiler.configure(args.profile, args.profile_format, args.profile_sample)
+
     # get the directory and filename values
     directory = args.directory
     csv_filename = args.filename
     
     # call the main() function
-    main(directory, csv_filename)
+    main(directory, csv_filename, args.workers, args.output_format, args.min_similarity, args.mode,
+         args.max_files, args.alignments, args.alignment_threshold, args.shard)
+
+    # keep the NLP cache within its size limit
+    nlp_cache.evict()
@@ -11,36 +11,126 @@ has been granted bail etc. However, the amount of detail in the written story re
 which makes it harder to tell how similar the current version is to the original article since the the common
 words get fewer and fewer. For such a scenario a lower cut-off point is important.
 
+Common words miss rewordings such as "robbed" and "stole from" in follow-up court reports. With --semantic
+the script also writes <filename>_semantic with the cosine similarity of the averaged word vectors of the
+two articles, for the same pairs, so the two signals can be compared.
+
 Tip: Ideally you do not want to run more than 100 files at once. It's best to experiment with a few files
-first depending on memory resources on your computer.
+first depending on memory resources on your computer. For large archives, --memory-limit scores the pairs in
+tiles that fit in the given memory (see tiled_pairs.py).
 """
 
-from typing import List
+from typing import List, Tuple
+from functools import lru_cache
 import argparse
-import spacy
 import os
-import pandas as pd
+import numpy as np
+from scipy import sparse
+from minhash_lsh import MAX_BUCKET_SIZE, lsh_candidate_pairs, sample_recall
+from corpus_index import load_index, save_index, new_files, incremental_pairs
+import nlp_cache
+import stage_profiler
+from pair_scheduler import run_pair_chunks
+from result_sink import ResultSink
+from tiled_pairs import parse_memory, tiled_sink, run_tiles
+from pair_shards import parse_shard, shard_range, shard_pairs, open_shard, write_manifest
+from packed_corpus import is_packed_corpus, is_document_path, document_paths, read_document
+from vocabulary import Vocabulary
+import prefetch
 
 # Create an argument parser
 parser = argparse.ArgumentParser()
 
 # Add the positional arguments
-parser.add_argument("directory", help="path to directory with files to compare")
+parser.add_argument("directory", help="path to directory with files to compare, or to a packed corpus (.pack file) or article store (.articles.parquet file)")
 parser.add_argument("filename", help="name of csv file (without .csv extension) to use for the similarity indices")
 
-args = parser.parse_args()
+# Add the optional arguments
+parser.add_argument("--pipeline", choices=["fast", "full"], default="fast",
+                    help="'fast' loads only the spaCy components the lemmas depend on, 'full' also loads the parser and NER")
+parser.add_argument("--batch-size", type=int, default=64, help="number of articles spaCy processes per batch")
+parser.add_argument("--n-process", type=int, default=1, help="number of processes spaCy uses to preprocess the articles")
+parser.add_argument("--engine", choices=["sparse", "pairwise"], default="sparse",
+                    help="'sparse' scores all pairs with one sparse matrix product, 'pairwise' compares one pair at a time")
+parser.add_argument("--candidates", choices=["all", "lsh"], default="all",
+                    help="'all' scores every pair of files, 'lsh' only scores the pairs found by MinHash/LSH")
+parser.add_argument("--lsh-threshold", type=float, default=0.3,
+                    help="Jaccard similarity of the lemma sets used to choose the LSH bands and rows")
+parser.add_argument("--num-perm", type=int, default=128, help="length of the MinHash signatures")
+parser.add_argument("--bands", type=int, help="number of LSH bands (overrides --lsh-threshold together with --rows)")
+parser.add_argument("--rows", type=int, help="number of rows in each LSH band")
+parser.add_argument("--max-bucket", type=int, default=MAX_BUCKET_SIZE,
+                    help="LSH buckets with more files only pair the files with identical signatures")
+parser.add_argument("--recall-sample", type=int, default=0,
+                    help="number of files to sample to report the LSH recall against scoring every pair")
+parser.add_argument("--cutoff", type=int, default=40, help="similarity (%%) used as the cut-off when reporting the LSH recall")
+parser.add_argument("--index", dest="index_directory",
+                    help="directory of a persisted corpus index. Only files that are not in the index are compared "
+                         "(to each other and to the indexed files) and the results are appended to the CSV file")
+parser.add_argument("--read-threads", type=int, default=8,
+                    help="number of threads reading the files ahead of the lemmatizer (0 reads them one at a time)")
+parser.add_argument("--read-ahead", type=int, default=64, help="number of files read ahead of the lemmatizer")
+parser.add_argument("--cache-dir", help="directory of the NLP cache shared by the similarity scripts (disabled if not given)")
+parser.add_argument("--cache-size", type=float, default=1024, help="size limit of the NLP cache in megabytes")
+parser.add_argument("--shard", type=parse_shard, metavar="I/N",
+                    help="only score the I-th of N ranges of the pairs (1 <= I <= N), for runs split over N machines. "
+                         "Writes FILENAME.shard-I-of-N.csv and a manifest, merged with pair_shards.py merge")
+parser.add_argument("--workers", type=int, default=1, help="number of processes used to score the pairs of files")
+parser.add_argument("--format", dest="output_format", choices=["csv", "parquet", "npz"], default="csv",
+                    help="format of the results file (the filename argument is used without its extension). npz needs --min-similarity")
+parser.add_argument("--min-similarity", type=int, help="only write pairs with at least this similarity (%%)")
+parser.add_argument("--memory-limit", type=parse_memory, metavar="SIZE",
+                    help="score every pair in tiles that fit in SIZE (e.g. 512M, 4G) instead of all at once. "
+                         "An interrupted run with csv output resumes from its last tile")
+parser.add_argument("--semantic", action="store_true",
+                    help="also write the cosine similarity (%%) of the averaged word vectors of the same pairs to <filename>_semantic")
+parser.add_argument("--vector-dtype", choices=["float32", "float16"], default="float32",
+                    help="type the document vectors are kept in, float16 halves their memory")
+parser.add_argument("--profile", metavar="FILE", help="write the time spent in each stage and the counters of the run to FILE")
+parser.add_argument("--profile-format", choices=["json", "chrome"], default="json",
+                    help="'json' for the totals of each stage, 'chrome' for a Chrome trace of every stage call")
+parser.add_argument("--profile-sample", type=float, default=0, metavar="HZ",
+                    help="also sample the Python stack HZ times per second of CPU time, written to FILE.folded")
+
+# spaCy components that do not change the lemmas: the dependency parser only sets heads, labels and
+# sentence boundaries, and NER only sets entities. The tagger and the attribute ruler set the POS tags
+# the rule-based lemmatizer uses, and the tagger reads the word vectors, so those are all kept
+FAST_EXCLUDE = ["parser", "ner"]
+
+# number of document vectors multiplied at a time by the semantic scorer
+SEMANTIC_BLOCK_ROWS = 1024
+
+# Function to load the spaCy pipeline
+def load_pipeline(model: str = "en_core_web_lg", fast: bool = True):
+    """
+    Loads the spaCy pipeline used to lemmatize the articles
+
+    Args:
+        model (str): name of, or path to, the spaCy pipeline package
+        fast (bool): leave out the components that do not change the lemmas (FAST_EXCLUDE)
+
+    Returns:
+        nlp (spacy.language.Language): the loaded pipeline
+    """
+    # spaCy takes a while to import, so it is only imported once it is needed
+    import spacy
+
+    return spacy.load(model, exclude=FAST_EXCLUDE if fast else [])
 
 # Get full file paths
 def filePaths(directory_with_files: str) -> List[str]:
   """
-  Gets the full path of each file in a directory
+  Gets the full path of each file in a directory, or the document path of each article
+  in a packed corpus (see packed_corpus.py)
 
     Args:
-      directory_with_files (str): path to directory that holds files
+      directory_with_files (str): path to directory that holds files, or to a .pack file
 
     Returns:
       filepaths (list): a list of full file paths 
   """
+  if is_packed_corpus(directory_with_files):
+    return document_paths(directory_with_files)
 
   # get a list of file names in directory
   list_of_files = os.listdir(directory_with_files) 
@@ -56,15 +146,78 @@ def get_file_contents(filename: str) -> str:
     Reads the contents of a file
 
     Args:
-      filename (str): full path to file
+      filename (str): full path to file, or document path of an article in a packed corpus
 
     Returns:
       filecontent (str): contents of file 
     """
-    with open(filename, 'r') as filehandle:
-        filecontent = filehandle.read()
+    with stage_profiler.stage("read"):
+        # articles in a packed corpus are sliced out of its memory map
+        if is_document_path(filename):
+            filecontent = read_document(filename)
+        else:
+            with open(filename, 'r') as filehandle:
+                filecontent = filehandle.read()
+
+    if stage_profiler.enabled:
+        stage_profiler.count("bytes_read", len(filecontent.encode("utf-8")))
     return filecontent
 
+# Function to decide whether a token is kept
+def keep_token(token) -> bool:
+    """
+    Decides whether a token is a word that is compared, i.e. not a stop word, punctuation,
+    a pronoun or an empty token
+
+    Args:
+        token (spacy.tokens.Token): token produced by the spaCy pipeline
+
+    Returns:
+        keep (bool): True if the token is kept
+    """
+    if token.text in nlp_lg.Defaults.stop_words:
+        return False
+    if token.is_punct:
+        return False
+    if token.lemma_ == '-PRON-':
+        return False
+    if token.text == " ":
+        return False
+    return True
+
+# Function to remove stop words, punctuation and pronouns from a processed document
+def filter_tokens(doc) -> List[str]:
+    """
+    Removes stop words, punctuation, pronouns and empty tokens from a spaCy document
+
+    Args:
+        doc (spacy.tokens.Doc): document produced by the spaCy pipeline
+
+    Returns:
+        result (list): lemmas of the tokens that were kept
+    """
+    return [token.lemma_ for token in doc if keep_token(token)]
+
+# Function to compute the meaning of a document as one vector
+def document_vector(doc) -> np.ndarray:
+    """
+    Averages the word vectors of the tokens kept by filter_tokens() and scales the average to
+    unit length, so that the dot product of two document vectors is their cosine similarity
+
+    Args:
+        doc (spacy.tokens.Doc): document produced by the spaCy pipeline
+
+    Returns:
+        vector (numpy.ndarray): float32 vector, all zeros if no kept token has a word vector
+    """
+    vectors = [token.vector for token in doc if token.has_vector and keep_token(token)]
+    if not vectors:
+        return np.zeros(nlp_lg.vocab.vectors_length, dtype=np.float32)
+
+    vector = np.mean(vectors, axis=0, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
 # Function to remove stop words, punctuation and pronouns
 def process_text(text: str) -> str:
     """
@@ -76,47 +229,137 @@ def process_text(text: str) -> str:
     Returns:
         String of tokens with stop words, punctuation, pronouns and empty tokens removed
     """
-    doc = nlp_lg(text.lower())
-    result = []
-    for token in doc:
-        if token.text in nlp_lg.Defaults.stop_words:
-            continue
-        if token.is_punct:
-            continue
-        if token.lemma_ == '-PRON-':
-            continue
-        if token.text == " ":
-            continue
-        result.append(token.lemma_)
-    return " ".join(result)
+    return " ".join(filter_tokens(nlp_lg(text.lower())))
+
+# Function to turn processed text into the terms used to compare documents
+def get_terms(processed_text: str) -> List[str]:
+    """
+    Removes duplicate words from processed text and splits it into terms
+
+    Args:
+        processed_text (str): string returned by process_text()
+
+    Returns:
+        terms (list): the words used when comparing this document to other documents
+    """
+    # remove duplicate words from string
+    unique_words = dict.fromkeys(processed_text.split())
+
+    # tokenize the words, which gives the same tokens as the full pipeline
+    terms = [term for word in unique_words for term in word_terms(nlp_lg.tokenizer, word)]
+
+    return terms
+
+# Function to split a lemma into terms
+@lru_cache(maxsize=1 << 16)
+def word_terms(tokenizer, word: str) -> Tuple[str, ...]:
+    """
+    Tokenizes a single lemma. The spaCy tokenizer splits text on spaces first and splits each
+    word on its own, so tokenizing the words of a text one at a time gives the same tokens as
+    tokenizing the whole text. Almost every lemma is a single token, and the same lemmas come
+    up in every article, so each is only tokenized once.
+
+    Args:
+        tokenizer (spacy.tokenizer.Tokenizer): tokenizer of the spaCy pipeline
+        word (str): lemma without spaces
+
+    Returns:
+        terms (tuple): the tokens of the lemma
+    """
+    return tuple(token.text for token in tokenizer(word))
+
+# Function to turn the text of one article into its terms
+def text_terms(text: str) -> List[str]:
+    """
+    Lemmatizes and filters the text of one article, the same way preprocess_documents()
+    processes the contents of a file
+
+    Args:
+        text (str): text of the article
+
+    Returns:
+        terms (list): the words used when comparing this article to other documents
+    """
+    return get_terms(" ".join(filter_tokens(nlp_lg(text.replace("\n", " ").lower()))))
+
+# Function to lemmatize and filter every file exactly once
+def preprocess_documents(files: List[str], batch_size: int = 64, n_process: int = 1, vectors: bool = False):
+    """
+    Runs every file through the spaCy pipeline once, using nlp.pipe to process the
+    files in batches, and keeps the terms of each document in memory. Files whose terms
+    are in the NLP cache (see nlp_cache.py) are not processed again.
+
+    Args:
+        files (list): full paths to the newspaper articles
+        batch_size (int): number of articles spaCy processes per batch
+        n_process (int): number of processes spaCy uses
+        vectors (bool): also compute the document vector of each file in the same pass
+
+    Returns:
+        documents (list): the terms of each file, in the same order as files
+        document_vectors (list): the vector of each file (see document_vector()), only returned
+                                 if vectors is True
+    """
+    import spacy
+
+    documents = [None] * len(files)
+    document_vectors = [None] * len(files)
+
+    # the terms depend on the spaCy version and on the model used to lemmatize
+    namespace = nlp_cache.cache_namespace("spacy-terms", spacy.__version__,
+                                          nlp_lg.meta["name"], nlp_lg.meta["version"])
+    vector_namespace = nlp_cache.cache_namespace("spacy-vectors", spacy.__version__,
+                                                 nlp_lg.meta["name"], nlp_lg.meta["version"])
+
+    # Reads a file and looks it up in the cache, on the reader threads of prefetch.py
+    def load(filename):
+        text = get_file_contents(filename)
+        key = nlp_cache.cache_key(namespace, text)
+        vector_key = nlp_cache.cache_key(vector_namespace, text) if vectors else None
+        terms = nlp_cache.cache_get(key)
+        vector = nlp_cache.cache_get(vector_key) if vectors else None
+        return text, key, vector_key, terms, vector
+
+    # Generator so that only the files read ahead and the current batch of file contents are held
+    # in memory. Files found in the cache are filled in directly and never reach the pipeline
+    def uncached_texts():
+        loaded = prefetch.prefetch(files, load, lambda result: len(result[0]))
+        for idx, (text, key, vector_key, terms, vector) in enumerate(loaded):
+            if terms is not None and (vector is not None or not vectors):
+                documents[idx] = terms
+                document_vectors[idx] = vector
+                continue
+            yield text.replace("\n", " ").lower(), (idx, key, vector_key)
+
+    with stage_profiler.stage("preprocess"):
+        for doc, (idx, key, vector_key) in nlp_lg.pipe(uncached_texts(), as_tuples=True, batch_size=batch_size,
+                                                       n_process=n_process):
+            documents[idx] = get_terms(" ".join(filter_tokens(doc)))
+            nlp_cache.cache_put(key, documents[idx])
+            if vectors:
+                document_vectors[idx] = document_vector(doc)
+                nlp_cache.cache_put(vector_key, document_vectors[idx])
+            stage_profiler.count("tokens", len(doc))
+
+    if vectors:
+        return documents, document_vectors
+    return documents
 
 # Function to compute the Similarity between two documents as a percentage
-def similarity(file_1: str, file_2: str)-> int:
+def similarity(doc1: np.ndarray, doc2: np.ndarray)-> int:
     """
     Computes how similar two newspaper articles are. The similarity is calculated based on the
     common words that appear in both articles. This is after the removal of stop words, punctuation, 
     empty spaces and pronouns.
 
     Args:
-        file_1 (str): full path to first newspaper article
-        file_2 (str): full path to second article to compare with
+        doc1 (numpy.ndarray): term IDs of the first newspaper article (see main())
+        doc2 (numpy.ndarray): term IDs of the second article to compare with
 
     Returns:
         similarity_as_percentage (int): Percentage of how similar two articles are
     """
 
-    # Get file contents, then remove stop words, punctuation & pronouns
-    file1_contents = process_text(get_file_contents(file_1).replace("\n", " "))
-    file2_contents = process_text(get_file_contents(file_2).replace("\n", " "))
-
-    # remove duplicate words from string
-    file1_contents = ' '.join(dict.fromkeys(file1_contents.split()))
-    file2_contents = ' '.join(dict.fromkeys(file2_contents.split()))
-
-    # create document objects, which contain the tokenized words
-    doc1 = nlp_lg(file1_contents)
-    doc2 = nlp_lg(file2_contents)
-
     ### Uncomment the following line if you want to see the words in file_1 used in computing the similarity
     #print(doc1)
 
@@ -125,12 +368,12 @@ def similarity(file_1: str, file_2: str)-> int:
     ### Uncomment the following line if you want to see the words in file_2 used in computing the similarity
     #print(doc2)
 
-    # Count how many times the tokens in file_1 appear in file_2
-    count = 0
-    for t1 in doc1:
-        for t2 in doc2:
-            if t1.text == t2.text:
-                count += 1
+    # Count how many times the tokens in file_1 appear in file_2, by looking each term ID of
+    # file_1 up in the sorted term IDs of file_2
+    doc2_terms, doc2_counts = np.unique(doc2, return_counts=True)
+    positions = np.minimum(np.searchsorted(doc2_terms, doc1), max(len(doc2_terms) - 1, 0))
+    found = doc2_terms[positions] == doc1 if len(doc2_terms) else np.zeros(len(doc1), dtype=bool)
+    count = int(doc2_counts[positions[found]].sum())
 
     sim = 0
     # to avoid division by zero
@@ -143,39 +386,440 @@ def similarity(file_1: str, file_2: str)-> int:
 
     return similarity_as_percentage
 
-def main(directory, csv_filename):
+# Function to build a document-term matrix from the terms of each document
+def document_term_matrix(documents: List[np.ndarray], n_terms: int) -> sparse.csr_matrix:
+    """
+    Places the terms of all documents into one sparse document-term matrix. Each row is a
+    document, each column a term and each value the number of times the term appears in the
+    document (1 for the deduplicated terms returned by preprocess_documents()).
+
+    Args:
+        documents (list): the term IDs of each document
+        n_terms (int): number of terms in the vocabulary of the term IDs
+
+    Returns:
+        matrix (scipy.sparse.csr_matrix): a (documents x terms) matrix
+    """
+    # the term IDs are the column indices
+    lengths = [len(terms) for terms in documents]
+    rows = np.repeat(np.arange(len(documents)), lengths)
+    columns = np.concatenate(documents) if documents else np.zeros(0, dtype=np.int32)
+
+    values = np.ones(len(rows), dtype=np.int32)
+
+    # duplicate (row, column) entries are summed when converting to CSR
+    matrix = sparse.coo_matrix((values, (rows, columns)),
+                               shape=(len(documents), n_terms)).tocsr()
+
+    return matrix
+
+# Function to compute the similarity of one document to all other documents as percentages
+def similarity_row(common_words: sparse.csr_matrix, lengths: np.ndarray, idx: int) -> np.ndarray:
+    """
+    Converts a row of common word counts into the same percentages as similarity(), i.e. the
+    number of common words divided by the number of words in the second document.
+
+    Args:
+        common_words (scipy.sparse.csr_matrix): (documents x documents) matrix of common word counts
+        lengths (numpy.ndarray): number of words in each document
+        idx (int): index of the first document
+
+    Returns:
+        percentages (numpy.ndarray): similarity of document idx to every document as a percentage
+    """
+    counts = common_words[idx].toarray().ravel()
+
+    return to_percentages(counts, lengths)
+
+# Function to compute the similarity of selected pairs of documents as percentages
+def pair_similarities(matrix: sparse.csr_matrix, lengths: np.ndarray, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """
+    Computes the similarity of the pairs (first[k], second[k]) without computing the common
+    word counts of every pair of documents
+
+    Args:
+        matrix (scipy.sparse.csr_matrix): document-term matrix returned by document_term_matrix()
+        lengths (numpy.ndarray): number of words in each document
+        first (numpy.ndarray): indices of the first document of each pair
+        second (numpy.ndarray): indices of the second document of each pair
+
+    Returns:
+        percentages (numpy.ndarray): similarity of each pair as a percentage
+    """
+    # the common word count of a pair is the dot product of the two rows
+    counts = np.asarray(matrix[first].multiply(matrix[second]).sum(axis=1)).ravel()
+
+    return to_percentages(counts, lengths[second])
+
+# Function to compute the similarities of a tile of pairs of documents
+def score_tile_sparse(data, rows: slice, columns: slice) -> np.ndarray:
+    """
+    Computes the similarity of the documents of a block of rows to the documents of a block of
+    columns, used by the tiled executor (see tiled_pairs.py)
+
+    Args:
+        data (tuple): the document-term matrix and the number of terms in each document
+        rows (slice): indices of the first documents of the pairs
+        columns (slice): indices of the second documents of the pairs
+
+    Returns:
+        percentages (numpy.ndarray): (rows x columns) similarities as percentages
+    """
+    matrix, lengths = data
+    counts = (matrix[rows] @ matrix[columns].T).toarray()
+    return to_percentages(counts, lengths[columns])
+
+# Function used by the worker processes to score pairs with the sparse engine
+def score_pairs_sparse(data, pairs: np.ndarray) -> np.ndarray:
+    """
+    Scores pairs of documents with pair_similarities()
+
+    Args:
+        data (tuple): the document-term matrix and the number of words in each document
+        pairs (numpy.ndarray): (pairs x 2) array of document indices
+
+    Returns:
+        percentages (numpy.ndarray): similarity of each pair as a percentage
+    """
+    matrix, lengths = data
+    return pair_similarities(matrix, lengths, pairs[:, 0], pairs[:, 1])
+
+# Function used by the worker processes to score pairs with the pairwise engine
+def score_pairs_pairwise(documents: List[np.ndarray], pairs: np.ndarray) -> List[int]:
+    """
+    Scores pairs of documents with similarity()
+
+    Args:
+        documents (list): the term IDs of each document
+        pairs (numpy.ndarray): (pairs x 2) array of document indices
+
+    Returns:
+        percentages (list): similarity of each pair as a percentage
+    """
+    return [similarity(documents[idx], documents[jdx]) for idx, jdx in pairs]
+
+# Function to convert common word counts into percentages
+def to_percentages(counts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Divides common word counts by the number of words in the second document and converts
+    the result to a percentage the same way as similarity()
+
+    Args:
+        counts (numpy.ndarray): number of common words
+        lengths (numpy.ndarray): number of words in the second document, broadcast against counts
+
+    Returns:
+        percentages (numpy.ndarray): the similarities as percentages
+    """
+    # to avoid division by zero
+    sim = np.zeros(np.broadcast(counts, lengths).shape, dtype=np.float64)
+    np.divide(counts, lengths, out=sim, where=lengths != 0)
+
+    # np.rint rounds halves to even, the same as round()
+    percentages = np.rint(sim * 100).astype(np.int64)
+
+    return percentages
+
+# Function to place the document vectors into one matrix
+def vector_matrix(document_vectors: List[np.ndarray], dtype: str = "float32") -> np.ndarray:
+    """
+    Stacks the document vectors into one (documents x dimensions) matrix
+
+    Args:
+        document_vectors (list): the vector of each document, as returned by document_vector()
+        dtype (str): 'float32', or 'float16' to halve the memory of the matrix
+
+    Returns:
+        vectors (numpy.ndarray): the vectors, one row per document. Documents without a vector
+                                 get a row of zeros
+    """
+    width = max((len(vector) for vector in document_vectors), default=0)
+    vectors = np.zeros((len(document_vectors), width), dtype=dtype)
+    for row, vector in enumerate(document_vectors):
+        vectors[row, :len(vector)] = vector
+
+    return vectors
+
+# Function to convert cosine similarities into percentages
+def cosine_percentages(cosines: np.ndarray) -> np.ndarray:
+    """
+    Converts cosine similarities into percentages, with opposite vectors at 0%
+
+    Args:
+        cosines (numpy.ndarray): cosine similarities
+
+    Returns:
+        percentages (numpy.ndarray): the similarities as percentages from 0 to 100
+    """
+    return np.clip(np.rint(cosines * 100), 0, 100).astype(np.int64)
+
+# Function to compute the semantic similarity of every document to the documents after it
+def semantic_rows(vectors: np.ndarray, block_rows: int = SEMANTIC_BLOCK_ROWS):
+    """
+    Computes the cosine similarity of every pair of document vectors with a blocked matrix
+    product. Only the blocks on and above the diagonal are multiplied, and only one block of
+    rows is held in memory at a time. float16 blocks are multiplied as float32.
+
+    Args:
+        vectors (numpy.ndarray): unit length document vectors, as returned by vector_matrix()
+        block_rows (int): number of rows and columns of a block
+
+    Yields:
+        start, percentages (tuple): index of the first document of a block of rows, and the
+                                    similarities of the documents start, start + 1, ... to the
+                                    documents start, start + 1, ..., n - 1 as percentages
+    """
+    n_docs = len(vectors)
+    for start in range(0, n_docs, block_rows):
+        stop = min(start + block_rows, n_docs)
+        block = vectors[start:stop].astype(np.float32)
+        percentages = np.empty((stop - start, n_docs - start), dtype=np.int64)
+        for column in range(start, n_docs, block_rows):
+            column_stop = min(column + block_rows, n_docs)
+            cosines = block @ vectors[column:column_stop].astype(np.float32).T
+            percentages[:, column - start:column_stop - start] = cosine_percentages(cosines)
+        yield start, percentages
+
+# Function to compute the semantic similarities of a tile of pairs of documents
+def score_tile_semantic(vectors: np.ndarray, rows: slice, columns: slice) -> np.ndarray:
+    """
+    Computes the cosine similarity of the documents of a block of rows to the documents of a
+    block of columns, used by the tiled executor (see tiled_pairs.py)
+
+    Returns:
+        percentages (numpy.ndarray): (rows x columns) similarities as percentages
+    """
+    return cosine_percentages(vectors[rows].astype(np.float32) @ vectors[columns].astype(np.float32).T)
+
+# Function to score pairs of documents by their document vectors, used by the worker processes
+def score_pairs_semantic(vectors: np.ndarray, pairs: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        vectors (numpy.ndarray): unit length document vectors, as returned by vector_matrix()
+        pairs (numpy.ndarray): (pairs x 2) array of document indices
+
+    Returns:
+        percentages (numpy.ndarray): cosine similarity of each pair as a percentage
+    """
+    first = vectors[pairs[:, 0]].astype(np.float32)
+    second = vectors[pairs[:, 1]].astype(np.float32)
+    return cosine_percentages(np.einsum("ij,ij->i", first, second))
+
+def main(directory, csv_filename, batch_size=64, n_process=1, engine="sparse", candidates="all",
+         lsh_threshold=0.3, num_perm=128, bands=None, rows=None, recall_sample=0, cutoff=40,
+         index_directory=None, workers=1, output_format="csv", min_similarity=None, semantic=False,
+         vector_dtype="float32", memory_limit=None, shard=None, max_bucket=MAX_BUCKET_SIZE):
 
-    d = []
     files = []
 
     # List containing full paths to our files to compare
     files = filePaths(directory)
+    if shard is not None:
+        # every machine of a sharded run must number the files the same way
+        files = sorted(files)
+    stage_profiler.count("documents", len(files))
+
+    if index_directory is not None:
+        # Only lemmatize and filter the files that are not in the index yet
+        index = load_index(index_directory)
+        added_files, added_hashes = new_files(index, files)
+        n_existing = len(index["files"])
+        files = index["files"] + added_files
+        if semantic and n_existing > 0 and "vectors" not in index["shared"]:
+            raise ValueError(f"the index in {index_directory} has no document vectors, build it with --semantic")
+        # the vectors of an index built with --semantic are kept up to date by every run
+        with_vectors = semantic or "vectors" in index["shared"]
+        if with_vectors:
+            added_documents, added_vectors = preprocess_documents(added_files, batch_size, n_process, vectors=True)
+            document_vectors = list(index["shared"].get("vectors", [])) + added_vectors
+        else:
+            added_documents = preprocess_documents(added_files, batch_size, n_process)
+        documents = index["documents"] + added_documents
+    elif semantic:
+        # Lemmatize and filter each file once, and average its word vectors in the same pass
+        documents, document_vectors = preprocess_documents(files, batch_size, n_process, vectors=True)
+    else:
+        # Lemmatize and filter each file once
+        documents = preprocess_documents(files, batch_size, n_process)
+
+    # Intern the terms of each document into an int32 array of term IDs, over one vocabulary
+    # that the index keeps for the next runs
+    vocabulary = index["shared"].get("vocabulary", Vocabulary()) if index_directory is not None else Vocabulary()
+    with stage_profiler.stage("intern"):
+        documents = [terms if isinstance(terms, np.ndarray) else vocabulary.intern(terms) for terms in documents]
+
+    if engine == "sparse":
+        with stage_profiler.stage("matrix"):
+            matrix = document_term_matrix(documents, len(vocabulary))
+            lengths = np.asarray(matrix.sum(axis=1)).ravel()
+
+    # pairs of files to compare, None for every pair
+    pairs = None
+
+    if candidates == "lsh":
+        # Only compare the pairs of files whose MinHash signatures collide in an LSH band
+        pairs = lsh_candidate_pairs(documents, lsh_threshold, num_perm, bands, rows, term_table=vocabulary.hashes(),
+                                    max_bucket=max_bucket)
+        if index_directory is not None:
+            # pairs of indexed files have been compared in previous runs
+            pairs = pairs[pairs[:, 1] >= n_existing]
+        print(f"LSH candidate pairs: {len(pairs)} of {len(files) * (len(files) - 1) // 2}")
+
+        if recall_sample > 0:
+            recall, found, total = sample_recall(pairs, len(files), recall_sample,
+                                                 lambda i, j: similarity(documents[i], documents[j]), cutoff)
+            print(f"LSH recall on {min(recall_sample, len(files))} sampled files: {recall:.1%} "
+                  f"({found} of {total} pairs at or above {cutoff}%)")
+
+    elif index_directory is not None:
+        # Compare the new files to the indexed files and to each other
+        pairs = incremental_pairs(n_existing, len(added_files))
+
+    # A shard only scores its range of the pair index space, or the candidate pairs in it
+    pair_range = None
+    if shard is not None:
+        pair_range = shard_range(len(files), *shard)
+        if pairs is not None:
+            pairs = shard_pairs(pairs, len(files), pair_range)
+
+    # Scoring every pair in this process counts the common words of all pairs at once, unless
+    # a memory limit is given. The pairs are then scored tile by tile
+    tiled = memory_limit is not None and pairs is None and workers <= 1 and shard is None
+
+    # Write the results to disk as the pairs are scored. Incremental runs append to the
+    # results of the previous runs, continuing their row numbers
+    if tiled:
+        sink, tile, checkpoint = tiled_sink(f"common_words-{engine}", csv_filename, files, output_format,
+                                            min_similarity, memory_limit)
+    elif shard is not None:
+        sink = open_shard(csv_filename, files, shard, min_similarity)
+    else:
+        sink = ResultSink(csv_filename, files, output_format, min_similarity, append=index_directory is not None,
+                          first_row=index["pairs"] if index_directory is not None else 0)
+
+    with stage_profiler.stage("score"):
+        if tiled:
+            run_tiles(score_tile_sparse, (matrix, lengths), len(files), tile, sink, min_similarity, checkpoint)
+
+        elif pairs is not None or workers > 1 or shard is not None:
+            # the data each worker needs is sent to it once
+            if engine == "sparse":
+                score_pairs, data = score_pairs_sparse, (matrix, lengths)
+            else:
+                score_pairs, data = score_pairs_pairwise, documents
+
+            # compute similarity, in chunks of pairs returned in order
+            for chunk_pairs, percentages in run_pair_chunks(score_pairs, data, len(files), pairs, workers,
+                                                            pair_range=pair_range):
+                sink.write(chunk_pairs[:, 0], chunk_pairs[:, 1], percentages)
+
+        else:
+            if engine == "sparse":
+                # Count the common words of every pair of documents with one sparse matrix product
+                common_words = (matrix @ matrix.T).tocsr()
+
+            # Loop through all files and compare each file to every other file
+            for idx in range(len(files)):
+                others = np.arange(idx + 1, len(files))
+                # compute similarity
+                if engine == "sparse":
+                    percentages = similarity_row(common_words, lengths, idx)[idx + 1:]
+                else:
+                    percentages = [similarity(documents[idx], documents[jdx]) for jdx in others]
+                sink.write(np.full(len(others), idx), others, percentages)
+
+    sink.close()
+    if shard is not None:
+        write_manifest(csv_filename, f"common_words-{engine}", files, shard, sink.rows, min_similarity,
+                       all_pairs=pairs is None)
+
+    if semantic:
+        # Write the cosine similarities of the document vectors of the same pairs to a second file
+        if tiled:
+            semantic_sink, tile, checkpoint = tiled_sink("semantic", f"{csv_filename}_semantic", files, output_format,
+                                                         min_similarity, memory_limit)
+        elif shard is not None:
+            semantic_sink = open_shard(f"{csv_filename}_semantic", files, shard, min_similarity)
+        else:
+            semantic_sink = ResultSink(f"{csv_filename}_semantic", files, output_format, min_similarity,
+                                       append=index_directory is not None,
+                                       first_row=index["shared"].get("semantic_pairs", 0) if index_directory is not None else 0)
+
+        with stage_profiler.stage("semantic"):
+            vectors = vector_matrix(document_vectors, vector_dtype)
+
+            if tiled:
+                run_tiles(score_tile_semantic, vectors, len(files), tile, semantic_sink, min_similarity, checkpoint)
+
+            elif pairs is not None or workers > 1 or shard is not None:
+                for chunk_pairs, percentages in run_pair_chunks(score_pairs_semantic, vectors, len(files), pairs, workers,
+                                                                pair_range=pair_range):
+                    semantic_sink.write(chunk_pairs[:, 0], chunk_pairs[:, 1], percentages)
+            else:
+                # Multiply the vectors block by block and write the pairs of each row
+                for start, percentages in semantic_rows(vectors):
+                    for row in range(len(percentages)):
+                        idx = start + row
+                        others = np.arange(idx + 1, len(files))
+                        semantic_sink.write(np.full(len(others), idx), others, percentages[row, row + 1:])
+
+        semantic_sink.close()
+        if shard is not None:
+            write_manifest(f"{csv_filename}_semantic", "semantic", files, shard, semantic_sink.rows, min_similarity,
+                           all_pairs=pairs is None)
+
+    if index_directory is not None:
+        # add the new files to the index
+        index["files"] = files
+        index["hashes"] = index["hashes"] + added_hashes
+        index["documents"] = documents
+        index["shared"]["vocabulary"] = vocabulary
+        index["pairs"] += sink.rows
+        if with_vectors:
+            index["shared"]["vectors"] = vector_matrix(document_vectors)
+        if semantic:
+            index["shared"]["semantic_pairs"] = index["shared"].get("semantic_pairs", 0) + semantic_sink.rows
+        save_index(index_directory, index)
 
-    # Loop through all files and compare each file to every other file
-    for idx, file_1 in enumerate(files):
-        for file_2 in files[idx + 1: ]:  
-            # compute similarity
-            similarity_percentage = similarity(file_1, file_2)
-            # append data to a List of dictionaries
-            d.append({"File_1": file_1, "File_2": file_2, "Similarity (%)": similarity_percentage})
 
-    # Create a temporary Pandas DataFrame from our List of dictionaries
-    temp_dataframe = pd.DataFrame(d)
+if __name__ == "__main__":
 
-    # save DataFrame to CSV file
-    temp_dataframe.to_csv(f"{csv_filename}.csv")
+    args = parser.parse_args()
 
+    if args.index_directory is not None and args.output_format != "csv":
+        parser.error("--index appends to the results of previous runs, which needs --format csv")
 
-if __name__ == "__main__":
+    if args.memory_limit is not None and args.engine != "sparse":
+        parser.error("--memory-limit scores tiles of the document-term matrix, which needs --engine sparse")
+
+    if args.shard is not None and (args.index_directory is not None or args.memory_limit is not None or args.output_format != "csv"):
+        parser.error("--shard writes csv results for a range of pairs, it cannot be combined with --index, --memory-limit or --format")
+
+    if args.output_format == "npz" and args.min_similarity is None:
+        parser.error("--format npz holds every written pair in memory until the end of the run, it needs --min-similarity")
 
     # load a large pipeline package that comes with word vectors
-    nlp_lg = spacy.load('en_core_web_lg')
+    nlp_lg = load_pipeline('en_core_web_lg', args.pipeline == "fast")
+
+    prefetch.configure(args.read_threads, args.read_ahead)
+
+    if args.cache_dir is not None:
+        nlp_cache.configure(args.cache_dir, args.cache_size)
+
+    if args.profile is not None:
+        stage_profiler.configure(args.profile, args.profile_format, args.profile_sample)
 
     # get the directory and filename values
     directory = args.directory
     csv_filename = args.filename
     
     # call the main() function
-    main(directory, csv_filename)
+    main(directory, csv_filename, args.batch_size, args.n_process, args.engine, args.candidates,
+         args.lsh_threshold, args.num_perm, args.bands, args.rows, args.recall_sample, args.cutoff,
+         args.index_directory, args.workers, args.output_format, args.min_similarity, args.semantic,
+         args.vector_dtype, args.memory_limit, args.shard, args.max_bucket)
+
+    # keep the NLP cache within its size limit
+    nlp_cache.evict()
 
 
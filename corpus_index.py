@@ -0,0 +1,156 @@
+"""
+    A corpus index persisted to a directory, so that the similarity scripts only need to compare
+    newly added articles instead of recomputing every pair of articles on every run.
+
+    The index directory contains:
+        manifest.json   -> the path and SHA-256 content hash of every indexed article, and the
+                           number of pairs written to the CSV file so far
+        documents.pkl   -> the preprocessed data of every indexed article (e.g. lemma lists or
+                           sentence Bags of Words) plus any shared data such as a gensim Dictionary
+
+    An article is new when its path is not in the manifest with the hash of its contents, so
+    unchanged articles are not compared again and an edited article is treated as a new article.
+    A copy of an indexed article under another path (e.g. a reprint scraped on a later day) is a
+    new article too: it is scored like any other, so its 100% pair with the original is written
+    as in a full run.
+"""
+
+from typing import List, Tuple
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+from packed_corpus import is_document_path, document_bytes
+import stage_profiler
+
+MANIFEST_FILENAME = "manifest.json"
+DOCUMENTS_FILENAME = "documents.pkl"
+
+# Function to compute the content hash of a file
+def file_hash(filename: str) -> str:
+    """
+    Computes the SHA-256 hash of the contents of a file
+
+    Args:
+        filename (str): full path to file, or document path of an article in a packed corpus
+
+    Returns:
+        digest (str): hexadecimal SHA-256 digest of the file contents
+    """
+    if is_document_path(filename):
+        return hashlib.sha256(document_bytes(filename)).hexdigest()
+
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as filehandle:
+        for block in iter(lambda: filehandle.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+# Function to load an index from a directory
+def load_index(index_directory: str) -> dict:
+    """
+    Loads a corpus index. An empty index is returned if the directory has no index yet.
+
+    Args:
+        index_directory (str): path to the index directory
+
+    Returns:
+        index (dict): with the keys "files", "hashes", "documents" (one entry per article, in the
+                      order the articles were added), "pairs" (number of pairs written so far)
+                      and "shared" (data shared by all articles, e.g. a gensim Dictionary)
+    """
+    manifest_path = os.path.join(index_directory, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {"files": [], "hashes": [], "documents": [], "pairs": 0, "shared": {}}
+
+    with stage_profiler.stage("load_index"):
+        with open(manifest_path, 'r') as filehandle:
+            manifest = json.load(filehandle)
+        with open(os.path.join(index_directory, DOCUMENTS_FILENAME), 'rb') as filehandle:
+            payload = pickle.load(filehandle)
+
+    index = {"files": [entry["path"] for entry in manifest["articles"]],
+             "hashes": [entry["sha256"] for entry in manifest["articles"]],
+             "documents": payload["documents"],
+             "pairs": manifest["pairs"],
+             "shared": payload["shared"]}
+
+    return index
+
+# Function to save an index to a directory
+def save_index(index_directory: str, index: dict) -> None:
+    """
+    Saves a corpus index. Each file is written to a temporary file first and then renamed, so an
+    interrupted save never leaves a half written index behind.
+
+    Args:
+        index_directory (str): path to the index directory
+        index (dict): index as returned by load_index()
+    """
+    if not os.path.exists(index_directory):
+        os.makedirs(index_directory)
+
+    manifest = {"articles": [{"path": path, "sha256": digest} for path, digest in zip(index["files"], index["hashes"])],
+                "pairs": index["pairs"]}
+    payload = {"documents": index["documents"], "shared": index["shared"]}
+
+    with stage_profiler.stage("save_index"):
+        # documents first, so that the manifest never lists articles that are missing from the payload
+        documents_path = os.path.join(index_directory, DOCUMENTS_FILENAME)
+        with open(documents_path + ".tmp", 'wb') as filehandle:
+            pickle.dump(payload, filehandle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(documents_path + ".tmp", documents_path)
+
+        manifest_path = os.path.join(index_directory, MANIFEST_FILENAME)
+        with open(manifest_path + ".tmp", 'w') as filehandle:
+            json.dump(manifest, filehandle, indent=1)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+# Function to find the files that are not in the index yet
+def new_files(index: dict, files: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Finds the files that are not in the index with their current contents. Files with the
+    contents of an indexed file under another path are new files, as they are in a full run
+
+    Args:
+        index (dict): index as returned by load_index()
+        files (list): full paths to the files in the corpus
+
+    Returns:
+        new_paths, new_hashes (tuple): the new files and their content hashes
+    """
+    known = set(zip(index["files"], index["hashes"]))
+    new_paths = []
+    new_hashes = []
+    for filename in files:
+        with stage_profiler.stage("hash"):
+            digest = file_hash(filename)
+        if (filename, digest) not in known:
+            known.add((filename, digest))
+            new_paths.append(filename)
+            new_hashes.append(digest)
+
+    return new_paths, new_hashes
+
+# Function to list the pairs that involve at least one new article
+def incremental_pairs(n_existing: int, n_new: int) -> np.ndarray:
+    """
+    Lists the pairs (i, j), i < j, of a corpus where articles n_existing onwards are new, and
+    j is a new article. These are the new x existing and new x new pairs.
+
+    Args:
+        n_existing (int): number of articles already in the index
+        n_new (int): number of new articles
+
+    Returns:
+        pairs (numpy.ndarray): (pairs x 2) array of article indices
+    """
+    new_articles = np.arange(n_existing, n_existing + n_new)
+
+    # new article j is compared to the articles 0 to j - 1
+    second = np.repeat(new_articles, new_articles)
+    starts = np.cumsum(new_articles) - new_articles
+    first = np.arange(len(second)) - np.repeat(starts, new_articles)
+
+    return np.stack([first, second], axis=1)
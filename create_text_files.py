@@ -1,44 +1,92 @@
 """
     This script reads a csv file, extracts text from a row-column cell and creates a
-    text file. 
+    text file.
+
+    With the --packed option, the text of all the rows is written to a single packed corpus
+    (see packed_corpus.py) in the directory instead, which the similarity scripts can read
+    without opening thousands of small files.
+
+    Empty cells, and cells whose text was already written, are skipped. The file may also be a
+    JSONL file (.jsonl or .ndjson), one article per line. To keep the row and metadata of the
+    articles, or ingest several ranges of rows, use article_store.py instead.
 """
 
-import pandas as pd
 import argparse
 import os
 import sys
 import uuid
+from packed_corpus import write_packed_corpus, document_id, PACK_EXTENSION
+from article_store import read_records
 
 # Create an argument parser
 parser = argparse.ArgumentParser()
 
 # Add the positional arguments
-parser.add_argument("filepath", help="filepath to csv file")
+parser.add_argument("filepath", help="filepath to csv (or JSONL) file")
 parser.add_argument("column_name", help="name of column with data to convert to text file")
 parser.add_argument("start_row", help="first row to start converting column data to text file")
 parser.add_argument("last_row", help="last row to convert column data to text file")
 parser.add_argument("directory", help="directory/folder to save the text files to")
 
-args = parser.parse_args()
-
-csv_filepath = args.filepath
-column_name = args.column_name
-start_row = int(args.start_row)
-last_row = int(args.last_row)
-directory = args.directory
-
-# Read CSV file into a Pandas dataframe
-df = pd.read_csv(csv_filepath)
-
-# Loop through dataframe from starting row to end row
-for idx in range(start_row, last_row + 1):
-    # Get the data at the intersection of row_index == idx and column == column_name
-    text = df.loc[idx, column_name]
-    # Path to text file with unique ID
-    text_filepath = os.path.join(directory, f"{str(uuid.uuid1())}.txt")
-    # Open file object for "writing"
-    file = open(text_filepath, "w")
-    # Write to file
-    file.write(text)
-    # Close file object
-    file.close()    
+# Add the optional arguments
+parser.add_argument("--packed", nargs="?", const="corpus", metavar="NAME",
+                    help="write one packed corpus <directory>/<NAME>.pack (default NAME: corpus) instead of text files")
+parser.add_argument("--chunksize", type=int, default=10000, help="number of csv rows to read at a time")
+
+# Read the text in a column of a range of rows
+def read_column(csv_filepath, column_name, start_row, last_row, chunksize=10000):
+    """
+    Reads the csv (or JSONL) file in chunks of rows, loading only the column with the text
+
+    Args:
+      csv_filepath (str): filepath to csv or JSONL file
+      column_name (str): name of column with the text
+      start_row (int): first row to read
+      last_row (int): last row to read
+      chunksize (int): number of rows to read at a time
+
+    Yields:
+      text: the data at the intersection of each row and column == column_name, for the rows
+            whose cell is not empty
+    """
+    for record in read_records(csv_filepath, column_name, rows=[(start_row, last_row)], chunksize=chunksize):
+        yield record["text"]
+
+def main(csv_filepath, column_name, start_row, last_row, directory, packed=None, chunksize=10000):
+
+    texts = read_column(csv_filepath, column_name, start_row, last_row, chunksize)
+
+    if packed is not None:
+        # Write all the rows into one packed corpus
+        write_packed_corpus(os.path.join(directory, f"{packed}{PACK_EXTENSION}"), texts)
+        return
+
+    # Loop through the rows from starting row to end row
+    written = set()
+    for text in texts:
+        # Skip the rows with the same text as a row already written
+        doc_id = document_id(text.encode("utf-8"))
+        if doc_id in written:
+            continue
+        written.add(doc_id)
+
+        # Path to text file with unique ID
+        text_filepath = os.path.join(directory, f"{str(uuid.uuid1())}.txt")
+        # Open file object for "writing"
+        file = open(text_filepath, "w")
+        # Write to file
+        file.write(text)
+        # Close file object
+        file.close()
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    csv_filepath = args.filepath
+    column_name = args.column_name
+    start_row = int(args.start_row)
+    last_row = int(args.last_row)
+    directory = args.directory
+
+    main(csv_filepath, column_name, start_row, last_row, directory, args.packed, args.chunksize)
@@ -0,0 +1,40 @@
+"""
+    The NLTK tokenizers and stop words used by the similarity scripts, imported on first use.
+
+    Importing nltk imports all of its subpackages, including scipy.stats, which takes most of a
+    second. The scripts import these names instead of the NLTK ones so that --help, and runs that
+    find every tokenized file in the NLP cache, do not pay for it.
+"""
+
+from typing import List
+from importlib import metadata
+
+# version of the installed NLTK, read without importing it
+NLTK_VERSION = metadata.version("nltk")
+
+# Function to split a text into sentences
+def sent_tokenize(text: str) -> List[str]:
+    """
+    Splits a text into sentences with nltk.sent_tokenize
+    """
+    from nltk.tokenize import sent_tokenize as nltk_sent_tokenize
+    return nltk_sent_tokenize(text)
+
+# Function to split a sentence into words
+def word_tokenize(text: str) -> List[str]:
+    """
+    Splits a text into words with nltk.word_tokenize
+    """
+    from nltk.tokenize import word_tokenize as nltk_word_tokenize
+    return nltk_word_tokenize(text)
+
+class StopWords:
+    """
+    Stands in for nltk.corpus.stopwords until its words are needed
+    """
+
+    def words(self, language: str) -> List[str]:
+        from nltk.corpus import stopwords as nltk_stopwords
+        return nltk_stopwords.words(language)
+
+stopwords = StopWords()
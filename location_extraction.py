@@ -0,0 +1,343 @@
+"""
+    Finds the places (towns, suburbs and police stations) mentioned in each newspaper article,
+    the first step towards putting the crimes on a map.
+
+    The place names of a gazetteer are compiled into one Aho-Corasick automaton: a trie of the
+    names with failure links, so all the names are found in one pass over each article whatever
+    the number of names, instead of one scan of every article per name. Matching ignores case and
+    only keeps whole words. Where names overlap (e.g. "Mbare" in "Mbare Police Station"), the
+    longest name wins. Places whose names are also ordinary words or surnames (e.g. Triangle,
+    Waterfalls, Norton) are marked case_sensitive in the gazetteer: their capital letters must be
+    capitals in the article too, so "Triangle" and "TRIANGLE" match but "a love triangle" does not.
+
+    The gazetteer is the bundled zimbabwe_gazetteer.csv unless --gazetteer is given, so no network
+    access is needed. Its columns are name, aliases (separated by |), kind, parent (province or
+    town), latitude, longitude and case_sensitive (yes or empty). The coordinates are approximate, the centre of the place to
+    about a kilometre, which is enough to put a crime on a town or suburb map.
+
+    The articles are the text files written by create_text_files.py (a directory or a packed
+    corpus). They are split into batches that worker processes search in parallel, each worker
+    building the automaton once. Every place mention is written, in article order, as:
+        csv     -> <name>.csv with a row number, File, Start, End, Text, Place, Kind, Parent,
+                   Latitude and Longitude. Start and End are character offsets into the article
+        geojson -> <name>.geojson, a FeatureCollection with one Point feature per mention
+"""
+
+from typing import Any, Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import json
+import os
+import stage_profiler
+from common_words_similarity import filePaths, get_file_contents
+
+# gazetteer shipped with the scripts
+DEFAULT_GAZETTEER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zimbabwe_gazetteer.csv")
+
+# column names of the csv output
+COLUMNS = ["File", "Start", "End", "Text", "Place", "Kind", "Parent", "Latitude", "Longitude"]
+
+# Create an argument parser
+parser = argparse.ArgumentParser()
+
+# Add the positional arguments
+parser.add_argument("directory", help="path to directory with the article text files, or to a packed corpus (.pack file) or article store (.articles.parquet file)")
+parser.add_argument("filename", help="name of the output file (without extension)")
+
+# Add the optional arguments
+parser.add_argument("--gazetteer", default=DEFAULT_GAZETTEER, help="csv file of the place names (default: the bundled Zimbabwe gazetteer)")
+parser.add_argument("--format", dest="output_format", choices=["csv", "geojson"], default="csv", help="format of the output file")
+parser.add_argument("--workers", type=int, default=1, help="number of processes searching the articles")
+parser.add_argument("--batch-size", type=int, default=256, help="number of articles searched by a worker per task")
+parser.add_argument("--profile", metavar="FILE", help="write the time spent in each stage and the counters of the run to FILE")
+
+# automaton of the worker process, set by init_worker()
+worker_automaton = None
+
+# line breaks and tabs inside a place name match the spaces of the gazetteer
+WHITESPACE = str.maketrans("\t\n\r\f\v\xa0", "      ")
+
+class PlaceAutomaton:
+    """
+    Aho-Corasick automaton of the place names of a gazetteer
+
+    Args:
+        places (list): gazetteer entries, dicts with the keys "name", "aliases", "kind", "parent",
+                       "latitude", "longitude" and "case_sensitive"
+    """
+
+    def __init__(self, places: List[Dict[str, Any]]):
+        self.places = places
+        # trie: the transitions, failure link and matched names (length, places) of each state. The
+        # places of a name are (place index, name as written or None if the case does not matter)
+        self.transitions = [{}]
+        self.failures = [0]
+        self.outputs = [[]]
+
+        names = {}
+        for number, place in enumerate(places):
+            for name in [place["name"]] + place["aliases"]:
+                key = normalize_case(" ".join(name.split()))
+                if key:
+                    names.setdefault(key, []).append((number, " ".join(name.split()) if place["case_sensitive"] else None))
+
+        for name, entries in names.items():
+            state = 0
+            for character in name:
+                following = self.transitions[state].get(character)
+                if following is None:
+                    following = len(self.transitions)
+                    self.transitions[state][character] = following
+                    self.transitions.append({})
+                    self.failures.append(0)
+                    self.outputs.append([])
+                state = following
+            self.outputs[state].append((len(name), entries))
+
+        # breadth first, so the failure link of a state is set before the states below it
+        queue = list(self.transitions[0].values())
+        for state in queue:
+            for character, following in self.transitions[state].items():
+                failure = self.failures[state]
+                while failure and character not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                self.failures[following] = self.transitions[failure].get(character, 0)
+                # a state also matches the names its failure state matches
+                self.outputs[following] = self.outputs[following] + self.outputs[self.failures[following]]
+                queue.append(following)
+
+    def __len__(self) -> int:
+        return len(self.transitions)
+
+    def matches(self, text: str) -> List[Tuple[int, int, List[int]]]:
+        """
+        Finds every occurrence of a place name in one pass over the text, including overlapping ones
+
+        Args:
+            text (str): the text, already passed through normalize_case()
+
+        Returns:
+            matches (list): (start, end, places) of each occurrence, in order of end offset. The
+                            places are (place index, name as written or None) pairs
+        """
+        transitions, failures, outputs = self.transitions, self.failures, self.outputs
+        found = []
+        state = 0
+        for end, character in enumerate(text, 1):
+            while state and character not in transitions[state]:
+                state = failures[state]
+            state = transitions[state].get(character, 0)
+            for length, entries in outputs[state]:
+                found.append((end - length, end, entries))
+        return found
+
+    def find(self, text: str) -> List[Tuple[int, int, List[int]]]:
+        """
+        Finds the place names that are whole words, written with the capitals of case sensitive
+        names, keeping the longest of overlapping names
+
+        Args:
+            text (str): the text of an article
+
+        Returns:
+            mentions (list): (start, end, place indices) of each mention, in order of start offset
+        """
+        folded = normalize_case(text).translate(WHITESPACE)
+        whole_words = []
+        for start, end, entries in self.matches(folded):
+            if (start == 0 or not folded[start - 1].isalnum()) and (end == len(folded) or not folded[end].isalnum()):
+                numbers = [number for number, name in entries if name is None or has_capitals(text[start:end], name)]
+                if numbers:
+                    whole_words.append((start, end, numbers))
+
+        # leftmost longest: the longest name at each start, then skip the names it overlaps
+        mentions = []
+        covered = 0
+        for start, end, numbers in sorted(whole_words, key=lambda match: (match[0], match[0] - match[1])):
+            if start >= covered:
+                mentions.append((start, end, numbers))
+                covered = end
+        return mentions
+
+# Function to ignore case without moving character offsets
+def normalize_case(text: str) -> str:
+    """
+    Lower cases text. Characters whose lower case form is longer than one character are left
+    as they are, so offsets into the result are offsets into the text
+
+    Args:
+        text (str): the text
+
+    Returns:
+        text (str): the lower case text, as long as the text
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(character.lower() if len(character.lower()) == 1 else character for character in text)
+
+# Function to check the capitals of a case sensitive name
+def has_capitals(text: str, name: str) -> bool:
+    """
+    Checks that the capital letters of a name are capitals in the text that matched it
+
+    Args:
+        text (str): the matched text, as long as the name
+        name (str): the name as written in the gazetteer
+
+    Returns:
+        True if every capital letter of the name is a capital in the text
+    """
+    return all(written.isupper() for written, letter in zip(text, name) if letter.isupper())
+
+# Function to read the gazetteer
+def load_gazetteer(gazetteer_path: str = DEFAULT_GAZETTEER) -> List[Dict[str, Any]]:
+    """
+    Reads the places of a gazetteer csv file
+
+    Args:
+        gazetteer_path (str): path to the csv file, with the columns name, aliases, kind, parent,
+                              latitude, longitude and (optionally) case_sensitive
+
+    Returns:
+        places (list): a dict for each place, with its aliases as a list, its coordinates as floats
+                       and case_sensitive as a bool
+    """
+    with open(gazetteer_path, newline="", encoding="utf-8") as filehandle:
+        places = []
+        for row in csv.DictReader(filehandle):
+            places.append({"name": row["name"], "aliases": [alias for alias in row.get("aliases", "").split("|") if alias],
+                           "kind": row["kind"], "parent": row["parent"],
+                           "latitude": float(row["latitude"]), "longitude": float(row["longitude"]),
+                           "case_sensitive": (row.get("case_sensitive") or "").strip().lower() in ("yes", "true", "1")})
+    return places
+
+# Function to find the places mentioned in an article
+def extract_locations(automaton: PlaceAutomaton, filename: str) -> List[Dict[str, Any]]:
+    """
+    Finds the places mentioned in an article
+
+    Args:
+        automaton (PlaceAutomaton): automaton of the gazetteer
+        filename (str): full path to the article
+
+    Returns:
+        hits (list): a dict for each mention and place it may refer to, with the keys of COLUMNS
+    """
+    text = get_file_contents(filename)
+
+    with stage_profiler.stage("match"):
+        mentions = automaton.find(text)
+    stage_profiler.count("characters", len(text))
+    stage_profiler.count("mentions", len(mentions))
+
+    hits = []
+    for start, end, numbers in mentions:
+        for number in numbers:
+            place = automaton.places[number]
+            hits.append({"File": filename, "Start": start, "End": end, "Text": text[start:end], "Place": place["name"],
+                         "Kind": place["kind"], "Parent": place["parent"], "Latitude": place["latitude"],
+                         "Longitude": place["longitude"]})
+    return hits
+
+# Function to build the automaton of a worker process
+def init_worker(gazetteer_path: str) -> None:
+    """
+    Builds the automaton once per worker process
+
+    Args:
+        gazetteer_path (str): path to the gazetteer csv file
+    """
+    global worker_automaton
+
+    worker_automaton = PlaceAutomaton(load_gazetteer(gazetteer_path))
+
+# Function to search a batch of articles, used by the worker processes
+def extract_batch(files: List[str]) -> List[List[Dict[str, Any]]]:
+    """
+    Finds the places mentioned in each article of a batch, with the automaton of the worker process
+
+    Args:
+        files (list): full paths to the articles of the batch
+
+    Returns:
+        hits (list): the mentions of each article, as returned by extract_locations()
+    """
+    return [extract_locations(worker_automaton, filename) for filename in files]
+
+class LocationSink:
+    """
+    Streams the place mentions to a csv or GeoJSON file
+
+    Args:
+        filename (str): name of the output file without extension
+        output_format (str): 'csv' or 'geojson'
+    """
+
+    def __init__(self, filename: str, output_format: str = "csv"):
+        if output_format not in ("csv", "geojson"):
+            raise ValueError(f"unknown output format: {output_format}")
+
+        self.output_format = output_format
+        self.rows = 0
+        self.filehandle = open(f"{filename}.{output_format}", "w", newline="", encoding="utf-8")
+        if output_format == "csv":
+            # same layout as the results files of the similarity scripts
+            self.writer = csv.writer(self.filehandle, lineterminator=os.linesep)
+            self.writer.writerow([""] + COLUMNS)
+        else:
+            self.filehandle.write('{"type": "FeatureCollection", "features": [')
+
+    def write(self, hits: List[Dict[str, Any]]) -> None:
+        """
+        Writes the mentions of an article
+        """
+        for hit in hits:
+            if self.output_format == "csv":
+                self.writer.writerow([self.rows] + [hit[column] for column in COLUMNS])
+            else:
+                feature = {"type": "Feature", "geometry": {"type": "Point", "coordinates": [hit["Longitude"], hit["Latitude"]]},
+                           "properties": {column.lower(): hit[column] for column in COLUMNS[:7]}}
+                self.filehandle.write(("," if self.rows else "") + "\n" + json.dumps(feature, ensure_ascii=False))
+            self.rows += 1
+
+    def close(self) -> None:
+        if self.output_format == "geojson":
+            self.filehandle.write("\n]}\n")
+        self.filehandle.close()
+
+def main(directory, filename, gazetteer_path=DEFAULT_GAZETTEER, output_format="csv", workers=1, batch_size=256):
+
+    # List containing full paths to the articles
+    files = filePaths(directory)
+    stage_profiler.count("documents", len(files))
+
+    sink = LocationSink(filename, output_format)
+    batches = [files[start:start + batch_size] for start in range(0, len(files), batch_size)]
+
+    with stage_profiler.stage("extract"):
+        if workers > 1:
+            # every worker builds the automaton once, the batches are returned in order
+            with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(gazetteer_path,)) as pool:
+                for batch_hits in pool.map(extract_batch, batches):
+                    for hits in batch_hits:
+                        sink.write(hits)
+        else:
+            init_worker(gazetteer_path)
+            for batch in batches:
+                for hits in extract_batch(batch):
+                    sink.write(hits)
+
+    sink.close()
+    print(f"Found {sink.rows} place mentions in {len(files)} articles")
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        stage_profiler.configure(args.profile)
+
+    # call the main() function
+    main(args.directory, args.filename, args.gazetteer, args.output_format, args.workers, args.batch_size)
@@ -0,0 +1,256 @@
+"""
+    MinHash signatures and Locality Sensitive Hashing (LSH) to find candidate pairs of similar
+    documents without comparing every document to every other document.
+
+    Each document is represented by a set of terms (e.g. lemmas or words). The MinHash signature
+    of a document is a short list of numbers such that two signatures agree in a given position
+    with a probability equal to the Jaccard similarity of the two term sets. The signatures are
+    split into bands of rows; two documents become a candidate pair when all the rows of at least
+    one band are identical. Only the candidate pairs then need to be scored exactly.
+
+    The probability that a pair with Jaccard similarity s becomes a candidate is
+    1 - (1 - s^rows)^bands, which rises steeply around the threshold (1/bands)^(1/rows).
+
+    Note: the common words percentage of common_words_similarity.py is the number of common words
+    divided by the size of one document, which is always greater than or equal to the Jaccard
+    similarity. Use an LSH threshold below the similarity cut-off you are interested in
+    (e.g. 0.3 for a 40% cut-off) so that pairs above the cut-off are not missed.
+"""
+
+from typing import Callable, Iterable, List, Tuple
+import zlib
+import numpy as np
+import stage_profiler
+
+# Mersenne prime used by the universal hash functions. Hashes of terms are 32 bit, so
+# a * x + b stays below 2^63 and fits in an int64
+MERSENNE_PRIME = (1 << 31) - 1
+
+# largest bucket whose pairs all become candidates. A bucket of n documents has n * (n - 1) / 2
+# pairs, so of a larger bucket only the documents with identical signatures are paired
+MAX_BUCKET_SIZE = 1000
+
+# Function to hash each term of a document to a 32 bit integer
+def term_hashes(terms: Iterable[str], term_table: np.ndarray = None) -> np.ndarray:
+    """
+    Hashes the unique terms of a document. crc32 is used instead of hash() because it does not
+    change between Python processes.
+
+    Args:
+        terms (iterable): the terms of a document, or an array of term IDs if term_table is given
+        term_table (numpy.ndarray): crc32 of each term ID, from vocabulary.Vocabulary.hashes()
+
+    Returns:
+        hashes (numpy.ndarray): one hash per unique term
+    """
+    if term_table is not None:
+        hashes = term_table[np.unique(terms)]
+    else:
+        hashes = np.array([zlib.crc32(term.encode("utf-8")) for term in set(terms)], dtype=np.int64)
+    return hashes % MERSENNE_PRIME
+
+# Function to compute the MinHash signature of each document
+def minhash_signatures(documents: List[Iterable[str]], num_perm: int = 128, seed: int = 1,
+                       term_table: np.ndarray = None) -> np.ndarray:
+    """
+    Computes a MinHash signature for each document
+
+    Args:
+        documents (list): the terms of each document
+        num_perm (int): number of hash functions, i.e. the length of each signature
+        seed (int): seed for the random hash functions, so that signatures are reproducible
+        term_table (numpy.ndarray): crc32 of each term ID if the documents are arrays of term IDs
+
+    Returns:
+        signatures (numpy.ndarray): (documents x num_perm) array of signatures. Documents without
+                                    any terms get a signature of MERSENNE_PRIME values
+    """
+    random_state = np.random.RandomState(seed)
+    a = random_state.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.int64)
+    b = random_state.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.int64)
+
+    signatures = np.full((len(documents), num_perm), MERSENNE_PRIME, dtype=np.int64)
+    for idx, terms in enumerate(documents):
+        hashes = term_hashes(terms, term_table)
+        if len(hashes) == 0:
+            continue
+        # apply every hash function to every term and keep the minimum for each function
+        signatures[idx] = ((np.outer(a, hashes) + b[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+    return signatures
+
+# Function to choose the number of bands and rows for a similarity threshold
+def optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Chooses the number of bands and rows per band that minimise the sum of the probabilities of
+    false positives (pairs below the threshold that become candidates) and false negatives (pairs
+    above the threshold that do not).
+
+    Args:
+        threshold (float): Jaccard similarity above which pairs should become candidates
+        num_perm (int): length of the MinHash signatures
+
+    Returns:
+        bands, rows (tuple): number of bands and number of rows in each band
+    """
+    # similarities at which the probabilities are evaluated
+    below = np.linspace(0, threshold, 200)
+    above = np.linspace(threshold, 1, 200)
+
+    best = None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            # approximate the integrals of the probabilities over each range of similarities
+            false_positive = (1 - (1 - below ** rows) ** bands).mean() * threshold
+            false_negative = ((1 - above ** rows) ** bands).mean() * (1 - threshold)
+            error = false_positive + false_negative
+            if best is None or error < best[0]:
+                best = (error, bands, rows)
+
+    return best[1], best[2]
+
+# Function to encode every pair of the documents of a bucket
+def bucket_pairs(members: np.ndarray, n_docs: int) -> np.ndarray:
+    """
+    Args:
+        members (numpy.ndarray): indices of the documents of a bucket
+        n_docs (int): number of documents
+
+    Returns:
+        codes (numpy.ndarray): each pair (i, j), i < j, of the documents encoded as i * n_docs + j
+    """
+    members = np.sort(members).astype(np.int64)
+    first, second = np.triu_indices(len(members), k=1)
+    return members[first] * n_docs + members[second]
+
+# Function to find the pairs of documents that share at least one band
+def candidate_pairs(signatures: np.ndarray, bands: int, rows: int, max_bucket: int = MAX_BUCKET_SIZE) -> np.ndarray:
+    """
+    Places the documents into buckets, one set of buckets for each band of their signatures,
+    and returns every pair of documents that share a bucket.
+
+    Args:
+        signatures (numpy.ndarray): (documents x num_perm) MinHash signatures
+        bands (int): number of bands
+        rows (int): number of rows in each band. bands * rows must not exceed num_perm
+        max_bucket (int): of a bucket with more documents only the documents with identical
+                          signatures (reprints) are paired, the other pairs are only candidates
+                          if they share another bucket. No limit if None
+
+    Returns:
+        pairs (numpy.ndarray): (candidates x 2) array of document indices (i, j) with i < j,
+                               sorted in the order the pairs would be visited by a nested loop
+    """
+    if bands * rows > signatures.shape[1]:
+        raise ValueError(f"bands * rows ({bands * rows}) is larger than the signature length ({signatures.shape[1]})")
+
+    n_docs = signatures.shape[0]
+    # documents without terms would all share the same buckets
+    non_empty = np.flatnonzero((signatures != MERSENNE_PRIME).any(axis=1))
+
+    codes = []
+    # size of each oversized bucket and the number of its pairs that were left out
+    oversized = []
+    skipped_pairs = 0
+    for band in range(bands):
+        band_values = signatures[non_empty, band * rows:(band + 1) * rows]
+        # documents with identical rows in this band get the same bucket id
+        _, buckets = np.unique(band_values, axis=0, return_inverse=True)
+        buckets = buckets.ravel()
+        order = np.argsort(buckets, kind="stable")
+        boundaries = np.flatnonzero(np.diff(buckets[order])) + 1
+        for members in np.split(non_empty[order], boundaries):
+            if max_bucket is not None and len(members) > max_bucket:
+                # only pair the documents whose whole signatures are identical
+                _, copies = np.unique(signatures[members], axis=0, return_inverse=True)
+                copies = copies.ravel()
+                order = np.argsort(copies, kind="stable")
+                kept = 0
+                for group in np.split(members[order], np.flatnonzero(np.diff(copies[order])) + 1):
+                    if len(group) > 1:
+                        codes.append(bucket_pairs(group, n_docs))
+                        kept += len(group) * (len(group) - 1) // 2
+                oversized.append(len(members))
+                skipped_pairs += len(members) * (len(members) - 1) // 2 - kept
+            elif len(members) > 1:
+                # encode each pair (i, j) as a single integer i * n_docs + j
+                codes.append(bucket_pairs(members, n_docs))
+
+    if oversized:
+        print(f"Warning: {len(oversized)} LSH buckets have more than {max_bucket} documents (the largest has "
+              f"{max(oversized)}), only their documents with identical signatures were paired. {skipped_pairs} of "
+              f"their pairs are only compared when they share another bucket, raise --max-bucket to compare them")
+        stage_profiler.count("lsh_buckets_oversized", len(oversized))
+        stage_profiler.count("lsh_pairs_skipped", skipped_pairs)
+
+    codes = np.unique(np.concatenate(codes)) if codes else np.empty(0, dtype=np.int64)
+    pairs = np.stack([codes // n_docs, codes % n_docs], axis=1)
+
+    return pairs
+
+# Function to generate the candidate pairs of a set of documents
+def lsh_candidate_pairs(documents: List[Iterable[str]], threshold: float = 0.3, num_perm: int = 128,
+                        bands: int = None, rows: int = None, seed: int = 1, term_table: np.ndarray = None,
+                        max_bucket: int = MAX_BUCKET_SIZE) -> np.ndarray:
+    """
+    Computes MinHash signatures for the documents and returns the pairs that collide in at
+    least one LSH band
+
+    Args:
+        documents (list): the terms of each document
+        threshold (float): Jaccard similarity used to choose the bands and rows
+        num_perm (int): length of the MinHash signatures
+        bands (int): number of bands. Chosen from the threshold if bands or rows is None
+        rows (int): number of rows in each band
+        seed (int): seed for the hash functions
+        term_table (numpy.ndarray): crc32 of each term ID if the documents are arrays of term IDs,
+                                    from vocabulary.Vocabulary.hashes()
+        max_bucket (int): largest bucket whose pairs all become candidates, see candidate_pairs()
+
+    Returns:
+        pairs (numpy.ndarray): (candidates x 2) array of document indices (i, j) with i < j
+    """
+    if bands is None or rows is None:
+        bands, rows = optimal_bands(threshold, num_perm)
+
+    with stage_profiler.stage("lsh"):
+        signatures = minhash_signatures(documents, num_perm, seed, term_table)
+        pairs = candidate_pairs(signatures, bands, rows, max_bucket)
+
+    return pairs
+
+# Function to measure how many similar pairs the candidate pairs contain
+def sample_recall(pairs: np.ndarray, n_docs: int, sample_size: int, score_pair: Callable[[int, int], int],
+                  cutoff: int, seed: int = 1) -> Tuple[float, int, int]:
+    """
+    Scores every pair of a random sample of documents exactly, and reports the fraction of the
+    pairs at or above the cut-off that are also candidate pairs.
+
+    Args:
+        pairs (numpy.ndarray): candidate pairs returned by lsh_candidate_pairs()
+        n_docs (int): number of documents
+        sample_size (int): number of documents to sample
+        score_pair (callable): function that returns the exact similarity of documents (i, j)
+        cutoff (int): similarity at or above which a pair is considered similar
+        seed (int): seed used to sample the documents
+
+    Returns:
+        recall, found, total (tuple): the recall, the number of similar sampled pairs that are
+                                      candidates and the number of similar sampled pairs
+    """
+    sample = np.sort(np.random.RandomState(seed).choice(n_docs, size=min(sample_size, n_docs), replace=False))
+    candidates = set((pairs[:, 0] * n_docs + pairs[:, 1]).tolist())
+
+    found = 0
+    total = 0
+    first, second = np.triu_indices(len(sample), k=1)
+    for i, j in zip(sample[first].tolist(), sample[second].tolist()):
+        if score_pair(i, j) >= cutoff:
+            total += 1
+            if i * n_docs + j in candidates:
+                found += 1
+
+    # with no similar pairs in the sample nothing was missed
+    recall = found / total if total else 1.0
+
+    return recall, found, total
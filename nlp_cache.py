@@ -0,0 +1,198 @@
+"""
+    A content-addressed on-disk cache for the results of the expensive NLP steps (sentence and
+    word tokenization, lemmatization), shared by all the similarity scripts.
+
+    Each result is stored under a key made from the SHA-256 hash of the text it was computed from
+    and a namespace that names the step and the version of the tokenizer/model that produced it.
+    Editing a file or upgrading NLTK/spaCy therefore never returns stale results, and running a
+    different script or threshold over the same corpus reuses the results of previous runs.
+
+    Results are pickled and compressed with zlib. When the cache grows beyond its size limit, the
+    least recently used entries are removed (reading an entry updates its modification time).
+
+    The cache is disabled until configure() is called, in which case cached() simply runs the
+    computation.
+"""
+
+from typing import Any, Callable
+import hashlib
+import os
+import pickle
+import zlib
+
+# directory and size limit set by configure()
+cache_directory = None
+max_bytes = 0
+
+# Function to enable the cache
+def configure(directory: str, size_limit_mb: float = 1024) -> None:
+    """
+    Enables the cache for the current process
+
+    Args:
+        directory (str): directory to store the cached results in. Created if it does not exist
+        size_limit_mb (float): size in megabytes above which the least recently used entries are removed
+    """
+    global cache_directory, max_bytes
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    cache_directory = directory
+    max_bytes = int(size_limit_mb * 1024 * 1024)
+
+# Function to build a namespace from the name and versions of an NLP step
+def cache_namespace(*parts: str) -> str:
+    """
+    Joins the name of an NLP step and the versions of the tools it uses into a namespace
+
+    Args:
+        parts (str): e.g. "nltk-tokens", nltk.__version__
+
+    Returns:
+        namespace (str): the parts joined with ':'
+    """
+    return ":".join(str(part) for part in parts)
+
+# Function to compute the key of a text in a namespace
+def cache_key(namespace: str, text: str) -> str:
+    """
+    Computes the cache key of a text
+
+    Args:
+        namespace (str): namespace returned by cache_namespace()
+        text (str): text the result is computed from
+
+    Returns:
+        key (str): hexadecimal SHA-256 digest of the namespace and the text
+    """
+    sha256 = hashlib.sha256(namespace.encode("utf-8"))
+    sha256.update(b"\0")
+    sha256.update(text.encode("utf-8"))
+    return sha256.hexdigest()
+
+# Function to get the path of the file that stores an entry
+def entry_path(key: str) -> str:
+    """
+    Gets the path of a cache entry. Entries are spread over 256 sub-directories so that no
+    directory holds too many files.
+
+    Args:
+        key (str): key returned by cache_key()
+
+    Returns:
+        path (str): full path to the entry
+    """
+    return os.path.join(cache_directory, key[:2], f"{key}.bin")
+
+# Function to read an entry from the cache
+def cache_get(key: str) -> Any:
+    """
+    Reads an entry from the cache and marks it as recently used
+
+    Args:
+        key (str): key returned by cache_key()
+
+    Returns:
+        value: the cached value, or None if the cache is disabled or has no such entry
+    """
+    if cache_directory is None:
+        return None
+
+    path = entry_path(key)
+    try:
+        with open(path, 'rb') as filehandle:
+            value = pickle.loads(zlib.decompress(filehandle.read()))
+    except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+        # missing entries, or entries removed or truncated by another process, are recomputed
+        return None
+
+    # the modification time records when an entry was last used. Another process may have
+    # evicted the entry since it was read, the value is still good
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    return value
+
+# Function to add an entry to the cache
+def cache_put(key: str, value: Any) -> None:
+    """
+    Writes an entry to the cache. The entry is written to a temporary file and renamed, so
+    readers never see half written entries.
+
+    Args:
+        key (str): key returned by cache_key()
+        value: any picklable value
+    """
+    if cache_directory is None:
+        return
+
+    path = entry_path(key)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as filehandle:
+        filehandle.write(zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+    os.replace(temp_path, path)
+
+# Function to get a result from the cache, computing it if it is not cached
+def cached(namespace: str, text: str, compute: Callable[[], Any]) -> Any:
+    """
+    Returns the cached result for a text, or computes and caches it
+
+    Args:
+        namespace (str): namespace returned by cache_namespace()
+        text (str): text the result is computed from
+        compute (callable): function without arguments that computes the result
+
+    Returns:
+        value: the cached or computed result
+    """
+    if cache_directory is None:
+        return compute()
+
+    key = cache_key(namespace, text)
+    value = cache_get(key)
+    if value is None:
+        value = compute()
+        cache_put(key, value)
+
+    return value
+
+# Function to keep the cache within its size limit
+def evict() -> int:
+    """
+    Removes the least recently used entries until the cache is smaller than its size limit
+
+    Returns:
+        removed (int): number of entries removed
+    """
+    if cache_directory is None:
+        return 0
+
+    entries = []
+    total_bytes = 0
+    for root, _, filenames in os.walk(cache_directory):
+        for filename in filenames:
+            if filename.endswith(".bin"):
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_bytes += stat.st_size
+
+    removed = 0
+    # oldest entries first
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+        removed += 1
+
+    return removed
@@ -0,0 +1,149 @@
+"""
+    Small local stand-ins for the NLP models used by the similarity scripts, so they can run
+    offline (e.g. in benchmarks) without downloading the spaCy 'en_core_web_lg' package or the
+    NLTK 'punkt' and 'stopwords' data.
+
+    The stand-ins are much cruder than the real models: sentences are split on end punctuation,
+    words on non-word characters, lemmas are found by stripping a few English suffixes and the
+    word vector of a lemma is a random vector seeded with its hash. Scores
+    computed with them are not comparable to scores computed with the real models, but the amount
+    of work done per document is of the same order, which is what benchmarks need.
+"""
+
+from typing import List
+from functools import lru_cache
+import re
+import zlib
+import numpy as np
+import spacy
+from spacy.language import Language
+from spacy.lang.en.stop_words import STOP_WORDS
+
+# name and version of the stand-in spaCy pipeline, used in the NLP cache namespace
+PIPELINE_NAME = "offline_stand_in"
+PIPELINE_VERSION = "1.0.0"
+
+# suffixes stripped by the stand-in lemmatizer, longest first
+SUFFIXES = [("ies", "y"), ("ing", ""), ("ed", ""), ("es", ""), ("s", "")]
+
+# number of dimensions of the stand-in word vectors
+VECTOR_WIDTH = 96
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+WORD = re.compile(r"\w+|[^\w\s]")
+
+# Function to find the lemma of a word by stripping its suffix
+def strip_suffix(word: str) -> str:
+    """
+    Finds an approximate lemma of a word
+
+    Args:
+        word (str): lower case word
+
+    Returns:
+        lemma (str): the word without its first matching suffix, if the rest is long enough
+    """
+    for suffix, replacement in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + replacement
+    return word
+
+# Function to find the stand-in word vector of a lemma
+@lru_cache(maxsize=1 << 16)
+def lemma_vector(lemma: str) -> np.ndarray:
+    """
+    Draws a random vector for a lemma, the same one every time
+
+    Args:
+        lemma (str): lemma of a token
+
+    Returns:
+        vector (numpy.ndarray): float32 vector of VECTOR_WIDTH dimensions
+    """
+    return np.random.default_rng(zlib.crc32(lemma.encode("utf-8"))).standard_normal(VECTOR_WIDTH, dtype=np.float32)
+
+# spaCy token hooks for Token.vector and Token.has_vector. Module functions rather than lambdas,
+# so documents processed with n_process > 1 can be pickled
+def token_vector(token) -> np.ndarray:
+    return lemma_vector(token.lemma_)
+
+def token_has_vector(token) -> bool:
+    return True
+
+@Language.component("stand_in_lemmatizer")
+def stand_in_lemmatizer(doc):
+    for token in doc:
+        token.lemma_ = strip_suffix(token.lower_)
+    doc.user_token_hooks["vector"] = token_vector
+    doc.user_token_hooks["has_vector"] = token_has_vector
+    return doc
+
+# Function to build the stand-in spaCy pipeline
+def spacy_pipeline() -> Language:
+    """
+    Builds a blank English spaCy pipeline with a suffix stripping lemmatizer
+
+    Returns:
+        nlp (spacy.language.Language): used in place of spacy.load('en_core_web_lg')
+    """
+    nlp = spacy.blank("en")
+    nlp.add_pipe("stand_in_lemmatizer")
+    nlp.meta["name"] = PIPELINE_NAME
+    nlp.meta["version"] = PIPELINE_VERSION
+    return nlp
+
+# Function to split a text into sentences
+def sent_tokenize(text: str) -> List[str]:
+    """
+    Splits a text into sentences after '.', '!' and '?'. Stands in for nltk.sent_tokenize
+
+    Args:
+        text (str): text to split
+
+    Returns:
+        sentences (list): the sentences of the text
+    """
+    return [sentence for sentence in SENTENCE_END.split(text.strip()) if sentence]
+
+# Function to split a sentence into words
+def word_tokenize(text: str) -> List[str]:
+    """
+    Splits a text into words and punctuation marks. Stands in for nltk.word_tokenize
+
+    Args:
+        text (str): text to split
+
+    Returns:
+        words (list): the words and punctuation marks of the text
+    """
+    return WORD.findall(text)
+
+class StopWords:
+    """
+    Stands in for nltk.corpus.stopwords, with the English stop words that come with spaCy
+    """
+
+    def words(self, language: str) -> List[str]:
+        if language != "english":
+            raise ValueError(f"no stand-in stop words for {language}")
+        return sorted(STOP_WORDS)
+
+stopwords = StopWords()
+
+# Function to replace the models of a similarity script with the stand-ins
+def install(module) -> None:
+    """
+    Replaces the NLTK tokenizers and stop words, and the spaCy pipeline, that a similarity
+    script uses with the stand-ins
+
+    Args:
+        module: an imported similarity script, e.g. common_words_similarity
+    """
+    for name, stand_in in [("sent_tokenize", sent_tokenize), ("word_tokenize", word_tokenize),
+                           ("stopwords", stopwords)]:
+        if hasattr(module, name):
+            setattr(module, name, stand_in)
+
+    if hasattr(module, "filter_tokens"):
+        # the spaCy pipeline is loaded in the __main__ block of the script
+        module.nlp_lg = spacy_pipeline()
@@ -0,0 +1,178 @@
+"""
+    A packed corpus stores many articles in two files instead of one small text file per article:
+
+        <name>.pack      -> the UTF-8 text of all the articles, one after the other
+        <name>.pack.idx  -> one line per article: "<id>\t<offset>\t<length>", where the ID is a hash
+                            of the article text and offset/length locate its bytes in <name>.pack
+
+    The similarity scripts accept the path to a .pack file wherever they accept a directory. Each
+    article is then referred to by a document path "<name>.pack#<id>", and its text is sliced out
+    of a memory map of the .pack file instead of opening a file per article.
+
+    The functions below that read corpora also read the article stores of article_store.py
+    (<name>.articles.parquet), so the scripts accept a store wherever they accept a packed corpus.
+"""
+
+from typing import Iterable, List
+import hashlib
+import mmap
+import os
+import article_store
+
+PACK_EXTENSION = ".pack"
+INDEX_EXTENSION = ".idx"
+
+# packed corpora opened by this process, by path
+open_corpora = {}
+
+# Function to compute the ID of an article
+def document_id(data: bytes) -> str:
+    """
+    Computes the stable ID of an article from its contents
+
+    Args:
+        data (bytes): UTF-8 encoded text of the article
+
+    Returns:
+        id (str): 16 hexadecimal characters
+    """
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+# Function to write a packed corpus
+def write_packed_corpus(pack_path: str, texts: Iterable[str]) -> int:
+    """
+    Writes articles to a packed corpus. Articles are written as they are read from texts, so
+    only one article is held in memory at a time. Articles with the same text are only written once.
+
+    Args:
+        pack_path (str): path to the .pack file to create. The index is written next to it
+        texts (iterable): the text of each article
+
+    Returns:
+        count (int): number of articles written
+    """
+    written = set()
+    offset = 0
+    with open(pack_path, 'wb') as pack_file, open(pack_path + INDEX_EXTENSION, 'w') as index_file:
+        for text in texts:
+            data = text.encode("utf-8")
+            doc_id = document_id(data)
+            if doc_id in written:
+                continue
+            written.add(doc_id)
+            pack_file.write(data)
+            index_file.write(f"{doc_id}\t{offset}\t{len(data)}\n")
+            offset += len(data)
+
+    return len(written)
+
+# Function to check if a path is a packed corpus
+def is_packed_corpus(path: str) -> bool:
+    """
+    Checks if a path is a packed corpus
+
+    Args:
+        path (str): path to a directory or file
+
+    Returns:
+        True if the path is a .pack file with an index, or an article store
+    """
+    # corpora opened by this process are not looked up on disk again, so reading an article
+    # does not stat its corpus
+    if path in open_corpora or article_store.is_article_store(path):
+        return True
+    return path.endswith(PACK_EXTENSION) and os.path.isfile(path + INDEX_EXTENSION)
+
+# Function to check if a path refers to an article in a packed corpus
+def is_document_path(path: str) -> bool:
+    """
+    Checks if a path has the form "<name>.pack#<id>" (or "<name>.articles.parquet#<id>")
+
+    Args:
+        path (str): path to a file or an article in a packed corpus
+
+    Returns:
+        True if the path refers to an article in a packed corpus
+    """
+    pack_path, separator, _ = path.rpartition("#")
+    return separator == "#" and is_packed_corpus(pack_path)
+
+# Function to open a packed corpus
+def open_packed_corpus(pack_path: str) -> dict:
+    """
+    Memory maps a packed corpus and reads its index. Corpora are opened once per process.
+
+    Args:
+        pack_path (str): path to the .pack file
+
+    Returns:
+        corpus (dict): with the keys "ids" (article IDs in the order they were written), "spans"
+                       ((offset, length) of each article by ID) and "data" (memoryview of the map)
+    """
+    if pack_path not in open_corpora:
+        ids = []
+        spans = {}
+        with open(pack_path + INDEX_EXTENSION, 'r') as index_file:
+            for line in index_file:
+                doc_id, offset, length = line.rstrip("\n").split("\t")
+                ids.append(doc_id)
+                spans[doc_id] = (int(offset), int(length))
+
+        with open(pack_path, 'rb') as pack_file:
+            # an empty file cannot be memory mapped
+            if os.fstat(pack_file.fileno()).st_size > 0:
+                data = memoryview(mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ))
+            else:
+                data = memoryview(b"")
+
+        open_corpora[pack_path] = {"ids": ids, "spans": spans, "data": data}
+
+    return open_corpora[pack_path]
+
+# Function to list the articles of a packed corpus
+def document_paths(pack_path: str) -> List[str]:
+    """
+    Lists the document paths of the articles in a packed corpus
+
+    Args:
+        pack_path (str): path to the .pack file
+
+    Returns:
+        paths (list): "<pack_path>#<id>" for each article
+    """
+    if article_store.is_article_store(pack_path):
+        return article_store.document_paths(pack_path)
+    return [f"{pack_path}#{doc_id}" for doc_id in open_packed_corpus(pack_path)["ids"]]
+
+# Function to get the bytes of an article without copying them
+def document_bytes(document_path: str) -> memoryview:
+    """
+    Slices the bytes of an article out of the memory map of its packed corpus
+
+    Args:
+        document_path (str): "<name>.pack#<id>"
+
+    Returns:
+        data (memoryview): the UTF-8 encoded text of the article
+    """
+    pack_path, _, doc_id = document_path.rpartition("#")
+    if article_store.is_article_store(pack_path):
+        return memoryview(article_store.document_bytes(document_path))
+    corpus = open_packed_corpus(pack_path)
+    offset, length = corpus["spans"][doc_id]
+    return corpus["data"][offset:offset + length]
+
+# Function to read the text of an article
+def read_document(document_path: str) -> str:
+    """
+    Reads the text of an article in a packed corpus
+
+    Args:
+        document_path (str): "<name>.pack#<id>"
+
+    Returns:
+        text (str): the text of the article, with the same newlines as reading a text file
+    """
+    if article_store.is_article_store(document_path.rpartition("#")[0]):
+        return article_store.read_document(document_path)
+    return str(document_bytes(document_path), "utf-8").replace("\r\n", "\n").replace("\r", "\n")
@@ -0,0 +1,202 @@
+"""
+    Scores pairs of documents in parallel with a pool of worker processes.
+
+    The pairs (i, j), i < j, of n documents are numbered 0 to n * (n - 1) / 2 - 1 in the order a
+    nested loop visits them: (0, 1), (0, 2), ..., (0, n - 1), (1, 2), ... This pair index space
+    (or an explicit list of pairs, e.g. LSH candidates) is split into chunks with the same number
+    of pairs each. The data the scorer needs (e.g. a document-term matrix) is sent to every worker
+    once, when the worker starts, and each task only names the range of pairs to score.
+
+    Results are returned in chunk order, so the output is the same as scoring the pairs serially.
+"""
+
+from typing import Any, Callable, Iterator, List, Sequence, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import math
+import os
+import time
+import numpy as np
+import stage_profiler
+
+# data shared by all the tasks of a worker process, set by init_worker()
+shared_data = None
+
+# whether the stage profile of each chunk is returned to the parent process, set by init_worker()
+return_profile = False
+
+# largest number of pairs in a chunk, so the pairs of a chunk fit in memory however many pairs are scored
+MAX_CHUNK_PAIRS = 1000000
+
+# Function to count the pairs of n documents
+def pair_count(n_docs: int) -> int:
+    """
+    Counts the pairs (i, j), i < j, of n documents
+
+    Args:
+        n_docs (int): number of documents
+
+    Returns:
+        count (int): n * (n - 1) / 2
+    """
+    return n_docs * (n_docs - 1) // 2
+
+# Function to find the pairs with indices from start to stop
+def pairs_in_range(n_docs: int, start: int, stop: int) -> np.ndarray:
+    """
+    Converts pair indices into pairs of document indices
+
+    Args:
+        n_docs (int): number of documents
+        start (int): index of the first pair
+        stop (int): index after the last pair
+
+    Returns:
+        pairs (numpy.ndarray): (stop - start) x 2 array of document indices (i, j)
+    """
+    k = np.arange(start, stop, dtype=np.int64)
+
+    # row i starts at pair index i * (2n - i - 1) / 2. Solve for i and correct rounding errors
+    b = 2 * n_docs - 1
+    i = np.floor((b - np.sqrt(np.maximum(b * b - 8.0 * k, 0))) / 2).astype(np.int64)
+    row_start = lambda rows: rows * (2 * n_docs - rows - 1) // 2
+    i = np.where(row_start(i) > k, i - 1, i)
+    i = np.where(row_start(i + 1) <= k, i + 1, i)
+
+    j = k - row_start(i) + i + 1
+
+    return np.stack([i, j], axis=1)
+
+# Function to find the indices of pairs
+def pair_index(n_docs: int, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """
+    Converts pairs of document indices into pair indices, the inverse of pairs_in_range()
+
+    Args:
+        n_docs (int): number of documents
+        first (numpy.ndarray): index i of the first document of each pair
+        second (numpy.ndarray): index j of the second document of each pair, j > i
+
+    Returns:
+        indices (numpy.ndarray): the index of each pair in nested loop order
+    """
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    return first * (2 * n_docs - first - 1) // 2 + second - first - 1
+
+# Function to split a number of pairs into balanced ranges
+def balanced_ranges(total: int, parts: int) -> List[Tuple[int, int]]:
+    """
+    Splits the indices 0 to total - 1 into ranges whose sizes differ by at most one
+
+    Args:
+        total (int): number of indices
+        parts (int): number of ranges
+
+    Returns:
+        ranges (list): (start, stop) of each range. Empty ranges are left out
+    """
+    ranges = []
+    for part in range(parts):
+        start = total * part // parts
+        stop = total * (part + 1) // parts
+        if stop > start:
+            ranges.append((start, stop))
+    return ranges
+
+# Function run by each worker process when it starts
+def init_worker(data: Any, profile: bool = False) -> None:
+    """
+    Keeps the shared data in the worker process, so it is not sent with every task
+
+    Args:
+        data: data passed to the scorer with each chunk of pairs
+        profile (bool): profile the stages of the worker and return them with each chunk
+    """
+    global shared_data, return_profile
+    shared_data = data
+    return_profile = profile
+
+    if profile:
+        stage_profiler.configure()
+        # a forked worker starts with a copy of the profile of the parent process
+        stage_profiler.take()
+
+# Function that scores one chunk of pairs
+def score_chunk(score_pairs: Callable[[Any, np.ndarray], Sequence], n_docs: int, chunk) -> Tuple[np.ndarray, Sequence, int, float, Any]:
+    """
+    Scores a chunk of pairs with the shared data of the current process
+
+    Args:
+        score_pairs (callable): function (shared data, pairs) -> one score per pair
+        n_docs (int): number of documents
+        chunk: (start, stop) range of pair indices, or an array of pairs
+
+    Returns:
+        pairs, scores, pid, seconds, profile (tuple): the pairs, their scores, the id of the process
+                                                      that scored them, the time it took and the
+                                                      stage profile of the worker (None unless profiled)
+    """
+    started = time.perf_counter()
+    pairs = pairs_in_range(n_docs, *chunk) if isinstance(chunk, tuple) else chunk
+    scores = score_pairs(shared_data, pairs)
+    profile = stage_profiler.take() if return_profile else None
+    return pairs, scores, os.getpid(), time.perf_counter() - started, profile
+
+# Function to score pairs with a pool of worker processes
+def run_pair_chunks(score_pairs: Callable[[Any, np.ndarray], Sequence], data: Any, n_docs: int,
+                    pairs: np.ndarray = None, workers: int = 1, chunks_per_worker: int = 4,
+                    pair_range: Tuple[int, int] = None) -> Iterator[Tuple[np.ndarray, Sequence]]:
+    """
+    Scores pairs of documents, in parallel if workers > 1, and yields the results in the order
+    of the pairs. A report of the speedup and the utilization of each worker is printed once all
+    the pairs are scored.
+
+    Args:
+        score_pairs (callable): module level function (shared data, pairs) -> one score per pair
+        data: data the scorer needs, sent to each worker once
+        n_docs (int): number of documents
+        pairs (numpy.ndarray): (pairs x 2) array of pairs to score. Every pair of the
+                               n_docs documents is scored if None
+        workers (int): number of worker processes
+        chunks_per_worker (int): number of chunks for each worker. More chunks balance the
+                                 load better when some pairs take longer to score
+        pair_range (tuple): (start, stop) range of pair indices to score when pairs is None,
+                            e.g. the shard of a multi-node run. Every pair is scored if None
+
+    Yields:
+        pairs, scores (tuple): the pairs of a chunk and their scores
+    """
+    first = 0
+    if pairs is None and pair_range is not None:
+        first, total = pair_range[0], pair_range[1] - pair_range[0]
+    else:
+        total = pair_count(n_docs) if pairs is None else len(pairs)
+    ranges = balanced_ranges(total, max(max(workers, 1) * chunks_per_worker, math.ceil(total / MAX_CHUNK_PAIRS)))
+    chunks = [(first + start, first + stop) for start, stop in ranges] if pairs is None else [pairs[start:stop] for start, stop in ranges]
+
+    if workers <= 1:
+        # score in this process, without the cost of starting workers
+        init_worker(data)
+        for chunk in chunks:
+            chunk_pairs, scores, _, _, _ = score_chunk(score_pairs, n_docs, chunk)
+            yield chunk_pairs, scores
+        return
+
+    started = time.perf_counter()
+    busy = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(data, stage_profiler.enabled)) as executor:
+        # map() returns the results in the order of the chunks
+        results = executor.map(score_chunk, [score_pairs] * len(chunks), [n_docs] * len(chunks), chunks)
+        for chunk_pairs, scores, pid, seconds, profile in results:
+            busy[pid] = busy.get(pid, 0) + seconds
+            if profile is not None:
+                # add the stages of the worker to the profile of this process
+                stage_profiler.merge(profile)
+            yield chunk_pairs, scores
+    wall = time.perf_counter() - started
+
+    # the time spent scoring is the time a single process would have needed
+    print(f"Scored {total} pairs in {len(chunks)} chunks with {workers} workers in {wall:.2f}s, "
+          f"speedup {sum(busy.values()) / wall if wall else math.nan:.2f}x")
+    for number, pid in enumerate(sorted(busy)):
+        print(f"  worker {number} (pid {pid}): busy {busy[pid]:.2f}s, utilization {busy[pid] / wall:.0%}")
@@ -0,0 +1,320 @@
+"""
+    Splits the pairs of a run over several machines, and merges the results of the machines.
+
+    With --shard i/N, a similarity script only scores the i-th of N ranges of the pair index space
+    (the pairs (0, 1), (0, 2), ..., (1, 2), ... numbered in nested loop order, see pair_scheduler.py).
+    The ranges differ by at most one pair and only depend on the number of documents, so the
+    machines need no coordination: each is given its shard number and the same articles. The files
+    are sorted in shard runs, so every machine numbers them the same way whatever order its file
+    system lists them in.
+
+    Each shard writes <name>.shard-i-of-N.csv with the pairs of its range and, once every pair of
+    the range is scored, the manifest <name>.shard-i-of-N.json with the files, the range and the
+    number of rows. The merge command checks that the manifests of all N shards are there and agree,
+    that their ranges cover every pair exactly once, and that every row belongs to the range of its
+    shard and comes after the previous one, so no pair is missing or duplicated. It then writes the
+    rows of all the shards, renumbered, to <name>.csv (or parquet/npz):
+
+        python pair_shards.py merge <name> [--format csv|parquet|npz]
+
+    The simulate command runs the N shards of a script as local processes, in parallel, and merges
+    them, to try a multi-node run on one machine:
+
+        python pair_shards.py simulate common_words_similarity.py <directory> <name> --shards 4 -- --engine sparse
+"""
+
+from typing import Any, Dict, List, Tuple
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import numpy as np
+from pair_scheduler import pair_count, pair_index
+from result_sink import ResultSink
+
+# number of rows of a shard read at a time when merging
+MERGE_BATCH_ROWS = 100000
+
+# Create an argument parser
+parser = argparse.ArgumentParser()
+commands = parser.add_subparsers(dest="command", required=True)
+
+merge_parser = commands.add_parser("merge", help="check the shards of a run and merge their results")
+merge_parser.add_argument("filename", help="name of the results file of the run (without extension)")
+merge_parser.add_argument("--format", dest="output_format", choices=["csv", "parquet", "npz"], default="csv",
+                          help="format of the merged results file")
+merge_parser.add_argument("--keep-shards", action="store_true", help="keep the shard files and manifests after merging")
+
+simulate_parser = commands.add_parser("simulate", help="run the shards of a script as local processes and merge them",
+                                      usage="%(prog)s [-h] --shards SHARDS [--format {csv,parquet,npz}] script directory filename "
+                                            "[-- SCRIPT_ARGS ...]")
+simulate_parser.add_argument("script", help="similarity script, e.g. common_words_similarity.py")
+simulate_parser.add_argument("directory", help="path to directory with files to compare, or to a packed corpus")
+simulate_parser.add_argument("filename", help="name of the results file (without extension)")
+simulate_parser.add_argument("--shards", type=int, required=True, help="number of shards, i.e. of simulated machines")
+simulate_parser.add_argument("--format", dest="output_format", choices=["csv", "parquet", "npz"], default="csv",
+                             help="format of the merged results file")
+
+# Function to read a shard such as "2/8"
+def parse_shard(text: str) -> Tuple[int, int]:
+    """
+    Reads a shard number and count, used as the type of the --shard arguments
+
+    Args:
+        text (str): "i/N", the i-th of N shards, 1 <= i <= N
+
+    Returns:
+        shard, shards (tuple): i and N
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", text)
+    if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"not a shard i/N with 1 <= i <= N: {text}")
+    return int(match.group(1)), int(match.group(2))
+
+# Function to find the pair range of a shard
+def shard_range(n_docs: int, shard: int, shards: int) -> Tuple[int, int]:
+    """
+    Splits the pair index space of n documents into shards whose sizes differ by at most one
+
+    Args:
+        n_docs (int): number of documents
+        shard (int): shard number, from 1 to shards
+        shards (int): number of shards
+
+    Returns:
+        start, stop (tuple): the range of pair indices of the shard
+    """
+    total = pair_count(n_docs)
+    return total * (shard - 1) // shards, total * shard // shards
+
+# Function to keep the pairs of a shard
+def shard_pairs(pairs: np.ndarray, n_docs: int, pair_range: Tuple[int, int]) -> np.ndarray:
+    """
+    Keeps the pairs (e.g. LSH candidates) whose pair index is in the range of a shard
+
+    Args:
+        pairs (numpy.ndarray): (pairs x 2) array of document indices
+        n_docs (int): number of documents
+        pair_range (tuple): (start, stop) range of the shard, from shard_range()
+
+    Returns:
+        pairs (numpy.ndarray): the pairs of the shard
+    """
+    indices = pair_index(n_docs, pairs[:, 0], pairs[:, 1])
+    return pairs[(indices >= pair_range[0]) & (indices < pair_range[1])]
+
+# Function to name the files of a shard
+def shard_name(filename: str, shard: int, shards: int) -> str:
+    """
+    Returns:
+        name (str): name of the results file and manifest of the shard, without extension
+    """
+    return f"{filename}.shard-{shard}-of-{shards}"
+
+# Function to open the results file of a shard
+def open_shard(filename: str, files: List[str], shard: Tuple[int, int], min_similarity: int = None) -> ResultSink:
+    """
+    Opens the csv results file of a shard, removing the manifest of a previous run of the shard
+
+    Args:
+        filename (str): name of the results file of the run, without extension
+        files (list): full paths to the files, sorted
+        shard (tuple): (i, N) from parse_shard()
+        min_similarity (int): pairs with a lower similarity are not written
+
+    Returns:
+        sink (result_sink.ResultSink): the results file of the shard
+    """
+    name = shard_name(filename, *shard)
+    if os.path.exists(f"{name}.json"):
+        os.remove(f"{name}.json")
+    return ResultSink(name, files, "csv", min_similarity)
+
+# Function to record a completed shard
+def write_manifest(filename: str, scorer: str, files: List[str], shard: Tuple[int, int], rows: int,
+                   min_similarity: int = None, all_pairs: bool = True) -> None:
+    """
+    Writes the manifest of a shard once all its pairs are scored and its results file is closed
+
+    Args:
+        filename (str): name of the results file of the run, without extension
+        scorer (str): name of the scorer, so shards of different scorers are not merged
+        files (list): full paths to the files, sorted
+        shard (tuple): (i, N) from parse_shard()
+        rows (int): number of rows written to the results file of the shard
+        min_similarity (int): least similarity of the written pairs, None if every pair is written
+        all_pairs (bool): whether every pair of the range was scored, False for LSH candidate pairs
+    """
+    name = shard_name(filename, *shard)
+    manifest = {"scorer": scorer, "shard": shard[0], "shards": shard[1], "pair_range": list(shard_range(len(files), *shard)),
+                "rows": rows, "min_similarity": min_similarity, "all_pairs": all_pairs, "files": files}
+    with open(f"{name}.json.tmp", "w") as filehandle:
+        json.dump(manifest, filehandle)
+    os.replace(f"{name}.json.tmp", f"{name}.json")
+    print(f"Shard {shard[0]}/{shard[1]}: {rows} rows for pairs {manifest['pair_range'][0]} to {manifest['pair_range'][1] - 1}")
+
+# Function to read and check the manifests of the shards of a run
+def check_manifests(filename: str) -> List[Dict[str, Any]]:
+    """
+    Reads the manifests of the shards of a run and checks that every shard is complete and that
+    the shards cover every pair exactly once
+
+    Args:
+        filename (str): name of the results file of the run, without extension
+
+    Returns:
+        manifests (list): the manifest of each shard, in shard order
+    """
+    paths = glob.glob(f"{glob.escape(filename)}.shard-*-of-*.json")
+    if not paths:
+        raise ValueError(f"no shard manifests found for {filename}")
+
+    manifests = []
+    for path in paths:
+        with open(path) as filehandle:
+            manifests.append(json.load(filehandle))
+    manifests.sort(key=lambda manifest: manifest["shard"])
+
+    first = manifests[0]
+    for manifest in manifests:
+        for key in ("scorer", "shards", "min_similarity", "all_pairs", "files"):
+            if manifest[key] != first[key]:
+                raise ValueError(f"shard {manifest['shard']} has another {key} than shard {first['shard']}")
+
+    numbers = [manifest["shard"] for manifest in manifests]
+    missing = sorted(set(range(1, first["shards"] + 1)) - set(numbers))
+    if missing:
+        raise ValueError(f"shards {missing} of {first['shards']} are missing or did not finish")
+
+    # the ranges must follow each other from the first to the last pair
+    stop = 0
+    for manifest in manifests:
+        start, end = manifest["pair_range"]
+        if start != stop or list(shard_range(len(first["files"]), manifest["shard"], manifest["shards"])) != [start, end]:
+            raise ValueError(f"shard {manifest['shard']} covers pairs {start} to {end - 1}, expected them to start at {stop}")
+        if manifest["min_similarity"] is None and manifest["all_pairs"] and manifest["rows"] != end - start:
+            raise ValueError(f"shard {manifest['shard']} has {manifest['rows']} rows for {end - start} pairs")
+        stop = end
+    if stop != pair_count(len(first["files"])):
+        raise ValueError(f"the shards cover {stop} of {pair_count(len(first['files']))} pairs")
+
+    return manifests
+
+# Function to read the rows of a shard
+def shard_rows(path: str, file_numbers: Dict[str, int]):
+    """
+    Reads the results file of a shard in batches
+
+    Args:
+        path (str): path to the csv results file of the shard
+        file_numbers (dict): index of each file
+
+    Yields:
+        first, second, similarities (tuple): arrays of the file indices and similarity of each pair of a batch
+    """
+    with open(path, newline="") as filehandle:
+        reader = csv.reader(filehandle)
+        next(reader)
+        while True:
+            rows = [row for _, row in zip(range(MERGE_BATCH_ROWS), reader)]
+            if not rows:
+                return
+            yield (np.array([file_numbers[row[1]] for row in rows], dtype=np.int64),
+                   np.array([file_numbers[row[2]] for row in rows], dtype=np.int64),
+                   np.array([int(row[3]) for row in rows], dtype=np.int64))
+
+# Function to merge the shards of a run
+def merge(filename: str, output_format: str = "csv", keep_shards: bool = False) -> int:
+    """
+    Checks the shards of a run and writes their rows, in pair order, to one results file
+
+    Args:
+        filename (str): name of the results file of the run, without extension
+        output_format (str): 'csv', 'parquet' or 'npz'
+        keep_shards (bool): keep the results files and manifests of the shards
+
+    Returns:
+        rows (int): number of rows of the merged results file
+    """
+    manifests = check_manifests(filename)
+    files = manifests[0]["files"]
+    file_numbers = {path: number for number, path in enumerate(files)}
+
+    # the rows are already filtered, the minimum similarity is passed on for the npz output
+    sink = ResultSink(filename, files, output_format, manifests[0]["min_similarity"])
+    previous = -1
+    for manifest in manifests:
+        name = shard_name(filename, manifest["shard"], manifest["shards"])
+        start, stop = manifest["pair_range"]
+        rows = 0
+        for first, second, similarities in shard_rows(f"{name}.csv", file_numbers):
+            indices = pair_index(len(files), first, second)
+            # pair indices only increase, so a pair cannot be written twice
+            if (first >= second).any() or indices[0] <= previous or (np.diff(indices) <= 0).any():
+                raise ValueError(f"{name}.csv has pairs out of order or written twice")
+            if indices[0] < start or indices[-1] >= stop:
+                raise ValueError(f"{name}.csv has pairs outside of its range {start} to {stop - 1}")
+            if manifest["min_similarity"] is not None and (similarities < manifest["min_similarity"]).any():
+                raise ValueError(f"{name}.csv has pairs below the minimum similarity")
+            previous = indices[-1]
+            rows += len(indices)
+            sink.write(first, second, similarities)
+        if rows != manifest["rows"]:
+            raise ValueError(f"{name}.csv has {rows} rows, its manifest {manifest['rows']}")
+    sink.close()
+
+    if not keep_shards:
+        for manifest in manifests:
+            name = shard_name(filename, manifest["shard"], manifest["shards"])
+            os.remove(f"{name}.json")
+            os.remove(f"{name}.csv")
+
+    print(f"Merged {len(manifests)} shards into {filename}.{output_format}: {sink.rows} rows")
+    return sink.rows
+
+# Function to run the shards of a script on this machine
+def simulate(script: str, directory: str, filename: str, shards: int, output_format: str = "csv",
+             script_args: List[str] = ()) -> int:
+    """
+    Runs the shards of a similarity script as parallel processes and merges their results
+
+    Args:
+        script (str): path to the similarity script
+        directory (str): path to directory with files to compare, or to a packed corpus
+        filename (str): name of the results file, without extension
+        shards (int): number of shards
+        output_format (str): format of the merged results file
+        script_args (list): more arguments for the script
+
+    Returns:
+        rows (int): number of rows of the merged results file
+    """
+    processes = [subprocess.Popen([sys.executable, script, directory, filename, "--shard", f"{shard}/{shards}", *script_args])
+                 for shard in range(1, shards + 1)]
+    failed = [shard for shard, process in enumerate(processes, 1) if process.wait() != 0]
+    if failed:
+        raise ValueError(f"shards {failed} of {shards} failed")
+
+    # common_words_similarity.py --semantic also writes the shards of <name>_semantic
+    if glob.glob(f"{glob.escape(filename)}_semantic.shard-*-of-*.json"):
+        merge(f"{filename}_semantic", output_format)
+    return merge(filename, output_format)
+
+if __name__ == "__main__":
+
+    # the arguments after -- are passed on to the script of the simulate command
+    arguments = sys.argv[1:]
+    script_args = arguments[arguments.index("--") + 1:] if "--" in arguments else []
+    args = parser.parse_args(arguments[:len(arguments) - len(script_args) - ("--" in arguments)])
+
+    try:
+        if args.command == "merge":
+            merge(args.filename, args.output_format, args.keep_shards)
+        else:
+            simulate(args.script, args.directory, args.filename, args.shards, args.output_format, script_args)
+    except ValueError as error:
+        sys.exit(f"{args.command} failed: {error}")
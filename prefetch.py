@@ -0,0 +1,100 @@
+"""
+    Reads the articles ahead of the code that tokenizes or lemmatizes them, so that waiting for
+    the disk (or an NFS mount) overlaps with the NLP work instead of adding to it.
+
+    prefetch() runs the load function (reading a file, and for common_words_similarity.py the NLP
+    cache lookups) of the next articles on a pool of reader threads, while the caller processes
+    the current one. At most READ_AHEAD articles are loaded ahead of the caller: once that many are
+    waiting, no more reads are started until the caller takes one (backpressure), so memory holds
+    a bounded number of articles however large the corpus is. The results are returned in the
+    order of the files, each file is loaded exactly once.
+
+    With --profile the reading throughput of each prefetch() is printed when it finishes, the
+    files read are the "files_prefetched" counter, and the time the caller waited for a read is
+    the "read_wait" stage: when it is close to the time of the run the reads are the bottleneck,
+    when it is close to 0 the reader threads keep up.
+"""
+
+from typing import Any, Callable, Iterable, Iterator
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import time
+import stage_profiler
+
+# number of reader threads, 0 to read in the calling thread
+READ_THREADS = 8
+
+# number of files loaded ahead of the caller
+READ_AHEAD = 64
+
+# Function to set the reader threads and read ahead
+def configure(read_threads: int = 8, read_ahead: int = 64) -> None:
+    """
+    Sets the number of reader threads and of files read ahead for the rest of the run
+
+    Args:
+        read_threads (int): number of reader threads, 0 to read in the calling thread
+        read_ahead (int): number of files loaded ahead of the caller
+    """
+    global READ_THREADS, READ_AHEAD
+
+    READ_THREADS = read_threads
+    READ_AHEAD = max(read_ahead, 1)
+
+# Function to load files ahead of the caller
+def prefetch(files: Iterable[str], load: Callable[[str], Any], size: Callable[[Any], int] = None) -> Iterator[Any]:
+    """
+    Loads files on the reader threads and returns the results in the order of the files
+
+    Args:
+        files (iterable): full paths to the files
+        load (callable): function (filename) -> result, e.g. get_file_contents. Runs on the reader threads
+        size (callable): function (result) -> number of bytes, for the throughput report. Only
+                         files are counted if None
+
+    Returns:
+        results (iterator): the result of load() for each file
+    """
+    started = time.perf_counter()
+    loaded = 0
+    loaded_bytes = 0
+    waited = 0.0
+
+    if READ_THREADS <= 0:
+        for filename in files:
+            result = load(filename)
+            loaded += 1
+            loaded_bytes += size(result) if size is not None else 0
+            yield result
+    else:
+        with ThreadPoolExecutor(READ_THREADS, thread_name_prefix="prefetch") as pool:
+            pending = deque()
+            files = iter(files)
+
+            while True:
+                # keep READ_AHEAD loads in flight
+                for filename in files:
+                    pending.append(pool.submit(load, filename))
+                    if len(pending) >= READ_AHEAD:
+                        break
+                if not pending:
+                    break
+
+                future = pending.popleft()
+                if not future.done():
+                    wait_started = time.perf_counter()
+                    with stage_profiler.stage("read_wait"):
+                        result = future.result()
+                    waited += time.perf_counter() - wait_started
+                else:
+                    result = future.result()
+
+                loaded += 1
+                loaded_bytes += size(result) if size is not None else 0
+                yield result
+
+    stage_profiler.count("files_prefetched", loaded)
+    if loaded > 0 and stage_profiler.enabled:
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        throughput = f"{loaded_bytes / elapsed / 1e6:.1f} MB/s" if size is not None else f"{loaded / elapsed:.0f} files/s"
+        print(f"Read {loaded} files in {elapsed:.2f}s ({throughput}), waited {waited:.2f}s for reads")
@@ -0,0 +1,193 @@
+"""
+    Writes the similarity of pairs of files to disk as the pairs are scored, instead of keeping
+    every pair in memory until the end of the run.
+
+    Three output formats are supported:
+        csv     -> <name>.csv with the same columns as pandas.DataFrame.to_csv() wrote before:
+                   a row number, File_1, File_2 and Similarity (%)
+        parquet -> <name>.parquet with the columns File_1, File_2 and Similarity (%), written in
+                   row groups (requires pyarrow)
+        npz     -> <name>.npz, a scipy.sparse (files x files) matrix where entry (i, j) is the
+                   similarity of files i and j, and <name>_files.csv, the table of file IDs
+
+    Pairs below the minimum similarity are dropped before anything is written. For csv and parquet
+    only one batch of rows is held in memory at a time. The npz matrix is saved in one piece when
+    the sink is closed, so every kept pair is held in memory until then: npz output needs a
+    minimum similarity, otherwise it would hold all N*(N-1)/2 pairs.
+"""
+
+import csv
+import os
+import numpy as np
+from scipy import sparse
+import stage_profiler
+
+# column names of the csv and parquet outputs
+COLUMNS = ["File_1", "File_2", "Similarity (%)"]
+
+# number of rows of a parquet row group
+PARQUET_BATCH_ROWS = 100000
+
+class ResultSink:
+    """
+    Streams the similarity of pairs of files to a csv, parquet or npz file
+
+    Args:
+        filename (str): name of the output file without extension
+        files (list): full paths to the files, indexed by the file indices passed to write()
+        output_format (str): 'csv', 'parquet' or 'npz'
+        min_similarity (int): pairs with a lower similarity are not written. All pairs are
+                              written if None
+        append (bool): append to an existing csv file instead of overwriting it
+        first_row (int): row number of the first row written, to continue the row numbers
+                         of the rows already in the file when appending
+    """
+
+    def __init__(self, filename, files, output_format="csv", min_similarity=None, append=False, first_row=0):
+        if append and output_format != "csv":
+            raise ValueError("only csv output can be appended to")
+        if output_format == "npz" and min_similarity is None:
+            raise ValueError("npz output holds every written pair in memory, it needs a minimum similarity")
+
+        self.filename = filename
+        self.files = files
+        self.output_format = output_format
+        self.min_similarity = min_similarity
+        # number of rows written so far
+        self.rows = 0
+        self.first_row = first_row
+        # size of the file appended to, not counted as written by this run
+        self.initial_bytes = 0
+
+        if output_format == "csv":
+            path = f"{filename}.csv"
+            write_header = not (append and os.path.exists(path))
+            if not write_header:
+                self.initial_bytes = os.path.getsize(path)
+            self.filehandle = open(path, "a" if append else "w", newline="")
+            # same line endings as pandas.DataFrame.to_csv()
+            self.writer = csv.writer(self.filehandle, lineterminator=os.linesep)
+            if write_header:
+                self.writer.writerow([""] + COLUMNS)
+        elif output_format == "parquet":
+            import pyarrow
+            import pyarrow.parquet
+            self.pyarrow = pyarrow
+            self.schema = pyarrow.schema([(COLUMNS[0], pyarrow.string()), (COLUMNS[1], pyarrow.string()),
+                                          (COLUMNS[2], pyarrow.int16())])
+            self.writer = pyarrow.parquet.ParquetWriter(f"{filename}.parquet", self.schema)
+            self.batch = ([], [], [])
+        elif output_format == "npz":
+            self.batch = ([], [], [])
+        else:
+            raise ValueError(f"unknown output format: {output_format}")
+
+    def write(self, first, second, similarities):
+        """
+        Writes the similarity of pairs of files
+
+        Args:
+            first (array like): indices of the first file of each pair
+            second (array like): indices of the second file of each pair
+            similarities (array like): similarity of each pair as a percentage
+        """
+        with stage_profiler.stage("write"):
+            self.write_rows(first, second, similarities)
+
+    def write_rows(self, first, second, similarities):
+        """
+        Writes the similarity of pairs of files, see write()
+        """
+        first = np.asarray(first, dtype=np.int64)
+        second = np.asarray(second, dtype=np.int64)
+        similarities = np.asarray(similarities, dtype=np.int64)
+        stage_profiler.count("pairs", len(first))
+
+        if self.min_similarity is not None:
+            keep = similarities >= self.min_similarity
+            first, second, similarities = first[keep], second[keep], similarities[keep]
+
+        if len(first) == 0:
+            return
+
+        stage_profiler.count("rows_written", len(first))
+
+        if self.output_format == "csv":
+            row_numbers = range(self.first_row + self.rows, self.first_row + self.rows + len(first))
+            self.writer.writerows(zip(row_numbers, (self.files[idx] for idx in first.tolist()),
+                                      (self.files[jdx] for jdx in second.tolist()), similarities.tolist()))
+        else:
+            # compact types, as the npz output keeps every kept pair until the end of the run
+            self.batch[0].append(first.astype(np.int32))
+            self.batch[1].append(second.astype(np.int32))
+            self.batch[2].append(similarities.astype(np.uint8))
+            if self.output_format == "parquet" and sum(len(part) for part in self.batch[0]) >= PARQUET_BATCH_ROWS:
+                self.flush_parquet()
+
+        self.rows += len(first)
+
+    def flush_parquet(self):
+        """
+        Writes the buffered rows as a parquet row group
+        """
+        if not self.batch[0]:
+            return
+        first, second, similarities = (np.concatenate(part) for part in self.batch)
+        table = self.pyarrow.Table.from_arrays(
+            [self.pyarrow.array([self.files[idx] for idx in first.tolist()], self.pyarrow.string()),
+             self.pyarrow.array([self.files[jdx] for jdx in second.tolist()], self.pyarrow.string()),
+             self.pyarrow.array(similarities, self.pyarrow.int16())], schema=self.schema)
+        self.writer.write_table(table)
+        self.batch = ([], [], [])
+
+    def flush(self):
+        """
+        Makes sure the rows written so far are on disk, so a run can be resumed from them
+
+        Returns:
+            size (int): size of the csv file in bytes
+        """
+        if self.output_format != "csv":
+            raise ValueError("only csv output can be flushed")
+        self.filehandle.flush()
+        os.fsync(self.filehandle.fileno())
+        return self.filehandle.tell()
+
+    def close(self):
+        """
+        Writes any buffered rows and closes the output file
+        """
+        with stage_profiler.stage("write"):
+            self.close_output()
+
+        if stage_profiler.enabled:
+            paths = [f"{self.filename}.{self.output_format}"]
+            if self.output_format == "npz":
+                paths.append(f"{self.filename}_files.csv")
+            stage_profiler.count("bytes_written", sum(os.path.getsize(path) for path in paths) - self.initial_bytes)
+
+    def close_output(self):
+        """
+        Writes any buffered rows and closes the output file, see close()
+        """
+        if self.output_format == "csv":
+            self.filehandle.close()
+        elif self.output_format == "parquet":
+            self.flush_parquet()
+            self.writer.close()
+        else:
+            first, second, similarities = (np.concatenate(part) if part else np.zeros(0, dtype=np.int32)
+                                           for part in self.batch)
+            matrix = sparse.coo_matrix((similarities.astype(np.uint8), (first, second)),
+                                       shape=(len(self.files), len(self.files)))
+            sparse.save_npz(f"{self.filename}.npz", matrix.tocsr())
+            with open(f"{self.filename}_files.csv", "w", newline="") as filehandle:
+                writer = csv.writer(filehandle, lineterminator=os.linesep)
+                writer.writerow(["ID", "File"])
+                writer.writerows(enumerate(self.files))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
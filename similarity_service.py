@@ -0,0 +1,594 @@
+"""
+    A long-running local service that answers "which existing articles are most similar to this
+    text" without rerunning an all-pairs script over the whole corpus.
+
+    At start-up the articles in a directory (or packed corpus) are preprocessed once, or read from
+    the corpus indices of earlier --index runs of the similarity scripts, and kept in memory as:
+
+        common_words -> the lemma terms of each article in a sparse document-term matrix. A query
+                        is scored against every article with one sparse matrix-vector product, as
+                        the share of the query's terms found in the article (common_words_similarity.py)
+        tf_idf       -> the summed TF-IDF sentence vectors of each article under one corpus-wide
+                        TF-IDF model. A query is scored against every article with one sparse
+                        matrix-vector product, as in tf_idf_document_similarity.py --mode corpus
+
+    Articles can be added while the service runs. Their rows are appended to a small matrix that
+    is merged into the main matrix every COMPACT_ROWS articles, so nothing is rebuilt. The TF-IDF
+    weights are those of the corpus at start-up (words first seen in added articles have no weight)
+    until POST /rebuild recomputes them from the articles in memory.
+
+    API (JSON over HTTP, on a TCP port or a Unix socket):
+        POST /similar    {"text": ..., "k": 10, "models": ["tf_idf"], "add": false, "name": ...}
+                         -> the k most similar articles for each model. With "add": true the text
+                            is then added to the index
+        POST /documents  {"text": ..., "name": ...} -> adds an article to the index
+        POST /rebuild    -> recomputes the TF-IDF weights
+        GET  /stats      -> number of articles and the latency percentiles of each endpoint
+
+    Usage:
+        python similarity_service.py <directory> [--port 8765 | --socket /tmp/similarity.sock]
+        curl -s localhost:8765/similar -d '{"text": "A 32-year-old man from Mbare ...", "k": 5}'
+"""
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+import signal
+import socketserver
+import threading
+import time
+import uuid
+import numpy as np
+from scipy import sparse
+import nlp_cache
+import common_words_similarity
+import tf_idf_document_similarity
+from corpus_index import load_index, file_hash
+from packed_corpus import is_packed_corpus
+
+# Create an argument parser
+parser = argparse.ArgumentParser()
+
+# Add the positional arguments
+parser.add_argument("directory", help="path to directory with the articles, or to a packed corpus (.pack file) or article store (.articles.parquet file)")
+
+# Add the optional arguments
+parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on")
+parser.add_argument("--socket", help="listen on this Unix socket instead of a TCP port")
+parser.add_argument("--models", nargs="+", choices=["common_words", "tf_idf"], default=["common_words", "tf_idf"],
+                    help="similarity models to load")
+parser.add_argument("--lemma-index", help="corpus index of common_words_similarity.py --index, to reuse its lemma terms")
+parser.add_argument("--tfidf-index", help="corpus index of tf_idf_document_similarity.py --index, to reuse its dictionary and sentences. "
+                                           "The TF-IDF weights then count reprinted articles once, as in the indexed runs")
+parser.add_argument("--accept-dir", help="directory to also save added articles to, as text files")
+parser.add_argument("--cache-dir", help="directory of the NLP cache shared by the similarity scripts (disabled if not given)")
+parser.add_argument("--cache-size", type=float, default=1024, help="size limit of the NLP cache in megabytes")
+parser.add_argument("--stand-ins", action="store_true", help="use the offline stand-ins for the spaCy and NLTK models")
+parser.add_argument("--spacy-model", default="en_core_web_lg", help="spaCy pipeline loaded without --stand-ins")
+
+# number of added rows kept apart from the main matrix of a model before they are merged into it
+COMPACT_ROWS = 1000
+
+# number of recent requests of each endpoint the latency percentiles are computed from
+LATENCY_WINDOW = 10000
+
+class GrowingMatrix:
+    """
+    Sparse (rows x columns) matrix that rows can be appended to, with more columns than the
+    existing rows, without rebuilding it
+
+    Args:
+        matrix (scipy.sparse.spmatrix): the initial rows
+    """
+
+    def __init__(self, matrix):
+        self.main = matrix.tocsr()
+        self.pending = []
+        self.pending_matrix = None
+
+    def __len__(self):
+        return self.main.shape[0] + len(self.pending)
+
+    def append(self, row):
+        """
+        Appends a row
+
+        Args:
+            row (scipy.sparse.csr_matrix): (1 x columns) row
+        """
+        self.pending.append(row.tocsr())
+        self.pending_matrix = None
+        if len(self.pending) >= COMPACT_ROWS:
+            self.main = self.stack([self.main] + self.pending)
+            self.pending = []
+
+    @staticmethod
+    def stack(matrices):
+        """
+        Stacks matrices with different numbers of columns, padding them with empty columns
+        """
+        columns = max(matrix.shape[1] for matrix in matrices)
+        return sparse.vstack([sparse.csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], columns))
+                              for matrix in matrices], format="csr")
+
+    def dot(self, vector):
+        """
+        Multiplies every row with a dense vector
+
+        Args:
+            vector (numpy.ndarray): vector with at least as many entries as the matrix has columns
+
+        Returns:
+            products (numpy.ndarray): the product of each row with the vector
+        """
+        products = self.main.dot(vector[:self.main.shape[1]])
+        if self.pending:
+            if self.pending_matrix is None:
+                self.pending_matrix = self.stack(self.pending)
+            products = np.concatenate([products, self.pending_matrix.dot(vector[:self.pending_matrix.shape[1]])])
+        return products
+
+class CommonWordsModel:
+    """
+    Scores a text against every article by the share of the text's lemma terms found in the article
+
+    Args:
+        documents (list): the terms of each article, as returned by common_words_similarity.preprocess_documents()
+    """
+    name = "common_words"
+
+    def __init__(self, documents):
+        self.vocabulary = {}
+        rows = []
+        columns = []
+        for row, terms in enumerate(documents):
+            for term in terms:
+                rows.append(row)
+                columns.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+
+        # duplicate (row, column) entries are summed when converting to CSR
+        self.matrix = GrowingMatrix(sparse.coo_matrix((np.ones(len(rows), dtype=np.float64), (rows, columns)),
+                                                      shape=(len(documents), len(self.vocabulary))))
+
+    def features(self, text):
+        """
+        Returns:
+            terms (list): the lemma terms of the text
+        """
+        return common_words_similarity.text_terms(text)
+
+    def scores(self, terms):
+        """
+        Computes the similarity of every article to a text, as common_words_similarity.py does
+        for the pair (article, text)
+
+        Args:
+            terms (list): the lemma terms of the text
+
+        Returns:
+            percentages (numpy.ndarray): similarity of each article as a percentage
+        """
+        query = np.zeros(len(self.vocabulary), dtype=np.float64)
+        for term in terms:
+            column = self.vocabulary.get(term)
+            if column is not None:
+                query[column] += 1
+
+        counts = self.matrix.dot(query)
+        return common_words_similarity.to_percentages(counts, np.full(len(counts), len(terms)))
+
+    def add(self, terms):
+        """
+        Adds an article
+
+        Args:
+            terms (list): the lemma terms of the article
+        """
+        columns = [self.vocabulary.setdefault(term, len(self.vocabulary)) for term in terms]
+        row = sparse.coo_matrix((np.ones(len(columns), dtype=np.float64), (np.zeros(len(columns)), columns)),
+                                shape=(1, len(self.vocabulary)))
+        self.matrix.append(row)
+
+class TfIdfModel:
+    """
+    Scores a text against every article with one TF-IDF model over the sentences of all articles
+
+    Args:
+        dictionary (gensim.corpora.Dictionary): the words of all articles and their document frequencies
+        file_bows (list): the Bag of Words of each sentence, grouped by article
+    """
+    name = "tf_idf"
+
+    def __init__(self, dictionary, file_bows):
+        self.dictionary = dictionary
+        self.file_bows = file_bows
+        self.stopwords_en = set(tf_idf_document_similarity.stopwords.words("english"))
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        Recomputes the TF-IDF weights and the vectors of the articles from their sentences
+        """
+        import gensim
+
+        self.tf_idf = gensim.models.TfidfModel(dictionary=self.dictionary)
+        sentence_vectors, sentence_counts = tf_idf_document_similarity.build_corpus_index(self.dictionary, self.file_bows)
+        self.matrix = GrowingMatrix(tf_idf_document_similarity.file_sentence_sums(sentence_vectors, sentence_counts))
+        self.sentence_counts = sentence_counts
+
+    def features(self, text):
+        """
+        Returns:
+            sentences (list): the words of each sentence of the text, minus the stopwords
+        """
+        return tf_idf_document_similarity.tokenize_text(text, self.stopwords_en)
+
+    def vector(self, bows):
+        """
+        Sums the TF-IDF vectors of the sentences of a text
+
+        Args:
+            bows (list): the Bag of Words of each sentence
+
+        Returns:
+            vector (scipy.sparse.csr_matrix): (1 x words) summed sentence vector
+        """
+        import gensim
+
+        sentence_vectors = gensim.matutils.corpus2csc(self.tf_idf[bows], num_terms=len(self.dictionary),
+                                                      num_docs=len(bows))
+        return sparse.csr_matrix(sentence_vectors.sum(axis=1).T)
+
+    def scores(self, sentences):
+        """
+        Computes the similarity of every article to a text, as tf_idf_document_similarity.py
+        --mode corpus does for the pair (article, text)
+
+        Args:
+            sentences (list): the words of each sentence of the text
+
+        Returns:
+            percentages (numpy.ndarray): similarity of each article as a percentage
+        """
+        # words that are not in the dictionary do not change the scores
+        bows = [self.dictionary.doc2bow(sentence) for sentence in sentences]
+        block_sums = self.matrix.dot(self.vector(bows).toarray().ravel())
+
+        return tf_idf_document_similarity.block_percentages(block_sums, self.sentence_counts)
+
+    def add(self, sentences):
+        """
+        Adds an article. Its words are added to the dictionary, with the TF-IDF weights of the
+        words already in it
+
+        Args:
+            sentences (list): the words of each sentence of the article
+        """
+        bows = tf_idf_document_similarity.add_to_dictionary(self.dictionary, [sentences])[0]
+        self.file_bows.append(bows)
+        self.matrix.append(self.vector(bows))
+        self.sentence_counts = np.append(self.sentence_counts, len(bows))
+
+class LatencyStats:
+    """
+    Keeps the latency of the recent requests of each endpoint
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.counts = {}
+
+    def record(self, endpoint, seconds):
+        with self.lock:
+            self.latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append(seconds * 1000)
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def report(self):
+        """
+        Returns:
+            stats (dict): number of requests and the p50/p90/p99/max latency in milliseconds of each endpoint
+        """
+        with self.lock:
+            report = {}
+            for endpoint, latencies in self.latencies.items():
+                p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+                report[endpoint] = {"requests": self.counts[endpoint], "p50_ms": round(p50, 3), "p90_ms": round(p90, 3),
+                                    "p99_ms": round(p99, 3), "max_ms": round(max(latencies), 3)}
+            return report
+
+class SimilarityService:
+    """
+    The articles and the models kept in memory, shared by the request handler threads
+
+    Args:
+        files (list): full paths to the articles
+        models (list): the loaded models (CommonWordsModel, TfIdfModel)
+        accept_directory (str): directory to also save added articles to. Not saved if None
+    """
+
+    def __init__(self, files, models, accept_directory=None):
+        self.files = list(files)
+        self.models = {model.name: model for model in models}
+        self.accept_directory = accept_directory
+        # the models are not safe to update and query at the same time, and the NLP pipelines
+        # are not safe to share between threads, but one request can tokenize while another scores
+        self.lock = threading.Lock()
+        self.nlp_lock = threading.Lock()
+        self.latency = LatencyStats()
+
+    def similar(self, text, k=10, model_names=None, add=False, name=None):
+        """
+        Finds the articles most similar to a text
+
+        Args:
+            text (str): text of the article to look up
+            k (int): number of articles to return for each model
+            model_names (list): models to score with. All loaded models if None
+            add (bool): add the text to the index after scoring it
+            name (str): name of the article if it is added
+
+        Returns:
+            response (dict): the k most similar articles of each model, and the added article
+        """
+        model_names = model_names or list(self.models)
+        for model_name in model_names:
+            if model_name not in self.models:
+                raise ValueError(f"model {model_name} is not loaded")
+
+        features = self.features(text, [model_name for model_name in self.models if model_name in model_names or add])
+
+        response = {}
+        with self.lock:
+            for model_name in model_names:
+                percentages = self.models[model_name].scores(features[model_name])
+                top = min(k, len(percentages))
+                # the k best in any order, then sorted
+                best = np.argpartition(-percentages, top - 1)[:top] if top > 0 else np.zeros(0, dtype=np.int64)
+                best = best[np.lexsort((best, -percentages[best]))]
+                response[model_name] = [{"file": self.files[idx], "similarity": int(percentages[idx])} for idx in best]
+
+            if add:
+                response["added"] = self.add_features(text, features, name)
+
+        return response
+
+    def add(self, text, name=None):
+        """
+        Adds an article to the index
+
+        Args:
+            text (str): text of the article
+            name (str): name of the article. A new file name if None
+
+        Returns:
+            added (dict): the ID and name of the article
+        """
+        features = self.features(text, list(self.models))
+        with self.lock:
+            return self.add_features(text, features, name)
+
+    def features(self, text, model_names):
+        """
+        Tokenizes a text for each model
+
+        Returns:
+            features (dict): what each model scores the text with, by model name
+        """
+        with self.nlp_lock:
+            return {model_name: self.models[model_name].features(text) for model_name in model_names}
+
+    def add_features(self, text, features, name=None):
+        """
+        Adds an article whose features have been computed by each model. Called with the lock held
+        """
+        name = name or f"{uuid.uuid1()}.txt"
+        if self.accept_directory is not None:
+            name = os.path.join(self.accept_directory, os.path.basename(name))
+            with open(name, "w") as filehandle:
+                filehandle.write(text)
+
+        for model_name, model in self.models.items():
+            model.add(features[model_name])
+        self.files.append(name)
+
+        return {"id": len(self.files) - 1, "file": name}
+
+    def rebuild(self):
+        """
+        Recomputes the TF-IDF weights from all the articles in memory
+        """
+        with self.lock:
+            if "tf_idf" in self.models:
+                self.models["tf_idf"].rebuild()
+        return {"documents": len(self.files)}
+
+    def stats(self):
+        """
+        Returns:
+            stats (dict): number of articles and the latency percentiles of each endpoint
+        """
+        return {"documents": len(self.files), "models": list(self.models), "latency": self.latency.report()}
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers the requests of the API with the SimilarityService set as the class attribute service
+    """
+    service = None
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.service.stats())
+        else:
+            self.send_json(404, {"error": f"unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        started = time.perf_counter()
+        try:
+            request = self.read_json()
+            if self.path == "/similar":
+                response = self.service.similar(request["text"], int(request.get("k", 10)), request.get("models"),
+                                                bool(request.get("add", False)), request.get("name"))
+            elif self.path == "/documents":
+                response = self.service.add(request["text"], request.get("name"))
+            elif self.path == "/rebuild":
+                response = self.service.rebuild()
+            else:
+                self.send_json(404, {"error": f"unknown endpoint {self.path}"})
+                return
+        except (ValueError, KeyError, TypeError) as error:
+            self.send_json(400, {"error": repr(error)})
+            return
+
+        self.service.latency.record(self.path, time.perf_counter() - started)
+        self.send_json(200, response)
+
+    def log_message(self, format, *args):
+        # no log line for every request
+        pass
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    HTTP server listening on a Unix socket, with one thread per request
+    """
+    daemon_threads = True
+
+# Function to find the files of a corpus
+def corpus_files(directory):
+    """
+    Lists the articles of a directory or packed corpus, the same way the similarity scripts do
+
+    Args:
+        directory (str): path to directory with the articles, or to a packed corpus
+
+    Returns:
+        files (list): full paths to the articles
+    """
+    return common_words_similarity.filePaths(directory) if is_packed_corpus(directory) or os.path.isdir(directory) else []
+
+# Function to reuse the preprocessed documents of a corpus index
+def indexed_documents(files, index, preprocess):
+    """
+    Finds the preprocessed document of each file in a corpus index, by content hash, and
+    preprocesses the files that are not in the index
+
+    Args:
+        files (list): full paths to the articles
+        index (dict): corpus index returned by load_index()
+        preprocess (callable): function (files) -> documents
+
+    Returns:
+        documents (list): the preprocessed document of each file
+    """
+    by_hash = dict(zip(index["hashes"], index["documents"]))
+    hashes = [file_hash(filename) for filename in files]
+
+    missing = [filename for filename, digest in zip(files, hashes) if digest not in by_hash]
+    preprocessed = iter(preprocess(missing) if missing else [])
+
+    return [by_hash[digest] if digest in by_hash else next(preprocessed) for digest in hashes]
+
+# Function to load the models
+def load_models(files, model_names, lemma_index=None, tfidf_index=None):
+    """
+    Preprocesses the articles, or reads them from corpus indices, and builds the models
+
+    Args:
+        files (list): full paths to the articles
+        model_names (list): 'common_words' and/or 'tf_idf'
+        lemma_index (str): corpus index of common_words_similarity.py --index
+        tfidf_index (str): corpus index of tf_idf_document_similarity.py --index
+
+    Returns:
+        models (list): the loaded models
+    """
+    import gensim
+
+    models = []
+
+    if "common_words" in model_names:
+        if lemma_index is None:
+            documents = common_words_similarity.preprocess_documents(files)
+        else:
+            index = load_index(lemma_index)
+            if "vocabulary" in index["shared"]:
+                # the index keeps the term IDs of its documents, the model keeps their terms
+                index["documents"] = [index["shared"]["vocabulary"].words(terms) for terms in index["documents"]]
+            documents = indexed_documents(files, index, common_words_similarity.preprocess_documents)
+        models.append(CommonWordsModel(documents))
+
+    if "tf_idf" in model_names:
+        if tfidf_index is None:
+            dictionary, file_bows = tf_idf_document_similarity.build_dictionary(tf_idf_document_similarity.tokenize_files(files))
+        else:
+            # the sentences of files that are not in the index are added to the dictionary of the index
+            index = load_index(tfidf_index)
+            dictionary = index["shared"].get("dictionary", gensim.corpora.Dictionary())
+            file_bows = indexed_documents(files, index, lambda missing: tf_idf_document_similarity.add_to_dictionary(
+                dictionary, tf_idf_document_similarity.tokenize_files(missing)))
+        models.append(TfIdfModel(dictionary, file_bows))
+
+    return models
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    if args.stand_ins:
+        import offline_models
+        offline_models.install(common_words_similarity)
+        offline_models.install(tf_idf_document_similarity)
+    elif "common_words" in args.models:
+        common_words_similarity.nlp_lg = common_words_similarity.load_pipeline(args.spacy_model)
+
+    if args.cache_dir is not None:
+        nlp_cache.configure(args.cache_dir, args.cache_size)
+
+    started = time.perf_counter()
+    files = corpus_files(args.directory)
+    RequestHandler.service = SimilarityService(files, load_models(files, args.models, args.lemma_index, args.tfidf_index),
+                                               args.accept_dir)
+
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, RequestHandler)
+        address = args.socket
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+        address = f"http://{args.host}:{server.server_address[1]}"
+
+    print(f"Loaded {len(files)} articles in {time.perf_counter() - started:.1f}s, listening on {address}", flush=True)
+
+    # stop the same way on kill as on Ctrl+C, so that the socket is removed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None:
+            os.remove(args.socket)
+        nlp_cache.evict()
@@ -0,0 +1,311 @@
+"""
+    Low overhead instrumentation of the stages of the similarity scripts (reading, tokenizing,
+    building dictionaries and indices, querying, writing the results), enabled by --profile.
+
+    Each stage is timed with a context manager:
+
+        with stage_profiler.stage("tokenize"):
+            ...
+
+    which adds its wall and CPU time to the totals of the stage. Stages can be nested, and the
+    time of a stage includes the time of the stages inside it. Counters (documents, sentences,
+    tokens, pairs, bytes read and written) are added to with count(). While the profiler is
+    disabled, stage() returns a shared do-nothing context manager and count() returns at once, so
+    the instrumentation can stay in the hot paths. Enabled, a stage costs a few microseconds, so
+    stages are placed around work that takes much longer (a file, a pair, a batch of pairs).
+
+    When the process exits the profile is written as:
+        json   -> totals of each stage, the counters, the CPU time of worker processes, the peak
+                  memory and the I/O of the process (from /proc/self/io where available)
+        chrome -> a Chrome trace (chrome://tracing, https://ui.perfetto.dev) with one event per
+                  stage call (up to MAX_TRACE_EVENTS) and the totals above as metadata
+
+    Optionally, a sampling profiler records the Python stack of the main thread at a fixed rate
+    of CPU time (Unix only). The samples are written next to the profile as <file>.folded, one
+    "frame;frame;...;frame count" line per stack, the input of flamegraph.pl and speedscope.
+"""
+
+from typing import Dict
+import atexit
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# state set by configure()
+enabled = False
+output_path = None
+output_format = "json"
+
+# wall/CPU time and calls of each stage, and the counters
+stages = {}
+counters = {}
+
+# trace events of the stage calls, for the Chrome trace
+trace_events = []
+dropped_events = 0
+MAX_TRACE_EVENTS = 200000
+
+# stack samples of the sampling profiler
+samples = {}
+sample_interval = 0
+
+# start of the profile
+started_wall = 0.0
+started_cpu = 0.0
+
+# shared context manager returned by stage() while the profiler is disabled
+NULL_STAGE = contextlib.nullcontext()
+
+# stages and counters are also added to by the reader threads of prefetch.py
+lock = threading.Lock()
+
+class Stage:
+    """
+    Context manager that adds the wall and CPU time of a block of code to a stage
+    """
+    __slots__ = ("name", "wall", "cpu")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        with lock:
+            totals = stages.get(self.name)
+            if totals is None:
+                totals = stages[self.name] = [0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+            record_event(self.name, self.wall, wall, cpu)
+
+# Function to enable the profiler
+def configure(path: str = None, file_format: str = "json", sample_hz: float = 0) -> None:
+    """
+    Enables the profiler for the current process and writes the profile when it exits
+
+    Args:
+        path (str): file to write the profile to. Nothing is written if None, the profile can
+                    then be read with report()
+        file_format (str): 'json' or 'chrome'
+        sample_hz (float): samples per second of CPU time taken by the sampling profiler.
+                           The sampling profiler is disabled if 0
+    """
+    global enabled, output_path, output_format, started_wall, started_cpu
+
+    if file_format not in ("json", "chrome"):
+        raise ValueError(f"unknown profile format: {file_format}")
+
+    enabled = True
+    output_path = path
+    output_format = file_format
+    started_wall = time.perf_counter()
+    started_cpu = time.process_time()
+
+    if sample_hz > 0:
+        start_sampling(sample_hz)
+
+    if path is not None:
+        atexit.register(write_profile)
+
+# Function to time a stage
+def stage(name: str):
+    """
+    Times a block of code as a stage
+
+    Args:
+        name (str): name of the stage
+
+    Returns:
+        context manager that adds the time of the block to the stage
+    """
+    if not enabled:
+        return NULL_STAGE
+    return Stage(name)
+
+# Function to add to a counter
+def count(name: str, value: int = 1) -> None:
+    """
+    Adds to a counter
+
+    Args:
+        name (str): name of the counter, e.g. "documents" or "bytes_read"
+        value (int): amount to add
+    """
+    if enabled:
+        with lock:
+            counters[name] = counters.get(name, 0) + value
+
+# Function to take the stage totals and counters of a worker process
+def take() -> tuple:
+    """
+    Returns the stage totals and counters recorded so far and starts new ones, so that a worker
+    process can send what it recorded for a task to the parent process
+
+    Returns:
+        profile (tuple): (stages, counters), to pass to merge() in the parent process
+    """
+    global stages, counters
+
+    profile = (stages, counters)
+    stages = {}
+    counters = {}
+    trace_events.clear()
+
+    return profile
+
+# Function to add the stage totals and counters of a worker process
+def merge(profile: tuple) -> None:
+    """
+    Adds the stage totals and counters returned by take() in a worker process to this process
+
+    Args:
+        profile (tuple): (stages, counters)
+    """
+    worker_stages, worker_counters = profile
+    for name, (calls, wall, cpu) in worker_stages.items():
+        totals = stages.setdefault(name, [0, 0.0, 0.0])
+        totals[0] += calls
+        totals[1] += wall
+        totals[2] += cpu
+    for name, value in worker_counters.items():
+        counters[name] = counters.get(name, 0) + value
+
+# Function to record a trace event
+def record_event(name: str, start: float, wall: float, cpu: float) -> None:
+    """
+    Records a stage call for the Chrome trace, until MAX_TRACE_EVENTS events are recorded
+
+    Args:
+        name (str): name of the stage
+        start (float): time.perf_counter() when the stage started
+        wall (float): wall time of the call in seconds
+        cpu (float): CPU time of the call in seconds
+    """
+    global dropped_events
+
+    if len(trace_events) >= MAX_TRACE_EVENTS:
+        dropped_events += 1
+        return
+    trace_events.append((name, start, wall, cpu, threading.get_ident()))
+
+# Function to start the sampling profiler
+def start_sampling(sample_hz: float) -> None:
+    """
+    Samples the stack of the main thread at a fixed rate of CPU time
+
+    Args:
+        sample_hz (float): samples per second of CPU time
+    """
+    global sample_interval
+
+    import signal
+    if not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        print("The sampling profiler needs Unix and the main thread, it is disabled", file=sys.stderr)
+        return
+
+    def take_sample(signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        key = ";".join(reversed(stack))
+        samples[key] = samples.get(key, 0) + 1
+
+    sample_interval = 1.0 / sample_hz
+    signal.signal(signal.SIGPROF, take_sample)
+    signal.setitimer(signal.ITIMER_PROF, sample_interval, sample_interval)
+
+# Function to stop the sampling profiler
+def stop_sampling() -> None:
+    if sample_interval:
+        import signal
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+
+# Function to read the I/O counters of the process
+def process_io() -> Dict[str, int]:
+    """
+    Returns:
+        io (dict): the counters of /proc/self/io (bytes read and written by the process,
+                   including files written by libraries), or an empty dict where not available
+    """
+    try:
+        with open("/proc/self/io") as io_file:
+            return {key: int(value) for key, value in (line.split(": ") for line in io_file)}
+    except (OSError, ValueError):
+        return {}
+
+# Function to summarise the profile
+def report() -> dict:
+    """
+    Summarises the profile so far
+
+    Returns:
+        profile (dict): wall and CPU time of the run and of each stage, the counters, the CPU
+                        time of finished worker processes, the peak memory and the process I/O
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return {
+        "wall_seconds": round(time.perf_counter() - started_wall, 6),
+        "cpu_seconds": round(time.process_time() - started_cpu, 6),
+        "children_cpu_seconds": round(children.ru_utime + children.ru_stime, 6),
+        # bytes on macOS, kilobytes on Linux
+        "peak_rss_mb": round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 3),
+        "stages": {name: {"calls": calls, "wall_seconds": round(wall, 6), "cpu_seconds": round(cpu, 6)}
+                   for name, (calls, wall, cpu) in stages.items()},
+        "counters": dict(counters),
+        "io": process_io(),
+        "samples": sum(samples.values()),
+        "dropped_trace_events": dropped_events,
+    }
+
+# Function to build the Chrome trace
+def chrome_trace(summary: dict) -> dict:
+    """
+    Converts the recorded stage calls to the Chrome trace event format
+
+    Args:
+        summary (dict): profile returned by report(), added as metadata
+
+    Returns:
+        trace (dict): the trace, with times in microseconds from the start of the profile
+    """
+    pid = os.getpid()
+    events = [{"name": name, "ph": "X", "pid": pid, "tid": tid, "ts": round((start - started_wall) * 1e6, 3),
+               "dur": round(wall * 1e6, 3), "args": {"cpu_ms": round(cpu * 1e3, 3)}}
+              for name, start, wall, cpu, tid in trace_events]
+    events.append({"name": "counters", "ph": "C", "pid": pid, "tid": 0, "ts": round(summary["wall_seconds"] * 1e6, 3),
+                   "args": summary["counters"]})
+    events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": os.path.basename(sys.argv[0])}})
+
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": summary}
+
+# Function to write the profile
+def write_profile() -> None:
+    """
+    Writes the profile to the file given to configure(), and the stack samples to <file>.folded
+    """
+    stop_sampling()
+    summary = report()
+
+    with open(output_path, "w") as profile_file:
+        json.dump(chrome_trace(summary) if output_format == "chrome" else summary, profile_file, indent=1)
+
+    if samples:
+        with open(f"{output_path}.folded", "w") as folded_file:
+            for stack, samples_taken in sorted(samples.items()):
+                folded_file.write(f"{stack} {samples_taken}\n")
+
+    print(f"Profile written to {output_path}", file=sys.stderr)
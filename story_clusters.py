@@ -0,0 +1,399 @@
+"""
+    Groups the articles of a results file into stories: every pair of articles at or above the
+    cut-off links the two articles, and each story is a connected group of linked articles. Follow
+    up articles chain together this way (bail hearing -> trial -> sentencing) even when the first
+    and the last article of the story share few words.
+
+    The pairs are read as a stream and applied to a union-find (disjoint set) with path compression
+    and union by size, so each pair takes near constant time and only the union-find is held in
+    memory. Each story gets a cluster ID, the lowest article number in it (articles are numbered
+    in the order they are first seen), and a canonical article, its longest article, so downstream
+    GIS ingestion can handle one record per incident.
+
+    Two files are written:
+        <name>.csv          -> File, Cluster and Canonical for every article
+        <name>_stories.csv  -> Cluster, Canonical and number of Articles for every story
+
+    With --state the union-find and the position reached in a csv results file are kept in a
+    state file. Running the same command again after the similarity scripts appended more pairs
+    (e.g. with --index) only reads the new rows and updates the stories incrementally. The state
+    also keeps the size of the results file and hashes of its first bytes and of the bytes before
+    the position reached: when the file has shrunk or been rewritten since (a run without --index,
+    a tiled run resuming from a checkpoint), the stories are rebuilt from the start of the file.
+
+    Results files written with --min-similarity leave out the articles without any kept pair. Pass
+    the directory or packed corpus of the articles to give each of them a cluster of its own.
+"""
+
+from typing import Any, Dict, Iterator, List, Tuple
+import argparse
+import csv
+import hashlib
+import json
+import os
+import numpy as np
+from packed_corpus import is_document_path, document_bytes
+from common_words_similarity import filePaths
+
+# Create an argument parser
+parser = argparse.ArgumentParser()
+
+# Add the positional arguments
+parser.add_argument("results", help="results file of a similarity script (.csv, .parquet or .npz)")
+parser.add_argument("filename", help="name of the csv files (without .csv extension) to write the clusters to")
+
+# Add the optional arguments
+parser.add_argument("--cutoff", type=int, default=40, help="least similarity (%%) of a pair of articles of the same story")
+parser.add_argument("--directory", help="directory with the compared files, or packed corpus, so that articles without "
+                                        "any pair in the results file get a cluster of their own")
+parser.add_argument("--state", metavar="FILE",
+                    help="state file of the clusters. Only the rows appended to a csv results file since the "
+                         "last run are read")
+
+# number of bytes of csv rows read at a time
+READ_BYTES = 1 << 20
+
+# number of bytes hashed at the start of a results file, and before the position reached in it
+FINGERPRINT_BYTES = 1 << 16
+
+class StoryClusters:
+    """
+    A union-find over articles, which keeps the size, cluster ID and canonical (longest) article
+    of each story
+
+    Args:
+        files (list): full paths to the articles already known, in article number order
+        lengths (list): length in bytes of each of these articles
+        parents (list): parent of each of these articles in the union-find
+    """
+
+    def __init__(self, files: List[str] = (), lengths: List[int] = (), parents: List[int] = ()):
+        self.files = list(files)
+        self.numbers = {filename: number for number, filename in enumerate(self.files)}
+        self.lengths = list(lengths)
+        self.parents = list(parents) if parents else list(range(len(self.files)))
+
+        # size, cluster ID and canonical article of each root
+        self.sizes = [1] * len(self.files)
+        self.cluster_ids = list(range(len(self.files)))
+        self.canonical = list(range(len(self.files)))
+        for number in range(len(self.files)):
+            root = self.find(number)
+            if root != number:
+                self.sizes[root] += 1
+                self.cluster_ids[root] = min(self.cluster_ids[root], number)
+                self.canonical[root] = self.longer(self.canonical[root], number)
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def article(self, filename: str) -> int:
+        """
+        Returns the number of an article, adding it as a story of its own if it is new
+
+        Args:
+            filename (str): full path to the article
+
+        Returns:
+            number (int): the article number
+        """
+        number = self.numbers.get(filename)
+        if number is None:
+            number = len(self.files)
+            self.numbers[filename] = number
+            self.files.append(filename)
+            self.lengths.append(article_length(filename))
+            self.parents.append(number)
+            self.sizes.append(1)
+            self.cluster_ids.append(number)
+            self.canonical.append(number)
+        return number
+
+    def longer(self, first: int, second: int) -> int:
+        """
+        Returns:
+            number (int): the longer of two articles, the one with the lower number if they are as long
+        """
+        if (self.lengths[second], -second) > (self.lengths[first], -first):
+            return second
+        return first
+
+    def find(self, number: int) -> int:
+        """
+        Finds the root of the story of an article and points every article on the way directly
+        at the root
+
+        Args:
+            number (int): the article number
+
+        Returns:
+            root (int): the article number of the root
+        """
+        parents = self.parents
+        root = number
+        while parents[root] != root:
+            root = parents[root]
+        while parents[number] != root:
+            parents[number], number = root, parents[number]
+        return root
+
+    def union(self, first: int, second: int) -> int:
+        """
+        Merges the stories of two articles, attaching the smaller story to the larger one
+
+        Returns:
+            root (int): the root of the merged story
+        """
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return first
+        if self.sizes[first] < self.sizes[second]:
+            first, second = second, first
+
+        self.parents[second] = first
+        self.sizes[first] += self.sizes[second]
+        self.cluster_ids[first] = min(self.cluster_ids[first], self.cluster_ids[second])
+        self.canonical[first] = self.longer(self.canonical[first], self.canonical[second])
+        return first
+
+    def add_pairs(self, files_1: List[str], files_2: List[str], similarities: np.ndarray, cutoff: int) -> int:
+        """
+        Links the pairs of articles at or above the cut-off. Every article of the pairs is added,
+        including the ones of pairs below the cut-off
+
+        Args:
+            files_1 (list): full paths to the first article of each pair
+            files_2 (list): full paths to the second article of each pair
+            similarities (numpy.ndarray): similarity of each pair as a percentage
+            cutoff (int): least similarity of the linked pairs
+
+        Returns:
+            linked (int): number of pairs at or above the cut-off
+        """
+        first = [self.article(filename) for filename in files_1]
+        second = [self.article(filename) for filename in files_2]
+
+        linked = np.flatnonzero(np.asarray(similarities) >= cutoff).tolist()
+        for row in linked:
+            self.union(first[row], second[row])
+        return len(linked)
+
+    def clusters(self) -> Tuple[List[int], List[int]]:
+        """
+        Returns:
+            cluster_ids, canonical (tuple): the cluster ID and canonical article number of each article
+        """
+        roots = [self.find(number) for number in range(len(self.files))]
+        return [self.cluster_ids[root] for root in roots], [self.canonical[root] for root in roots]
+
+# Function to find the length of an article
+def article_length(filename: str) -> int:
+    """
+    Args:
+        filename (str): full path to the article, or document path of an article in a packed corpus
+
+    Returns:
+        length (int): size of the article in bytes
+    """
+    if is_document_path(filename):
+        return len(document_bytes(filename))
+    return os.path.getsize(filename)
+
+# Function to read the rows of a csv results file from a byte offset
+def csv_pairs(results_path: str, offset: int = 0) -> Iterator[Tuple[List[str], List[str], np.ndarray, int]]:
+    """
+    Reads the pairs of a csv results file in batches, from a byte offset. A last line that is
+    not complete yet, because the file is still being written, is left for the next run
+
+    Args:
+        results_path (str): path to the csv file written by result_sink.ResultSink
+        offset (int): byte offset to start at, 0 for the start of the file
+
+    Returns:
+        batches (iterator): (files_1, files_2, similarities, offset) of each batch of rows, where
+                            offset is the byte offset after the batch
+    """
+    with open(results_path, "rb") as filehandle:
+        filehandle.seek(offset)
+        if offset == 0:
+            # skip the header
+            header = filehandle.readline()
+            if not header.endswith(b"\n"):
+                return
+            offset = filehandle.tell()
+
+        while True:
+            lines = filehandle.readlines(READ_BYTES)
+            if not lines:
+                return
+            if not lines[-1].endswith(b"\n"):
+                lines.pop()
+            if not lines:
+                return
+            offset += sum(len(line) for line in lines)
+
+            rows = list(csv.reader(line.decode("utf-8") for line in lines))
+            yield ([row[1] for row in rows], [row[2] for row in rows],
+                   np.array([int(row[3]) for row in rows], dtype=np.int64), offset)
+
+# Function to read the rows of a parquet results file
+def parquet_pairs(results_path: str) -> Iterator[Tuple[List[str], List[str], np.ndarray]]:
+    """
+    Reads the pairs of a parquet results file one record batch at a time
+
+    Returns:
+        batches (iterator): (files_1, files_2, similarities) of each batch of rows
+    """
+    import pyarrow.parquet
+
+    for batch in pyarrow.parquet.ParquetFile(results_path).iter_batches():
+        columns = batch.to_pydict()
+        yield (columns["File_1"], columns["File_2"],
+               np.asarray(columns["Similarity (%)"], dtype=np.int64))
+
+# Function to read the pairs of an npz results file
+def npz_pairs(results_path: str) -> Iterator[Tuple[List[str], List[str], np.ndarray]]:
+    """
+    Reads the pairs of an npz results file and its table of file IDs
+
+    Returns:
+        batches (iterator): (files_1, files_2, similarities) of the pairs of the matrix
+    """
+    from scipy import sparse
+
+    with open(f"{results_path[:-len('.npz')]}_files.csv", newline="") as filehandle:
+        files = [row[1] for row in list(csv.reader(filehandle))[1:]]
+    matrix = sparse.load_npz(results_path).tocoo()
+
+    # the files without any pair are in the table of file IDs
+    yield files, files, np.zeros(len(files), dtype=np.int64)
+    yield ([files[idx] for idx in matrix.row.tolist()], [files[jdx] for jdx in matrix.col.tolist()],
+           matrix.data.astype(np.int64))
+
+# Function to identify the rows of a results file that have been read
+def fingerprint(results_path: str, offset: int) -> Dict[str, Any]:
+    """
+    Hashes the first bytes of a results file and the bytes before the position reached in it, so
+    a file rewritten since the position was saved is told apart from one that was appended to
+
+    Args:
+        results_path (str): path to the csv results file
+        offset (int): byte offset reached in the file
+
+    Returns:
+        fingerprint (dict): the "size" of the file and the "head" and "tail" hashes
+    """
+    with open(results_path, "rb") as filehandle:
+        size = os.fstat(filehandle.fileno()).st_size
+        head = hashlib.sha256(filehandle.read(min(FINGERPRINT_BYTES, offset))).hexdigest()
+        start = max(offset - FINGERPRINT_BYTES, 0)
+        filehandle.seek(start)
+        tail = hashlib.sha256(filehandle.read(offset - start)).hexdigest()
+    return {"size": size, "head": head, "tail": tail}
+
+# Function to read the state of a previous run
+def load_state(state_path: str, results_path: str, cutoff: int) -> Tuple[StoryClusters, int]:
+    """
+    Loads the clusters of a previous run. A state of another results file or cut-off is ignored,
+    and so is the state of a results file that has shrunk or been rewritten since
+
+    Args:
+        state_path (str): path to the state file
+        results_path (str): path to the results file
+        cutoff (int): least similarity of the linked pairs
+
+    Returns:
+        clusters, offset (tuple): the clusters and the byte offset reached in the csv results file
+    """
+    if state_path is not None and os.path.exists(state_path):
+        with open(state_path) as filehandle:
+            state = json.load(filehandle)
+        if state["results"] != os.path.abspath(results_path) or state["cutoff"] != cutoff:
+            print(f"Ignoring {state_path}, it was written for another results file or cut-off")
+        else:
+            current = fingerprint(results_path, state["offset"]) if os.path.exists(results_path) else None
+            # the rows before the offset must still be the ones that were read
+            if current is None or current["size"] < state.get("size", 0) \
+                    or (current["head"], current["tail"]) != (state.get("head"), state.get("tail")):
+                print(f"Ignoring {state_path}, {results_path} has been rewritten since, reading it from the start")
+            else:
+                return StoryClusters(state["files"], state["lengths"], state["parents"]), state["offset"]
+
+    return StoryClusters(), 0
+
+# Function to save the state of the clusters
+def save_state(state_path: str, results_path: str, cutoff: int, clusters: StoryClusters, offset: int) -> None:
+    """
+    Writes the clusters, the byte offset reached in the results file and its fingerprint. The
+    state is written to a temporary file and renamed, so an interruption never leaves half a state
+    """
+    with open(f"{state_path}.tmp", "w") as filehandle:
+        json.dump({"results": os.path.abspath(results_path), "cutoff": cutoff, "offset": offset,
+                   **fingerprint(results_path, offset),
+                   "files": clusters.files, "lengths": clusters.lengths, "parents": clusters.parents}, filehandle)
+    os.replace(f"{state_path}.tmp", state_path)
+
+# Function to write the clusters
+def write_clusters(filename: str, clusters: StoryClusters) -> Dict[str, int]:
+    """
+    Writes the cluster of every article to <filename>.csv and every story to <filename>_stories.csv
+
+    Returns:
+        counts (dict): number of "articles" and "stories"
+    """
+    cluster_ids, canonical = clusters.clusters()
+
+    with open(f"{filename}.csv", "w", newline="") as filehandle:
+        writer = csv.writer(filehandle, lineterminator=os.linesep)
+        writer.writerow(["", "File", "Cluster", "Canonical"])
+        writer.writerows((number, clusters.files[number], cluster_ids[number], clusters.files[canonical[number]])
+                         for number in range(len(clusters)))
+
+    # one row per story, in cluster ID order
+    stories = {}
+    for number, cluster_id in enumerate(cluster_ids):
+        stories.setdefault(cluster_id, [canonical[number], 0])[1] += 1
+
+    with open(f"{filename}_stories.csv", "w", newline="") as filehandle:
+        writer = csv.writer(filehandle, lineterminator=os.linesep)
+        writer.writerow(["", "Cluster", "Canonical", "Articles"])
+        writer.writerows((row, cluster_id, clusters.files[story[0]], story[1])
+                         for row, (cluster_id, story) in enumerate(sorted(stories.items())))
+
+    return {"articles": len(clusters), "stories": len(stories)}
+
+def main(results_path, filename, cutoff=40, directory=None, state_path=None):
+
+    clusters, offset = load_state(state_path, results_path, cutoff)
+
+    if directory is not None:
+        for article in filePaths(directory):
+            clusters.article(article)
+
+    # Link the pairs of the results file at or above the cut-off, batch by batch
+    linked = 0
+    if results_path.endswith(".csv"):
+        for files_1, files_2, similarities, offset in csv_pairs(results_path, offset):
+            linked += clusters.add_pairs(files_1, files_2, similarities, cutoff)
+    else:
+        # parquet and npz results are not appended to, so they are read whole. Linking the
+        # same pairs again does not change the clusters
+        batches = parquet_pairs(results_path) if results_path.endswith(".parquet") else npz_pairs(results_path)
+        for files_1, files_2, similarities in batches:
+            linked += clusters.add_pairs(files_1, files_2, similarities, cutoff)
+
+    counts = write_clusters(filename, clusters)
+    print(f"Linked {linked} pairs at or above {cutoff}%: {counts['articles']} articles in {counts['stories']} stories")
+
+    if state_path is not None:
+        save_state(state_path, results_path, cutoff, clusters, offset)
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    if args.state is not None and not args.results.endswith(".csv"):
+        parser.error("--state follows the rows appended to a results file, which needs a .csv results file")
+
+    # call the main() function
+    main(args.results, args.filename, args.cutoff, args.directory, args.state)
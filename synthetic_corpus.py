@@ -0,0 +1,202 @@
+"""
+    Generates a deterministic synthetic corpus of newspaper crime articles, for benchmarks and
+    for trying the similarity scripts without real data.
+
+    Articles are built from sentence templates filled with Zimbabwean names, places, crimes and
+    weapons. A share of the articles are reprints (exact copies of an earlier article, as when a
+    story runs in several papers) and a share are near duplicates (an earlier article with some
+    words replaced and a sentence dropped or added, as when a story is edited for another paper).
+
+    The same seed and settings always produce the same articles.
+
+    Usage:
+        python synthetic_corpus.py <directory> <count> [--seed 0] [--reprint-rate 0.1] ...
+"""
+
+from typing import List
+import argparse
+import os
+import random
+from packed_corpus import write_packed_corpus, PACK_EXTENSION
+
+# Create an argument parser
+parser = argparse.ArgumentParser()
+
+# Add the positional arguments
+parser.add_argument("directory", help="directory to write the articles to")
+parser.add_argument("count", type=int, help="number of articles")
+
+# Add the optional arguments
+parser.add_argument("--seed", type=int, default=0, help="seed of the random number generator")
+parser.add_argument("--reprint-rate", type=float, default=0.1, help="share of articles that are exact reprints")
+parser.add_argument("--near-duplicate-rate", type=float, default=0.1, help="share of articles that are edited reprints")
+parser.add_argument("--min-sentences", type=int, default=5, help="least number of sentences of an article")
+parser.add_argument("--max-sentences", type=int, default=25, help="largest number of sentences of an article")
+parser.add_argument("--edit-rate", type=float, default=0.1, help="share of words replaced in a near duplicate")
+parser.add_argument("--packed", action="store_true", help="write a packed corpus instead of text files")
+
+FIRST_NAMES = ["Tendai", "Tatenda", "Farai", "Rudo", "Chipo", "Tinashe", "Nyasha", "Blessing", "Tafadzwa",
+               "Kudakwashe", "Rumbidzai", "Tsitsi", "Simbarashe", "Memory", "Precious", "Takudzwa", "Sipho",
+               "Themba", "Nkosana", "Sibongile", "Thandiwe", "Lovemore", "Fungai", "Munyaradzi"]
+SURNAMES = ["Moyo", "Ncube", "Sibanda", "Dube", "Ndlovu", "Mpofu", "Nyathi", "Chikwanha", "Mutasa", "Chigumba",
+            "Mhlanga", "Gumbo", "Marufu", "Makoni", "Zvobgo", "Mupfumira", "Chinembiri", "Shumba", "Mapfumo",
+            "Mlambo", "Chari", "Tshuma", "Madziva", "Hove"]
+PLACES = ["Harare", "Bulawayo", "Chitungwiza", "Mutare", "Gweru", "Kwekwe", "Kadoma", "Masvingo", "Chinhoyi",
+          "Marondera", "Norton", "Chegutu", "Bindura", "Beitbridge", "Hwange", "Victoria Falls", "Kariba",
+          "Rusape", "Zvishavane", "Chiredzi", "Gokwe", "Mbare", "Epworth", "Glen View", "Budiriro", "Mabvuku"]
+CRIMES = [("robbery", "robbed"), ("stock theft", "stole cattle from"), ("murder", "murdered"),
+          ("assault", "assaulted"), ("fraud", "defrauded"), ("unlawful entry", "broke into the house of"),
+          ("theft", "stole from"), ("armed robbery", "robbed at gunpoint"), ("culpable homicide", "killed"),
+          ("extortion", "extorted money from")]
+WEAPONS = ["a knife", "an axe", "a machete", "a pistol", "a log", "a hoe", "an iron bar", "a brick",
+           "a knobkerrie", "a shotgun"]
+COURTS = ["Harare Magistrates' Court", "Bulawayo Magistrates' Court", "the High Court", "Mutare Magistrates' Court",
+          "Gweru Magistrates' Court", "Masvingo Magistrates' Court", "Chinhoyi Magistrates' Court"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+          "November", "December"]
+ITEMS = ["a mobile phone", "cash", "a television set", "groceries", "a bicycle", "solar panels", "a laptop",
+         "livestock", "building materials", "fuel coupons"]
+
+TEMPLATES = [
+    "A {age}-year-old man from {place} has appeared before {court} charged with {crime}.",
+    "{accused}, {age}, of {place}, was arrested on {date} after he allegedly {verb} {victim}.",
+    "The court heard that on {date} {accused} armed himself with {weapon} and went to {victim_first}'s homestead in {place}.",
+    "It is alleged that {accused} {verb} {victim} and took {item} worth US${amount}.",
+    "{victim}, {victim_age}, sustained serious injuries and was taken to {place} District Hospital.",
+    "The State, represented by {prosecutor}, said {accused} was positively identified by witnesses.",
+    "Police in {place} confirmed the arrest and urged members of the public to report crime.",
+    "{accused} was remanded in custody to {date} and advised to apply for bail at the High Court.",
+    "The matter came to light when {victim_first} reported the case at {place} Police Station.",
+    "{accused} pleaded not guilty to the charge of {crime} before magistrate {magistrate}.",
+    "Investigations revealed that {accused} had struck {victim_first} with {weapon} several times.",
+    "Nothing was recovered and police are still looking for an accomplice who fled towards {place}.",
+    "The magistrate sentenced {accused} to {years} years in prison, of which {suspended} were suspended.",
+    "Residents of {place} said cases of {crime} had increased in the area in recent months.",
+    "{victim_first} told the court that {accused} threatened to kill him if he reported the matter.",
+    "A report was made to the police leading to the arrest of {accused} on {date}.",
+]
+
+# Function to draw a full name
+def full_name(rng: random.Random) -> str:
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}"
+
+# Function to write a new article
+def new_article(rng: random.Random, n_sentences: int) -> List[str]:
+    """
+    Writes the sentences of a new article about one crime
+
+    Args:
+        rng (random.Random): random number generator
+        n_sentences (int): number of sentences
+
+    Returns:
+        sentences (list): the sentences of the article
+    """
+    crime, verb = rng.choice(CRIMES)
+    victim = full_name(rng)
+    slots = {"accused": full_name(rng), "victim": victim, "victim_first": victim.split()[0],
+             "place": rng.choice(PLACES), "court": rng.choice(COURTS), "crime": crime, "verb": verb,
+             "weapon": rng.choice(WEAPONS), "item": rng.choice(ITEMS), "prosecutor": full_name(rng),
+             "magistrate": full_name(rng), "age": rng.randint(18, 65), "victim_age": rng.randint(10, 80),
+             "amount": rng.randint(2, 500) * 10, "years": rng.randint(2, 20), "suspended": rng.randint(1, 2),
+             "date": f"{rng.randint(1, 28)} {rng.choice(MONTHS)}"}
+
+    # the first sentence introduces the case, the others are drawn from the remaining templates
+    body = [rng.choice(TEMPLATES[1:]) for _ in range(n_sentences - 1)]
+    return [template.format(**slots) for template in [TEMPLATES[0]] + body]
+
+# Function to edit an article into a near duplicate
+def near_duplicate(rng: random.Random, sentences: List[str], edit_rate: float) -> List[str]:
+    """
+    Edits an article the way another paper might: replaces some words and drops or adds a sentence
+
+    Args:
+        rng (random.Random): random number generator
+        sentences (list): the sentences of the original article
+        edit_rate (float): share of the words to replace
+
+    Returns:
+        sentences (list): the sentences of the edited article
+    """
+    edited = []
+    for sentence in sentences:
+        words = sentence.split(" ")
+        for idx in range(len(words)):
+            if rng.random() < edit_rate:
+                words[idx] = rng.choice(SURNAMES + PLACES + ["reportedly", "allegedly", "yesterday", "also"])
+        edited.append(" ".join(words))
+
+    if len(edited) > 2 and rng.random() < 0.5:
+        del edited[rng.randrange(1, len(edited))]
+    else:
+        edited.insert(rng.randrange(1, len(edited) + 1), new_article(rng, 2)[1])
+
+    return edited
+
+# Function to generate a corpus of articles
+def generate_articles(count: int, seed: int = 0, reprint_rate: float = 0.1, near_duplicate_rate: float = 0.1,
+                      min_sentences: int = 5, max_sentences: int = 25, edit_rate: float = 0.1) -> List[str]:
+    """
+    Generates the text of a synthetic corpus of crime articles
+
+    Args:
+        count (int): number of articles
+        seed (int): seed of the random number generator
+        reprint_rate (float): share of the articles that are exact copies of an earlier article
+        near_duplicate_rate (float): share of the articles that are edited copies of an earlier article
+        min_sentences (int): least number of sentences of a new article
+        max_sentences (int): largest number of sentences of a new article
+        edit_rate (float): share of the words replaced in a near duplicate
+
+    Returns:
+        articles (list): the text of each article
+    """
+    rng = random.Random(seed)
+    articles = []
+    for _ in range(count):
+        draw = rng.random()
+        if articles and draw < reprint_rate:
+            sentences = rng.choice(articles)
+        elif articles and draw < reprint_rate + near_duplicate_rate:
+            sentences = near_duplicate(rng, rng.choice(articles), edit_rate)
+        else:
+            sentences = new_article(rng, rng.randint(min_sentences, max_sentences))
+        articles.append(sentences)
+
+    return [" ".join(sentences) for sentences in articles]
+
+# Function to write a corpus to disk
+def write_corpus(directory: str, articles: List[str], packed: bool = False) -> str:
+    """
+    Writes articles as text files, or as a packed corpus, in a directory
+
+    Args:
+        directory (str): directory to write to. Created if it does not exist
+        articles (list): the text of each article
+        packed (bool): write <directory>/corpus.pack instead of one text file per article. Reprints
+                       are only written once to a packed corpus
+
+    Returns:
+        path (str): the path to pass to the similarity scripts
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    if packed:
+        pack_path = os.path.join(directory, f"corpus{PACK_EXTENSION}")
+        write_packed_corpus(pack_path, articles)
+        return pack_path
+
+    width = len(str(len(articles)))
+    for idx, text in enumerate(articles):
+        with open(os.path.join(directory, f"article-{idx:0{width}d}.txt"), "w") as file:
+            file.write(text)
+
+    return directory
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    articles = generate_articles(args.count, args.seed, args.reprint_rate, args.near_duplicate_rate,
+                                 args.min_sentences, args.max_sentences, args.edit_rate)
+    print(write_corpus(args.directory, articles, args.packed))
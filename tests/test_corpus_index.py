@@ -0,0 +1,28 @@
+import corpus_index
+
+
+def test_new_files(tmp_path):
+    paths = []
+    for number, text in enumerate(["first article", "second article", "first article"]):
+        path = tmp_path / f"article-{number}.txt"
+        path.write_text(text)
+        paths.append(str(path))
+
+    index = corpus_index.load_index(str(tmp_path / "index"))
+    added, hashes = corpus_index.new_files(index, paths[:2])
+    assert added == paths[:2]
+    index["files"], index["hashes"] = added, hashes
+    corpus_index.save_index(str(tmp_path / "index"), index)
+    index = corpus_index.load_index(str(tmp_path / "index"))
+
+    # a reprint of an indexed article is new, an unchanged article is not
+    assert corpus_index.new_files(index, paths) == ([paths[2]], [hashes[0]])
+
+    # an edited article is new
+    (tmp_path / "article-1.txt").write_text("second article, edited")
+    assert corpus_index.new_files(index, paths[:2])[0] == [paths[1]]
+
+
+def test_incremental_pairs():
+    assert corpus_index.incremental_pairs(2, 2).tolist() == [[0, 2], [1, 2], [0, 3], [1, 3], [2, 3]]
+    assert corpus_index.incremental_pairs(3, 0).tolist() == []
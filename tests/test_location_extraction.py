@@ -0,0 +1,37 @@
+import pytest
+from location_extraction import PlaceAutomaton, load_gazetteer
+
+
+@pytest.fixture(scope="module")
+def automaton():
+    return PlaceAutomaton(load_gazetteer())
+
+
+def places(automaton, text):
+    return [(text[start:end], automaton.places[numbers[0]]["name"]) for start, end, numbers in automaton.find(text)]
+
+
+def test_common_words_only_match_with_capitals(automaton):
+    assert places(automaton, "It was a love triangle, the waterfalls and headlands nearby.") == []
+    assert places(automaton, "He was arrested in Triangle and taken to WATERFALLS.") == [
+        ("Triangle", "Triangle"), ("WATERFALLS", "Waterfalls")]
+
+
+def test_case_sensitive_aliases(automaton):
+    assert places(automaton, "the hartley family") == []
+    assert places(automaton, "police in Hartley") == [("Hartley", "Chegutu")]
+
+
+def test_other_names_ignore_case(automaton):
+    assert places(automaton, "Riots in harare and MBARE") == [("harare", "Harare"), ("MBARE", "Mbare")]
+
+
+def test_longest_name_wins(automaton):
+    assert places(automaton, "taken to Mbare Police\nStation on Monday") == [
+        ("Mbare Police\nStation", "Mbare Police Station")]
+
+
+def test_gazetteer_without_case_column(tmp_path):
+    path = tmp_path / "places.csv"
+    path.write_text("name,aliases,kind,parent,latitude,longitude\nTriangle,,town,Masvingo,-21.0,31.4\n")
+    assert places(PlaceAutomaton(load_gazetteer(str(path))), "a love triangle") == [("triangle", "Triangle")]
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import minhash_lsh
+
+N_DOCS = 40
+
+
+@pytest.fixture
+def documents():
+    rng = np.random.default_rng(0)
+    words = [f"word{number}" for number in range(500)]
+    documents = [set(rng.choice(words, size=60, replace=False).tolist()) for _ in range(N_DOCS)]
+    # reprints, with a few words changed
+    for original, reprint in [(0, 10), (3, 20), (5, 30)]:
+        documents[reprint] = set(sorted(documents[original])[:55]) | {"new1", "new2", "new3", "new4", "new5"}
+    return documents
+
+
+def jaccard(documents, i, j):
+    return round(100 * len(documents[i] & documents[j]) / len(documents[i] | documents[j]))
+
+
+def test_candidates_contain_the_reprints(documents):
+    pairs = minhash_lsh.lsh_candidate_pairs(documents, threshold=0.5)
+    candidates = set(map(tuple, pairs.tolist()))
+    assert {(0, 10), (3, 20), (5, 30)} <= candidates
+    assert all(i < j for i, j in candidates)
+    assert pairs.tolist() == sorted(pairs.tolist())
+
+
+def test_sample_recall(documents):
+    pairs = minhash_lsh.lsh_candidate_pairs(documents, threshold=0.5)
+    scored = []
+
+    def score_pair(i, j):
+        scored.append((i, j))
+        return jaccard(documents, i, j)
+
+    recall, found, total = minhash_lsh.sample_recall(pairs, N_DOCS, N_DOCS, score_pair, 70)
+    assert (recall, found, total) == (1.0, 3, 3)
+    assert sorted(scored) == [(i, j) for i in range(N_DOCS) for j in range(i + 1, N_DOCS)]
+
+    # without candidates nothing similar is found
+    recall, found, total = minhash_lsh.sample_recall(pairs[:0], N_DOCS, N_DOCS, score_pair, 70)
+    assert (recall, found, total) == (0.0, 0, 3)
+
+    # a sample without similar pairs missed nothing
+    assert minhash_lsh.sample_recall(pairs, N_DOCS, 1, score_pair, 70) == (1.0, 0, 0)
+
+
+def test_oversized_buckets_keep_identical_signatures(capsys):
+    # 8 copies of one article and 8 variants that share its first band
+    signatures = np.tile(np.arange(8, dtype=np.int64), (16, 1))
+    signatures[8:, 4:] += np.arange(1, 9)[:, None]
+
+    pairs = minhash_lsh.candidate_pairs(signatures, 2, 4, max_bucket=5)
+    assert pairs.tolist() == [[i, j] for i in range(8) for j in range(i + 1, 8)]
+    assert "92 of their pairs" in capsys.readouterr().out
+
+    pairs = minhash_lsh.candidate_pairs(signatures, 2, 4, max_bucket=None)
+    assert len(pairs) == 16 * 15 // 2
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+import nlp_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(nlp_cache, "cache_directory", str(tmp_path / "cache"))
+    monkeypatch.setattr(nlp_cache, "max_bytes", 1 << 20)
+    return str(tmp_path / "cache")
+
+
+def test_cached_value_is_read_back(cache):
+    key = nlp_cache.cache_key(nlp_cache.cache_namespace("test"), "text")
+    assert nlp_cache.cache_get(key) is None
+    nlp_cache.cache_put(key, ["lemma", "list"])
+    assert nlp_cache.cache_get(key) == ["lemma", "list"]
+
+
+def test_entry_evicted_after_it_was_read_is_a_hit(cache, monkeypatch):
+    key = nlp_cache.cache_key(nlp_cache.cache_namespace("test"), "text")
+    nlp_cache.cache_put(key, ["lemma"])
+
+    # another process removes the entry between the read and the touch
+    def evicted(path, *args, **kwargs):
+        os.remove(path)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(nlp_cache.os, "utime", evicted)
+    assert nlp_cache.cache_get(key) == ["lemma"]
+    assert nlp_cache.cache_get(key) is None
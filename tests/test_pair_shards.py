@@ -0,0 +1,119 @@
+import csv
+import glob
+
+import pytest
+import pair_shards
+from pair_scheduler import pairs_in_range
+from result_sink import ResultSink
+
+N_DOCS = 23
+SHARDS = 3
+
+
+@pytest.fixture
+def files():
+    return [f"doc-{number:02d}" for number in range(N_DOCS)]
+
+
+def similarity(first, second):
+    return (first * 7 + second * 13) % 101
+
+
+def run_shard(filename, files, shard, min_similarity=None):
+    pairs = pairs_in_range(len(files), *pair_shards.shard_range(len(files), *shard))
+    scores = similarity(pairs[:, 0], pairs[:, 1])
+    with pair_shards.open_shard(filename, files, shard, min_similarity) as sink:
+        sink.write(pairs[:, 0], pairs[:, 1], scores)
+    pair_shards.write_manifest(filename, "test", files, shard, sink.rows, min_similarity)
+
+
+def read_rows(path):
+    with open(path, newline="") as filehandle:
+        return list(csv.reader(filehandle))[1:]
+
+
+def test_parse_shard():
+    assert pair_shards.parse_shard("2/8") == (2, 8)
+    for text in ("0/3", "4/3", "3"):
+        with pytest.raises(ValueError):
+            pair_shards.parse_shard(text)
+
+
+def test_shard_ranges_cover_every_pair_once():
+    ranges = [pair_shards.shard_range(N_DOCS, shard, SHARDS) for shard in range(1, SHARDS + 1)]
+    assert ranges[0][0] == 0 and ranges[-1][1] == N_DOCS * (N_DOCS - 1) // 2
+    assert all(previous[1] == following[0] for previous, following in zip(ranges, ranges[1:]))
+
+
+def test_merge_equals_an_unsharded_run(tmp_path, files):
+    unsharded = str(tmp_path / "unsharded")
+    pairs = pairs_in_range(N_DOCS, 0, N_DOCS * (N_DOCS - 1) // 2)
+    with ResultSink(unsharded, files, "csv", 40) as sink:
+        sink.write(pairs[:, 0], pairs[:, 1], similarity(pairs[:, 0], pairs[:, 1]))
+
+    sharded = str(tmp_path / "sharded")
+    for shard in range(1, SHARDS + 1):
+        run_shard(sharded, files, (shard, SHARDS), min_similarity=40)
+
+    assert pair_shards.merge(sharded) == sink.rows
+    assert read_rows(f"{sharded}.csv") == read_rows(f"{unsharded}.csv")
+    assert not glob.glob(f"{sharded}.shard-*")
+
+
+def test_missing_shard_is_not_merged(tmp_path, files):
+    filename = str(tmp_path / "sharded")
+    run_shard(filename, files, (1, SHARDS))
+    run_shard(filename, files, (3, SHARDS))
+
+    with pytest.raises(ValueError, match=r"shards \[2\] of 3 are missing"):
+        pair_shards.merge(filename)
+
+
+def test_shard_without_manifest_is_missing(tmp_path, files):
+    filename = str(tmp_path / "sharded")
+    for shard in range(1, SHARDS + 1):
+        run_shard(filename, files, (shard, SHARDS))
+    # a rerun of shard 2 that did not finish
+    pair_shards.open_shard(filename, files, (2, SHARDS)).close()
+
+    with pytest.raises(ValueError, match=r"shards \[2\] of 3 are missing"):
+        pair_shards.merge(filename)
+
+
+def test_shards_of_other_settings_are_not_merged(tmp_path, files):
+    filename = str(tmp_path / "sharded")
+    run_shard(filename, files, (1, SHARDS))
+    run_shard(filename, files, (2, SHARDS))
+    run_shard(filename, files, (3, SHARDS), min_similarity=10)
+
+    with pytest.raises(ValueError, match="another min_similarity"):
+        pair_shards.merge(filename)
+
+
+def test_duplicated_pair_is_not_merged(tmp_path, files):
+    filename = str(tmp_path / "sharded")
+    for shard in range(1, SHARDS + 1):
+        run_shard(filename, files, (shard, SHARDS), min_similarity=40)
+    # the last row of shard 2 written twice
+    path = f"{pair_shards.shard_name(filename, 2, SHARDS)}.csv"
+    with open(path) as filehandle:
+        last = filehandle.read().splitlines()[-1]
+    with open(path, "a") as filehandle:
+        filehandle.write(last + "\n")
+
+    with pytest.raises(ValueError, match="out of order or written twice"):
+        pair_shards.merge(filename)
+
+
+def test_pair_of_another_shard_is_not_merged(tmp_path, files):
+    filename = str(tmp_path / "sharded")
+    for shard in range(1, SHARDS + 1):
+        run_shard(filename, files, (shard, SHARDS))
+    # shard 1 ends with the first pair of shard 2, and shard 2 starts with it again
+    start = pair_shards.shard_range(N_DOCS, 2, SHARDS)[0]
+    first, second = pairs_in_range(N_DOCS, start, start + 1)[0]
+    with open(f"{pair_shards.shard_name(filename, 1, SHARDS)}.csv", "a", newline="") as filehandle:
+        csv.writer(filehandle).writerow([start, files[first], files[second], similarity(first, second)])
+
+    with pytest.raises(ValueError, match="outside of its range"):
+        pair_shards.merge(filename)
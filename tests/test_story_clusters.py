@@ -0,0 +1,111 @@
+import csv
+
+import pytest
+import story_clusters
+
+
+@pytest.fixture
+def articles(tmp_path):
+    paths = []
+    for number, size in enumerate([30, 10, 20, 40, 5]):
+        path = tmp_path / f"article-{number}.txt"
+        path.write_text("x" * size)
+        paths.append(str(path))
+    return paths
+
+
+def write_results(path, articles, pairs, append=False):
+    rows = []
+    if append:
+        with open(path, newline="") as filehandle:
+            rows = list(csv.reader(filehandle))[1:]
+    with open(path, "w", newline="") as filehandle:
+        writer = csv.writer(filehandle)
+        writer.writerow(["", "File_1", "File_2", "Similarity (%)"])
+        writer.writerows(rows)
+        writer.writerows((len(rows) + row, articles[i], articles[j], similarity)
+                         for row, (i, j, similarity) in enumerate(pairs))
+
+
+def read_clusters(name):
+    with open(f"{name}.csv", newline="") as filehandle:
+        return {row[1]: (int(row[2]), row[3]) for row in list(csv.reader(filehandle))[1:]}
+
+
+def test_union_keeps_the_lowest_id_and_longest_article(articles):
+    clusters = story_clusters.StoryClusters()
+    numbers = [clusters.article(filename) for filename in articles]
+    assert numbers == list(range(len(articles)))
+    assert clusters.article(articles[2]) == 2
+
+    clusters.union(4, 1)
+    clusters.union(1, 2)
+    cluster_ids, canonical = clusters.clusters()
+    assert cluster_ids == [0, 1, 1, 3, 1]
+    assert canonical == [0, 2, 2, 3, 2]
+
+    # the chain 4 - 1 - 2 joins the story of 0 through 3
+    clusters.union(3, 0)
+    clusters.union(2, 3)
+    assert clusters.clusters() == ([0] * 5, [3] * 5)
+    assert clusters.union(4, 0) == clusters.find(1)
+
+
+def test_equally_long_articles_keep_the_lower_number(tmp_path):
+    paths = []
+    for number in range(3):
+        path = tmp_path / f"article-{number}.txt"
+        path.write_text("same length")
+        paths.append(str(path))
+
+    clusters = story_clusters.StoryClusters()
+    clusters.add_pairs(paths[2:], paths[1:2], [90], 40)
+    clusters.add_pairs(paths[1:2], paths[:1], [90], 40)
+    assert clusters.clusters() == ([0, 0, 0], [0, 0, 0])
+
+
+def test_pairs_below_the_cutoff_are_not_linked(articles):
+    clusters = story_clusters.StoryClusters()
+    linked = clusters.add_pairs([articles[0], articles[1]], [articles[3], articles[2]], [39, 40], 40)
+    assert linked == 1
+    # article 3 is added as a story of its own
+    assert clusters.files == [articles[0], articles[1], articles[3], articles[2]]
+    assert clusters.clusters() == ([0, 1, 2, 1], [0, 3, 2, 3])
+
+
+def test_clusters_are_rebuilt_from_the_parents(articles):
+    clusters = story_clusters.StoryClusters()
+    clusters.add_pairs(articles[:3], articles[1:4], [90, 10, 90], 40)
+    rebuilt = story_clusters.StoryClusters(clusters.files, clusters.lengths, clusters.parents)
+    assert rebuilt.clusters() == clusters.clusters()
+    assert rebuilt.sizes[rebuilt.find(0)] == 2
+
+
+def test_state_follows_appended_rows(tmp_path, articles):
+    results, state, name = str(tmp_path / "results.csv"), str(tmp_path / "state.json"), str(tmp_path / "clusters")
+    write_results(results, articles, [(0, 1, 90), (2, 3, 10)])
+    story_clusters.main(results, name, 40, state_path=state)
+    write_results(results, articles, [(1, 2, 50)], append=True)
+    story_clusters.main(results, name, 40, state_path=state)
+
+    clusters = read_clusters(name)
+    assert clusters[articles[2]] == (0, articles[0])
+    assert clusters[articles[3]] == (3, articles[3])
+
+
+def test_state_of_a_rewritten_results_file_is_ignored(tmp_path, articles):
+    results, state, name = str(tmp_path / "results.csv"), str(tmp_path / "state.json"), str(tmp_path / "clusters")
+    write_results(results, articles, [(0, 1, 90), (0, 2, 90), (0, 3, 90)])
+    story_clusters.main(results, name, 40, state_path=state)
+
+    # a shorter file: the links of the previous rows are gone
+    write_results(results, articles, [(3, 4, 90)])
+    story_clusters.main(results, name, 40, state_path=state)
+    clusters = read_clusters(name)
+    assert clusters[articles[4]] == (0, articles[3])
+    assert articles[1] not in clusters
+
+    # a file of the same size with other rows
+    write_results(results, articles, [(1, 4, 90)])
+    story_clusters.main(results, name, 40, state_path=state)
+    assert read_clusters(name) == {articles[1]: (0, articles[1]), articles[4]: (0, articles[1])}
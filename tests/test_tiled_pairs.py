@@ -0,0 +1,99 @@
+import csv
+import os
+
+import numpy as np
+import pytest
+import result_sink
+import tiled_pairs
+
+N_DOCS = 70
+TILE = tiled_pairs.MIN_TILE
+
+
+@pytest.fixture
+def scores():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 101, size=(N_DOCS, N_DOCS))
+
+
+def score_tile(scores, rows, columns):
+    return scores[rows, columns]
+
+
+def run(name, files, scores, min_similarity=None):
+    # a budget of exactly TILE x TILE entries
+    sink, tile, checkpoint = tiled_pairs.tiled_sink("test", name, files, "csv", min_similarity,
+                                                    tiled_pairs.BYTES_PER_ENTRY * TILE * TILE)
+    assert tile == TILE
+    with sink:
+        tiled_pairs.run_tiles(score_tile, scores, len(files), tile, sink, min_similarity, checkpoint)
+
+
+def read_rows(name):
+    with open(f"{name}.csv", newline="") as filehandle:
+        return list(csv.reader(filehandle))[1:]
+
+
+def expected_pairs(files, scores, min_similarity=None):
+    return sorted((files[i], files[j], str(scores[i, j])) for i in range(N_DOCS) for j in range(i + 1, N_DOCS)
+                  if min_similarity is None or scores[i, j] >= min_similarity)
+
+
+def test_tiles_write_every_pair(tmp_path, scores):
+    files = [f"doc-{number}" for number in range(N_DOCS)]
+    name = str(tmp_path / "tiled")
+    run(name, files, scores, min_similarity=50)
+
+    rows = read_rows(name)
+    assert sorted(tuple(row[1:]) for row in rows) == expected_pairs(files, scores, 50)
+    assert [int(row[0]) for row in rows] == list(range(len(rows)))
+    assert not os.path.exists(f"{name}.csv.tiles.json")
+
+
+def test_interrupted_run_resumes_after_the_last_checkpoint(tmp_path, scores, monkeypatch, capsys):
+    files = [f"doc-{number}" for number in range(N_DOCS)]
+    name = str(tmp_path / "tiled")
+
+    write = result_sink.ResultSink.write
+    calls = []
+
+    def interrupted_write(self, *pairs):
+        calls.append(1)
+        if len(calls) == 6:
+            raise KeyboardInterrupt
+        return write(self, *pairs)
+
+    monkeypatch.setattr(result_sink.ResultSink, "write", interrupted_write)
+    with pytest.raises(KeyboardInterrupt):
+        run(name, files, scores)
+    assert os.path.exists(f"{name}.csv.tiles.json")
+
+    monkeypatch.setattr(result_sink.ResultSink, "write", write)
+    run(name, files, scores)
+    assert "after tile 5" in capsys.readouterr().out
+
+    rows = read_rows(name)
+    assert sorted(tuple(row[1:]) for row in rows) == expected_pairs(files, scores)
+    assert [int(row[0]) for row in rows] == list(range(N_DOCS * (N_DOCS - 1) // 2))
+    assert not os.path.exists(f"{name}.csv.tiles.json")
+
+
+def test_checkpoint_of_other_settings_is_ignored(tmp_path, scores):
+    files = [f"doc-{number}" for number in range(N_DOCS)]
+    name = str(tmp_path / "tiled")
+    (tmp_path / "tiled.csv").write_text("rows of another run\n")
+    # a checkpoint of a run without a minimum similarity
+    tiled_pairs.save_checkpoint(f"{name}.csv", tiled_pairs.run_settings("test", files, TILE), {"tiles": 3, "rows": 9, "bytes": 5})
+
+    run(name, files, scores, min_similarity=50)
+    rows = read_rows(name)
+    assert sorted(tuple(row[1:]) for row in rows) == expected_pairs(files, scores, 50)
+    assert int(rows[0][0]) == 0
+
+
+def test_parse_memory():
+    assert tiled_pairs.parse_memory("512M") == 512 * 1024 ** 2
+    assert tiled_pairs.parse_memory("1.5g") == int(1.5 * 1024 ** 3)
+    assert tiled_pairs.parse_memory("1000") == 1000
+    with pytest.raises(ValueError):
+        tiled_pairs.parse_memory("lots")
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from vocabulary import Vocabulary, LocalDictionary
+
+gensim = pytest.importorskip("gensim")
+
+DOCUMENTS = [
+    ["the", "minister", "said", "the", "budget", "Harare"],
+    ["Budget", "zebra", "apple", "the", "ZANU-PF", "2023"],
+    ["école", "apple", "Émile", "minister", "zebra", "a"],
+    [],
+    ["said", "said", "a", "Zimbabwe", "100", "10"],
+]
+
+
+@pytest.fixture
+def vocabulary():
+    vocabulary = Vocabulary()
+    # tokens interned in another order than the string order, as the documents of a run are
+    vocabulary.intern(["zebra", "Zimbabwe", "said", "école", "10"])
+    return vocabulary
+
+
+def test_ids_follow_gensim(vocabulary):
+    documents = [vocabulary.intern(document) for document in DOCUMENTS]
+    dictionary = LocalDictionary(vocabulary.ranks(), documents)
+    expected = gensim.corpora.Dictionary(DOCUMENTS)
+
+    assert {vocabulary.tokens[token]: token_id for token, token_id in dictionary.token2id.items()} == expected.token2id
+    assert len(dictionary) == len(expected)
+
+
+def test_doc2bow_follows_gensim(vocabulary):
+    documents = [vocabulary.intern(document) for document in DOCUMENTS]
+    dictionary = LocalDictionary(vocabulary.ranks(), documents[:2])
+    expected = gensim.corpora.Dictionary(DOCUMENTS[:2])
+
+    for document, tokens in zip(documents, DOCUMENTS):
+        assert dictionary.doc2bow(document) == expected.doc2bow(tokens)
+    # tokens without an ID are left out unless allow_update is set
+    assert len(dictionary) == len(expected)
+    assert dictionary.doc2bow(documents[2], allow_update=True) == expected.doc2bow(DOCUMENTS[2], allow_update=True)
+    assert dictionary.doc2bow(np.zeros(0, dtype=np.int32)) == []
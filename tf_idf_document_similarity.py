@@ -5,42 +5,97 @@
     index to determine if two documents are similar or not. 
 
     Tip: Do not compare more than 100 files at a time. You might want to start with a few files 
-         depending on your memory resources.
+         depending on your memory resources. For large archives, --mode corpus with --memory-limit
+         scores the pairs in tiles that fit in the given memory (see tiled_pairs.py).
 
 """
 
 import argparse
 import os
-from gensim import similarities
-import pandas as pd
-import gensim
-import nltk
 import numpy as np
 import sys
-from nltk.tokenize import word_tokenize, sent_tokenize
-from nltk.corpus import stopwords
+from scipy import sparse
+from minhash_lsh import MAX_BUCKET_SIZE, lsh_candidate_pairs, sample_recall
+from corpus_index import load_index, save_index, new_files, incremental_pairs
+import nlp_cache
+import stage_profiler
+from pair_scheduler import run_pair_chunks
+from result_sink import ResultSink
+from tiled_pairs import parse_memory, tiled_sink, run_tiles
+from pair_shards import parse_shard, shard_range, shard_pairs, open_shard, write_manifest
+from packed_corpus import is_packed_corpus, is_document_path, document_paths, read_document
+from lazy_nltk import word_tokenize, sent_tokenize, stopwords, NLTK_VERSION
+from vocabulary import Vocabulary, LocalDictionary
+import prefetch
 
 # Create an argument parser
 parser = argparse.ArgumentParser()
 
 # Add the positional arguments
-parser.add_argument("directory", help="path to directory with files to compare")
+parser.add_argument("directory", help="path to directory with files to compare, or to a packed corpus (.pack file) or article store (.articles.parquet file)")
 parser.add_argument("filename", help="name of csv file (without .csv extension) to use for the similarity indices")
 
-args = parser.parse_args()
+# Add the optional arguments
+parser.add_argument("--mode", choices=["pairwise", "corpus"], default="pairwise",
+                    help="'pairwise' builds a TF-IDF model for every pair of files, 'corpus' builds one TF-IDF model over all files")
+parser.add_argument("--candidates", choices=["all", "lsh"], default="all",
+                    help="'all' scores every pair of files, 'lsh' only scores the pairs found by MinHash/LSH")
+parser.add_argument("--lsh-threshold", type=float, default=0.3,
+                    help="Jaccard similarity of the word sets used to choose the LSH bands and rows")
+parser.add_argument("--num-perm", type=int, default=128, help="length of the MinHash signatures")
+parser.add_argument("--bands", type=int, help="number of LSH bands (overrides --lsh-threshold together with --rows)")
+parser.add_argument("--rows", type=int, help="number of rows in each LSH band")
+parser.add_argument("--max-bucket", type=int, default=MAX_BUCKET_SIZE,
+                    help="LSH buckets with more files only pair the files with identical signatures")
+parser.add_argument("--recall-sample", type=int, default=0,
+                    help="number of files to sample to report the LSH recall against scoring every pair")
+parser.add_argument("--cutoff", type=int, default=40, help="similarity (%%) used as the cut-off when reporting the LSH recall")
+parser.add_argument("--index", dest="index_directory",
+                    help="directory of a persisted corpus index. Only files that are not in the index are compared "
+                         "(to each other and to the indexed files) and the results are appended to the CSV file")
+parser.add_argument("--read-threads", type=int, default=8,
+                    help="number of threads reading the files ahead of the tokenizer (0 reads them one at a time)")
+parser.add_argument("--read-ahead", type=int, default=64, help="number of files read ahead of the tokenizer")
+parser.add_argument("--cache-dir", help="directory of the NLP cache shared by the similarity scripts (disabled if not given)")
+parser.add_argument("--cache-size", type=float, default=1024, help="size limit of the NLP cache in megabytes")
+parser.add_argument("--memory-limit", type=parse_memory, metavar="SIZE",
+                    help="with --mode corpus, score every pair in tiles that fit in SIZE (e.g. 512M, 4G) instead of all "
+                         "at once. An interrupted run with csv output resumes from its last tile")
+parser.add_argument("--shard", type=parse_shard, metavar="I/N",
+                    help="only score the I-th of N ranges of the pairs (1 <= I <= N), for runs split over N machines. "
+                         "Writes FILENAME.shard-I-of-N.csv and a manifest, merged with pair_shards.py merge")
+parser.add_argument("--workers", type=int, default=1, help="number of processes used to score the pairs of files")
+parser.add_argument("--format", dest="output_format", choices=["csv", "parquet", "npz"], default="csv",
+                    help="format of the results file (the filename argument is used without its extension). npz needs --min-similarity")
+parser.add_argument("--min-similarity", type=int, help="only write pairs with at least this similarity (%%)")
+parser.add_argument("--profile", metavar="FILE", help="write the time spent in each stage and the counters of the run to FILE")
+parser.add_argument("--profile-format", choices=["json", "chrome"], default="json",
+                    help="'json' for the totals of each stage, 'chrome' for a Chrome trace of every stage call")
+parser.add_argument("--profile-sample", type=float, default=0, metavar="HZ",
+                    help="also sample the Python stack HZ times per second of CPU time, written to FILE.folded")
+
+# namespace of the NLTK sentence and word tokens in the NLP cache
+NLTK_TOKENS = nlp_cache.cache_namespace("nltk-tokens", NLTK_VERSION)
+
+# number of block sums computed at a time in corpus mode, so the (files x files) matrix of
+# block sums is never held in memory (32 MB of float64)
+BLOCK_SUM_ENTRIES = 1 << 22
 
 
 # Get full file paths
 def filePaths(directory_with_files):
   """
-  Gets the full path of each file in a directory
+  Gets the full path of each file in a directory, or the document path of each article
+  in a packed corpus (see packed_corpus.py)
 
     Args:
-      directory_with_files (str): path to directory that holds files
+      directory_with_files (str): path to directory that holds files, or to a .pack file
 
     Returns:
       filepaths (list): a list of full file paths 
   """
+  if is_packed_corpus(directory_with_files):
+    return document_paths(directory_with_files)
 
   # get a list of file names in directory
   list_of_files = os.listdir(directory_with_files) 
@@ -56,57 +111,132 @@ def get_file_contents(filename: str) -> str:
     Reads the contents of a file
 
     Args:
-      filename (str): full path to file
+      filename (str): full path to file, or document path of an article in a packed corpus
 
     Returns:
       filecontent (str): contents of file 
     """
     filecontent = ""
-    # check if file exists before trying to read from it
-    if os.path.exists(filename):
-        with open(filename, 'r') as filehandle:
-            filecontent = filehandle.read()
-    else:
-        sys.exit(f"File does not exists: {filename}")
-
+    with stage_profiler.stage("read"):
+        # articles in a packed corpus are sliced out of its memory map
+        if is_document_path(filename):
+            filecontent = read_document(filename)
+        # check if file exists before trying to read from it
+        elif os.path.exists(filename):
+            with open(filename, 'r') as filehandle:
+                filecontent = filehandle.read()
+        else:
+            sys.exit(f"File does not exists: {filename}")
+
+    if stage_profiler.enabled:
+        stage_profiler.count("bytes_read", len(filecontent.encode("utf-8")))
     return filecontent
 
+# Split text into sentences and words, reusing the results of previous runs
+def sentence_words(text):
+    """
+    Splits text into sentences and each sentence into words. The result is kept in the NLP
+    cache, where check_document_similarity.py finds it too.
+
+    Args:
+      text (str): contents of a file
+
+    Returns:
+      sentences (list): a list of word lists, one for each sentence in the text
+    """
+    with stage_profiler.stage("tokenize"):
+        sentences = nlp_cache.cached(NLTK_TOKENS, text, lambda: [word_tokenize(line) for line in sent_tokenize(text)])
+
+    if stage_profiler.enabled:
+        stage_profiler.count("sentences", len(sentences))
+        stage_profiler.count("tokens", sum(len(words) for words in sentences))
+    return sentences
+
 # Compute how similar two files are as a percentage
 def similarity(file_1, file_2):
-    
-    file1_docs = []
+    # intern the words of both files into a vocabulary of their own
+    vocabulary = Vocabulary(stopwords.words("english"))
 
-    file2_docs = []
+    return encoded_similarity(encode_file(file_1, vocabulary), encode_file(file_2, vocabulary), vocabulary.ranks())
 
-    avg_sims = []
+# Split a file into sentences of token IDs, minus the stopwords
+def encode_file(filename, vocabulary):
+    """
+    Splits a file into sentences and each sentence into the token IDs of its lower case words,
+    minus the stopwords
 
-    # get the English stopwords
-    stopwords_en = stopwords.words("english")
+    Args:
+      filename (str): full path to file
+      vocabulary (vocabulary.Vocabulary): vocabulary the words are interned into, created with
+                                          the stopwords to remove
 
-    # open file and tokenize into Sentences
-    fileContents = get_file_contents(file_1)
-    # split file contents into sentences
-    sentence_tokens = sent_tokenize(fileContents)
-    # place the sentences into a list
-    for line in sentence_tokens:
-        file1_docs.append(line)
+    Returns:
+      sentences (list): a numpy.int32 array of token IDs for each sentence in the file
+    """
+    return encode_text(get_file_contents(filename), vocabulary)
 
-    # tokenize each sentence into words minus the stopwords like 'the', 'should' etc      
-    gen_docs = [[w.lower() for w in word_tokenize(text) if w not in stopwords_en] 
-                for text in file1_docs]
+# Split text into sentences of token IDs, minus the stopwords
+def encode_text(text, vocabulary):
+    """
+    Splits text into sentences of token IDs, see encode_file()
 
-    # create a dictionary - each word will be given a unique Index
-    dictionary = gensim.corpora.Dictionary(gen_docs)
+    Args:
+      text (str): contents of a file
+      vocabulary (vocabulary.Vocabulary): vocabulary the words are interned into
 
-    # Create a Bag of Words - this is an object that contains the word ID and its frequency in each document.
-    # Document can refer to a sentence or paragraph
-    # Corpus is typically a 'collection of documents as a bag of words'
-    corpus = [dictionary.doc2bow(gen_doc) for gen_doc in gen_docs]
+    Returns:
+      sentences (list): a numpy.int32 array of token IDs for each sentence in the text
+    """
+    return encode_sentences(sentence_words(text), vocabulary)
 
-    # TF-IDF (Term Frequency - Inverse Document Frequency) --> is also a bag of words, however it 
-    # calculates the weight of words that appear frequently across documents. Words that appear more 
-    # frequently across a document get smaller weights.
-    tf_idf = gensim.models.TfidfModel(corpus)
+# Convert sentences of words into sentences of token IDs, minus the stopwords
+def encode_sentences(sentences, vocabulary):
+    """
+    Converts sentences of words into the token IDs of their lower case words, minus the stopwords
+
+    Args:
+      sentences (list): a list of word lists, as returned by sentence_words()
+      vocabulary (vocabulary.Vocabulary): vocabulary the words are interned into
+
+    Returns:
+      sentences (list): a numpy.int32 array of token IDs for each sentence
+    """
+    return [vocabulary.normalize(ids) for ids in vocabulary.intern_sentences(sentences)]
+
+# Compute how similar two tokenized files are as a percentage
+def encoded_similarity(file1_docs, file2_docs, ranks):
+    """
+    Builds a TF-IDF model and sentence index over the sentences of the first file and queries
+    it with each sentence of the second file
+
+    Args:
+      file1_docs (list): token ID arrays of the sentences of the first file, from encode_file()
+      file2_docs (list): token ID arrays of the sentences of the second file
+      ranks (list): ranks of the tokens in string order, from Vocabulary.ranks()
+
+    Returns:
+      percentage_of_similarity (int): similarity of the files as a percentage
+    """
+    # gensim takes a while to import, so it is only imported once it is needed
+    import gensim
+
+    avg_sims = []
+
+    with stage_profiler.stage("dictionary"):
+        # create a dictionary - each word will be given a unique Index, in the same order
+        # gensim.corpora.Dictionary gives them to the words
+        dictionary = LocalDictionary(ranks, file1_docs)
+
+        # Create a Bag of Words - this is an object that contains the word ID and its frequency in each document.
+        # Document can refer to a sentence or paragraph
+        # Corpus is typically a 'collection of documents as a bag of words'
+        corpus = [dictionary.doc2bow(gen_doc) for gen_doc in file1_docs]
+
+    with stage_profiler.stage("tfidf"):
+        # TF-IDF (Term Frequency - Inverse Document Frequency) --> is also a bag of words, however it 
+        # calculates the weight of words that appear frequently across documents. Words that appear more 
+        # frequently across a document get smaller weights.
+        tf_idf = gensim.models.TfidfModel(corpus)
 
     # make sure you do not have another folder/directory named "sims-workdir" in your workspace
     temp_directory = "sims-workdir/"
@@ -117,35 +247,33 @@ def similarity(file_1, file_2):
 
     # Create a Similarity measure object --> The Similarity class builds an index for a given set of 
     # documents. The Similarity class splits the index into several smaller sub-indexes, which are 
-    # disk-based.
-    sims = gensim.similarities.Similarity(temp_directory, tf_idf[corpus],
-                                        num_features=len(dictionary))
-
-    # open file and tokenize into Sentences
-    fileContents_2 = get_file_contents(file_2)
-    # split file contents into sentences
-    sentence_tokens_2 = sent_tokenize(fileContents_2)
-    # place the sentences into a list
-    for line in sentence_tokens_2:
-        file2_docs.append(line)
-                
-    for line in file2_docs:
-        # tokenize each word in a sentence
-        query_doc = [w.lower() for w in word_tokenize(line) if w not in stopwords_en]
-        # update the existing dictionary and create Bag of Words
-        query_doc_bow = dictionary.doc2bow(query_doc)    
-        # perform a similarity query (file_2) against the corpus (created from file_1)
-        query_doc_tf_idf = tf_idf[query_doc_bow]
-        # print (document/sentence_number, document/sentence_similarity)
-        #print(f"Comparing Result: {sims[query_doc_tf_idf]}")
-        # calculate sum of similarities for each sentence in file_2
-        sum_of_sims = (np.sum(sims[query_doc_tf_idf], dtype=np.float32))
-        # calculate the averahe of similarity for each sentence in file_2
-        avg = sum_of_sims / len(file1_docs)
-        #print(f"Avg: {avg}")
-        # add average values into an array
-        avg_sims.append(avg)
-    
+    # disk-based. The shards are prefixed with the process ID so parallel workers do not share them.
+    with stage_profiler.stage("similarity_index"):
+        sims = gensim.similarities.Similarity(os.path.join(temp_directory, str(os.getpid())), tf_idf[corpus],
+                                            num_features=len(dictionary))
+
+    with stage_profiler.stage("query"):
+        for query_doc in file2_docs:
+            # create the Bag of Words of the sentence, leaving out the words file_1 does not have
+            query_doc_bow = dictionary.doc2bow(query_doc)    
+            # perform a similarity query (file_2) against the corpus (created from file_1)
+            query_doc_tf_idf = tf_idf[query_doc_bow]
+            # print (document/sentence_number, document/sentence_similarity)
+            #print(f"Comparing Result: {sims[query_doc_tf_idf]}")
+            # calculate sum of similarities for each sentence in file_2
+            sum_of_sims = (np.sum(sims[query_doc_tf_idf], dtype=np.float32))
+            # calculate the averahe of similarity for each sentence in file_2
+            avg = sum_of_sims / len(file1_docs)
+            #print(f"Avg: {avg}")
+            # add average values into an array
+            avg_sims.append(avg)
+    stage_profiler.count("queries", len(file2_docs))
+
+    if stage_profiler.enabled:
+        # the shards of the index are written to disk on the first query
+        stage_profiler.count("shard_bytes_written", sum(os.path.getsize(shard.fullname()) for shard in sims.shards
+                                                        if os.path.exists(shard.fullname())))
+
     # compute the total average 
     total_avg = np.sum(avg_sims, dtype=np.float32)    
     
@@ -159,33 +287,479 @@ def similarity(file_1, file_2):
     
     return percentage_of_similarity
      
-def main(directory, csv_filename):
+# Split text into sentences and tokenize each sentence into words
+def tokenize_text(text, stopwords_en):
+    """
+    Splits text into sentences and each sentence into lower case words, minus the stopwords
+
+    Args:
+      text (str): contents of a file
+      stopwords_en (set): words to remove from the sentences
+
+    Returns:
+      sentences (list): a list of word lists, one for each sentence in the text
+    """
+    return remove_stopwords(sentence_words(text), stopwords_en)
+
+# Lower case the words of sentences, minus the stopwords
+def remove_stopwords(sentences, stopwords_en):
+    """
+    Args:
+      sentences (list): a list of word lists, as returned by sentence_words()
+      stopwords_en (set): words to remove from the sentences
+
+    Returns:
+      sentences (list): the lower case words of each sentence, minus the stopwords
+    """
+    return [[w.lower() for w in words if w not in stopwords_en] for words in sentences]
+
+# Tokenize every file once
+def tokenize_files(files):
+    """
+    Splits every file into sentences of words, minus the stopwords
+
+    Args:
+      files (list): full paths to the files to compare
+
+    Returns:
+      tokenized_files (list): the sentences of each file as returned by tokenize_text()
+    """
+    # get the English stopwords once for the whole corpus
+    stopwords_en = set(stopwords.words("english"))
+
+    # the files are read ahead on other threads while the previous ones are tokenized
+    tokenized_files = [tokenize_text(text, stopwords_en) for text in prefetch.prefetch(files, get_file_contents, len)]
+
+    return tokenized_files
+
+# Read every file once into sentences of words and sentences of token IDs
+def preprocess_files(files, vocabulary=None, tokenize=True):
+    """
+    Reads and splits every file once, for both the corpus-wide dictionary and the pairwise scorer
+
+    Args:
+      files (list): full paths to the files to compare
+      vocabulary (vocabulary.Vocabulary): vocabulary the words are interned into. The files are
+                                          not encoded if None
+      tokenize (bool): also return the sentences of words, minus the stopwords
+
+    Returns:
+      tokenized_files, encoded_files (tuple): the sentences of each file as returned by
+                                              tokenize_text() and by encode_file(), None for the
+                                              ones not asked for
+    """
+    stopwords_en = set(stopwords.words("english"))
+    tokenized_files = [] if tokenize else None
+    encoded_files = [] if vocabulary is not None else None
+
+    # the files are read ahead on other threads while the previous ones are tokenized
+    for text in prefetch.prefetch(files, get_file_contents, len):
+        sentences = sentence_words(text)
+        if tokenize:
+            tokenized_files.append(remove_stopwords(sentences, stopwords_en))
+        if vocabulary is not None:
+            encoded_files.append(encode_sentences(sentences, vocabulary))
+
+    return tokenized_files, encoded_files
+
+# Build one dictionary over the sentences of all files
+def build_dictionary(tokenized_files):
+    """
+    Builds a single dictionary over the sentences of all files and converts every sentence
+    into a Bag of Words
+
+    Args:
+      tokenized_files (list): the sentences of each file as returned by tokenize_files()
+
+    Returns:
+      dictionary (gensim.corpora.Dictionary): the words of all files and their document frequencies
+      file_bows (list): the Bag of Words of each sentence, grouped by file
+    """
+    import gensim
+
+    dictionary = gensim.corpora.Dictionary()
+    file_bows = add_to_dictionary(dictionary, tokenized_files)
+
+    return dictionary, file_bows
+
+# Add the sentences of more files to a dictionary
+def add_to_dictionary(dictionary, tokenized_files):
+    """
+    Adds the sentences of files to a dictionary, which updates the document frequencies the
+    TF-IDF weights are computed from. The IDs of the words already in the dictionary do not
+    change, so Bags of Words created earlier remain valid.
+
+    Args:
+      dictionary (gensim.corpora.Dictionary): dictionary to update
+      tokenized_files (list): the sentences of each file as returned by tokenize_files()
+
+    Returns:
+      file_bows (list): the Bag of Words of each sentence, grouped by file
+    """
+    file_bows = []
+    with stage_profiler.stage("dictionary"):
+        for sentences in tokenized_files:
+            # prune_at=None so that rare words are never removed, which would change word IDs
+            dictionary.add_documents(sentences, prune_at=None)
+            file_bows.append([dictionary.doc2bow(sentence) for sentence in sentences])
+
+    return file_bows
+
+# Build one TF-IDF model and sentence index over all files
+def build_corpus_index(dictionary, file_bows):
+    """
+    Builds a single TF-IDF model over the sentences of all files, and keeps the TF-IDF vectors
+    of every sentence in one in-memory sparse matrix.
+
+    Args:
+      dictionary (gensim.corpora.Dictionary): dictionary returned by build_dictionary()
+      file_bows (list): the Bag of Words of each sentence, grouped by file
+
+    Returns:
+      sentence_vectors (scipy.sparse.csr_matrix): (sentences x words) matrix of L2 normalised TF-IDF vectors
+      sentence_counts (numpy.ndarray): number of sentences in each file, in the same order as files
+    """
+    import gensim
+
+    corpus = [bow for bows in file_bows for bow in bows]
+    sentence_counts = np.array([len(bows) for bows in file_bows], dtype=np.int64)
+
+    with stage_profiler.stage("tfidf"):
+        # the IDF weights come from the document frequencies of the dictionary, which are the
+        # same as the ones TfidfModel would count from the corpus of all sentences
+        tf_idf = gensim.models.TfidfModel(dictionary=dictionary)
+
+    with stage_profiler.stage("sentence_index"):
+        # each row is the TF-IDF vector of a sentence. TfidfModel normalises the vectors, so the
+        # product of two rows is the cosine similarity computed by gensim.similarities.Similarity
+        sentence_vectors = gensim.matutils.corpus2csc(tf_idf[corpus], num_terms=len(dictionary),
+                                                      num_docs=len(corpus)).T.tocsr()
+
+    return sentence_vectors, sentence_counts
+
+# Compute how similar every file is to the files after it
+def corpus_similarities(sentence_vectors, sentence_counts):
+    """
+    Computes the similarity of every pair of files from the sentence index built by
+    build_corpus_index(), one file after the other.
+
+    For a pair (file_1, file_2), similarity() sums the similarities between each sentence of
+    file_2 and each sentence of file_1, i.e. the sum of the (file_2 x file_1) block of the
+    sentence similarity matrix, and divides it by the number of sentences in file_1. The sum of
+    a block equals the dot product of the summed sentence vectors of both files, so the block
+    sums of a group of files come from one sparse matrix product. The groups hold at most
+    BLOCK_SUM_ENTRIES block sums, so memory does not grow with the square of the number of files.
+
+    Args:
+      sentence_vectors (scipy.sparse.csr_matrix): TF-IDF vectors of the sentences of all files
+      sentence_counts (numpy.ndarray): number of sentences in each file
+
+    Yields:
+      block_sums (numpy.ndarray): for each file idx, the sums of the sentence similarities of
+                                  the pairs (idx, jdx), jdx > idx
+    """
+    file_vectors = file_sentence_sums(sentence_vectors, sentence_counts)
+    n_files = len(sentence_counts)
+    group = max(1, BLOCK_SUM_ENTRIES // max(n_files, 1))
+
+    for start in range(0, n_files, group):
+        stop = min(start + group, n_files)
+        block_sums = (file_vectors[start:stop] @ file_vectors[start:].T).toarray()
+        for idx in range(start, stop):
+            yield block_sums[idx - start, idx - start + 1:]
+
+# Sum the sentence vectors of each file
+def file_sentence_sums(sentence_vectors, sentence_counts):
+    """
+    Adds up the TF-IDF vectors of the sentences of each file
+
+    Args:
+      sentence_vectors (scipy.sparse.csr_matrix): TF-IDF vectors of the sentences of all files
+      sentence_counts (numpy.ndarray): number of sentences in each file
+
+    Returns:
+      file_vectors (scipy.sparse.csr_matrix): (files x words) matrix of summed sentence vectors
+    """
+    # matrix that maps each sentence to the file it comes from
+    owners = np.repeat(np.arange(len(sentence_counts)), sentence_counts)
+    membership = sparse.csr_matrix((np.ones(len(owners)), (owners, np.arange(len(owners)))),
+                                   shape=(len(sentence_counts), len(owners)))
+
+    file_vectors = membership @ sentence_vectors
+
+    return file_vectors
+
+# Convert the similarities of a pair of files into a percentage
+def block_percentage(block_sum, file1_sentences):
+    """
+    Converts the sum of the sentence similarities of two files into a percentage
+
+    Args:
+      block_sum (float): sum of the similarities between the sentences of both files
+      file1_sentences (int): number of sentences in the first file
+
+    Returns:
+      percentage_of_similarity (int): how similar the files are as a percentage
+    """
+    # to avoid division by zero
+    total_avg = 0
+    if file1_sentences != 0:
+        total_avg = block_sum / file1_sentences
+
+    # round the value and multiply by 100 to convert it to a percentage
+    percentage_of_similarity = round(float(total_avg) * 100)
+
+    # if percentage is greater than 100
+    # that means documents are almost similar
+    if percentage_of_similarity >= 100:
+        percentage_of_similarity = 100
+
+    return percentage_of_similarity
+
+# Convert the similarities of many pairs of files into percentages
+def block_percentages(block_sums, file1_sentences):
+    """
+    Converts sums of sentence similarities into percentages the same way as block_percentage()
+
+    Args:
+      block_sums (numpy.ndarray): sums of the similarities between the sentences of pairs of files
+      file1_sentences (numpy.ndarray): number of sentences in the first file of each pair,
+                                       broadcast against block_sums
+
+    Returns:
+      percentages (numpy.ndarray): how similar the files are as percentages
+    """
+    # to avoid division by zero
+    averages = np.zeros(np.broadcast(block_sums, file1_sentences).shape, dtype=np.float64)
+    np.divide(block_sums, file1_sentences, out=averages, where=file1_sentences != 0)
+
+    # np.rint rounds halves to even, the same as round()
+    return np.minimum(np.rint(averages * 100), 100).astype(np.int64)
+
+# Score a tile of pairs of files with the corpus-wide TF-IDF model
+def score_tile_corpus(data, rows, columns):
+    """
+    Computes the similarity of the files of a block of rows to the files of a block of columns,
+    used by the tiled executor (see tiled_pairs.py)
+
+    Args:
+      data (tuple): the summed sentence vectors and the number of sentences of each file
+      rows (slice): indices of the first files of the pairs
+      columns (slice): indices of the second files of the pairs
+
+    Returns:
+      percentages (numpy.ndarray): (rows x columns) similarities as percentages
+    """
+    file_vectors, sentence_counts = data
+    block_sums = (file_vectors[rows] @ file_vectors[columns].T).toarray()
+    return block_percentages(block_sums, sentence_counts[rows][:, None])
+
+# Score pairs of files with the corpus-wide TF-IDF model
+def score_pairs_corpus(data, pairs):
+    """
+    Scores pairs of files from their summed sentence vectors, used by the worker processes
+
+    Args:
+      data (tuple): the summed sentence vectors and the number of sentences of each file
+      pairs (numpy.ndarray): (pairs x 2) array of file indices
+
+    Returns:
+      percentages (list): similarity of each pair as a percentage
+    """
+    file_vectors, sentence_counts = data
+    block_sums = np.asarray(file_vectors[pairs[:, 0]].multiply(file_vectors[pairs[:, 1]]).sum(axis=1)).ravel()
+    return [block_percentage(block_sum, sentence_counts[idx]) for block_sum, idx in zip(block_sums, pairs[:, 0])]
+
+# Score pairs of files with a TF-IDF model for each pair
+def score_pairs_pairwise(data, pairs):
+    """
+    Scores pairs of files with encoded_similarity(), used by the worker processes
+
+    Args:
+      data (tuple): the sentence token ID arrays of each file, from encode_file(), and the
+                    ranks of the tokens, from Vocabulary.ranks()
+      pairs (numpy.ndarray): (pairs x 2) array of file indices
+
+    Returns:
+      percentages (list): similarity of each pair as a percentage
+    """
+    encoded_files, ranks = data
+    return [encoded_similarity(encoded_files[idx], encoded_files[jdx], ranks) for idx, jdx in pairs]
+
+def main(directory, csv_filename, mode="pairwise", candidates="all", lsh_threshold=0.3,
+         num_perm=128, bands=None, rows=None, recall_sample=0, cutoff=40, index_directory=None,
+         workers=1, output_format="csv", min_similarity=None, memory_limit=None, shard=None, max_bucket=MAX_BUCKET_SIZE):
+    import gensim
 
-    d = []
     files = []
 
     # List containing full paths to our files to compare
     files = filePaths(directory)
+    if shard is not None:
+        # every machine of a sharded run must number the files the same way
+        files = sorted(files)
+    stage_profiler.count("documents", len(files))
+
+    # Tokenize every file once into arrays of token IDs for the pairwise scorer. The stopwords are
+    # flagged once for each word of the vocabulary instead of being looked up for each word of each pair
+    vocabulary = Vocabulary(stopwords.words("english")) if mode == "pairwise" else None
+
+    if index_directory is not None:
+        # Only read the files that are not in the index yet: add their sentences to the dictionary
+        # of the indexed files, and their token IDs to the token IDs of the indexed files
+        index = load_index(index_directory)
+        added_files, added_hashes = new_files(index, files)
+        n_existing = len(index["files"])
+        files = index["files"] + added_files
+        dictionary = index["shared"].get("dictionary", gensim.corpora.Dictionary())
+        if "encoded" in index["shared"]:
+            vocabulary = index["shared"]["vocabulary"]
+        else:
+            # indexes saved before the token IDs were kept in them are encoded once from their files
+            vocabulary = Vocabulary(stopwords.words("english"))
+            _, index["shared"]["encoded"] = preprocess_files(index["files"], vocabulary, tokenize=False)
+        tokenized_files, added_encoded = preprocess_files(added_files, vocabulary)
+        file_bows = index["documents"] + add_to_dictionary(dictionary, tokenized_files)
+        encoded_files = index["shared"]["encoded"] + added_encoded
+    elif mode == "corpus" or candidates == "lsh":
+        tokenized_files, encoded_files = preprocess_files(files, vocabulary)
+        dictionary, file_bows = build_dictionary(tokenized_files)
+    else:
+        _, encoded_files = preprocess_files(files, vocabulary, tokenize=False)
 
-    # Loop through all files and compare each file to every other file
-    for idx, file_1 in enumerate(files):
-        for file_2 in files[idx + 1: ]:  
-            # compute similarity
-            similarity_percentage = similarity(file_1, file_2)
-            # append data to a List of dictionaries
-            d.append({"File_1": file_1, "File_2": file_2, "Similarity (%)": similarity_percentage})
+    if mode == "corpus":
+        # Build the TF-IDF model and sentence index once for all files
+        sentence_vectors, sentence_counts = build_corpus_index(dictionary, file_bows)
+    else:
+        ranks = vocabulary.ranks()
+
+    # pairs of files to compare, None for every pair
+    pairs = None
+
+    if candidates == "lsh":
+        # Only compare the pairs of files whose MinHash signatures collide in an LSH band
+        word_sets = [set(dictionary[word_id] for bow in bows for word_id, _ in bow) for bows in file_bows]
+        pairs = lsh_candidate_pairs(word_sets, lsh_threshold, num_perm, bands, rows, max_bucket=max_bucket)
+        if index_directory is not None:
+            # pairs of indexed files have been compared in previous runs
+            pairs = pairs[pairs[:, 1] >= n_existing]
+        print(f"LSH candidate pairs: {len(pairs)} of {len(files) * (len(files) - 1) // 2}")
+
+        if recall_sample > 0:
+            if mode == "corpus":
+                file_vectors = file_sentence_sums(sentence_vectors, sentence_counts)
+                score_pair = lambda i, j: block_percentage(file_vectors[i].multiply(file_vectors[j]).sum(), sentence_counts[i])
+            else:
+                score_pair = lambda i, j: encoded_similarity(encoded_files[i], encoded_files[j], ranks)
+            recall, found, total = sample_recall(pairs, len(files), recall_sample, score_pair, cutoff)
+            print(f"LSH recall on {min(recall_sample, len(files))} sampled files: {recall:.1%} "
+                  f"({found} of {total} pairs at or above {cutoff}%)")
+
+    elif index_directory is not None:
+        # Compare the new files to the indexed files and to each other
+        pairs = incremental_pairs(n_existing, len(added_files))
+
+    # A shard only scores its range of the pair index space, or the candidate pairs in it
+    pair_range = None
+    if shard is not None:
+        pair_range = shard_range(len(files), *shard)
+        if pairs is not None:
+            pairs = shard_pairs(pairs, len(files), pair_range)
+
+    # Scoring every pair in this process in corpus mode computes the similarities of all pairs at
+    # once, unless a memory limit is given. The pairs are then scored tile by tile
+    tiled = memory_limit is not None and mode == "corpus" and pairs is None and workers <= 1 and shard is None
+
+    # Write the results to disk as the pairs are scored. Incremental runs append to the
+    # results of the previous runs, continuing their row numbers
+    if tiled:
+        sink, tile, checkpoint = tiled_sink("tf_idf-corpus", csv_filename, files, output_format, min_similarity,
+                                            memory_limit)
+    elif shard is not None:
+        sink = open_shard(csv_filename, files, shard, min_similarity)
+    else:
+        sink = ResultSink(csv_filename, files, output_format, min_similarity, append=index_directory is not None,
+                          first_row=index["pairs"] if index_directory is not None else 0)
+
+    with stage_profiler.stage("score"):
+        if tiled:
+            data = (file_sentence_sums(sentence_vectors, sentence_counts), sentence_counts)
+            run_tiles(score_tile_corpus, data, len(files), tile, sink, min_similarity, checkpoint)
+
+        elif pairs is not None or workers > 1 or shard is not None:
+            # the data each worker needs is sent to it once
+            if mode == "corpus":
+                score_pairs, data = score_pairs_corpus, (file_sentence_sums(sentence_vectors, sentence_counts), sentence_counts)
+            else:
+                score_pairs, data = score_pairs_pairwise, (encoded_files, ranks)
+
+            # compute similarity, in chunks of pairs returned in order
+            for chunk_pairs, percentages in run_pair_chunks(score_pairs, data, len(files), pairs, workers,
+                                                            pair_range=pair_range):
+                sink.write(chunk_pairs[:, 0], chunk_pairs[:, 1], percentages)
+
+        else:
+            if mode == "corpus":
+                file_block_sums = corpus_similarities(sentence_vectors, sentence_counts)
+
+            # Loop through all files and compare each file to every other file
+            for idx, file_1 in enumerate(files):
+                others = np.arange(idx + 1, len(files))
+                # compute similarity
+                if mode == "corpus":
+                    percentages = [block_percentage(block_sum, sentence_counts[idx]) for block_sum in next(file_block_sums)]
+                else:
+                    percentages = [encoded_similarity(encoded_files[idx], encoded_files[jdx], ranks) for jdx in others]
+                sink.write(np.full(len(others), idx), others, percentages)
+
+    sink.close()
+    if shard is not None:
+        write_manifest(csv_filename, f"tf_idf-{mode}", files, shard, sink.rows, min_similarity,
+                       all_pairs=pairs is None)
+
+    if index_directory is not None:
+        # add the new files to the index
+        index["files"] = files
+        index["hashes"] = index["hashes"] + added_hashes
+        index["documents"] = file_bows
+        index["shared"]["dictionary"] = dictionary
+        index["shared"]["vocabulary"] = vocabulary
+        index["shared"]["encoded"] = encoded_files
+        index["pairs"] += sink.rows
+        save_index(index_directory, index)
 
-    # Create a temporary Pandas DataFrame from our List of dictionaries
-    temp_dataframe = pd.DataFrame(d)
+if __name__ == "__main__":
 
-    # save DataFrame to CSV file
-    temp_dataframe.to_csv(f"{csv_filename}.csv")
+    args = parser.parse_args()
 
-if __name__ == "__main__":
+    if args.index_directory is not None and args.output_format != "csv":
+        parser.error("--index appends to the results of previous runs, which needs --format csv")
+
+    if args.memory_limit is not None and args.mode != "corpus":
+        parser.error("--memory-limit scores tiles of the corpus-wide sentence index, which needs --mode corpus")
+
+    if args.shard is not None and (args.index_directory is not None or args.memory_limit is not None or args.output_format != "csv"):
+        parser.error("--shard writes csv results for a range of pairs, it cannot be combined with --index, --memory-limit or --format")
+
+    if args.output_format == "npz" and args.min_similarity is None:
+        parser.error("--format npz holds every written pair in memory until the end of the run, it needs --min-similarity")
+
+    prefetch.configure(args.read_threads, args.read_ahead)
+
+    if args.cache_dir is not None:
+        nlp_cache.configure(args.cache_dir, args.cache_size)
+
+    if args.profile is not None:
+        stage_profiler.configure(args.profile, args.profile_format, args.profile_sample)
 
     # get the directory and filename values
     directory = args.directory
     csv_filename = args.filename
     
     # call the main() function
-    main(directory, csv_filename)
\ No newline at end of file
+    main(directory, csv_filename, args.mode, args.candidates, args.lsh_threshold,
+         args.num_perm, args.bands, args.rows, args.recall_sample, args.cutoff, args.index_directory,
+         args.workers, args.output_format, args.min_similarity, args.memory_limit, args.shard, args.max_bucket)
+
+    # keep the NLP cache within its size limit
+    nlp_cache.evict()
\ No newline at end of file
@@ -0,0 +1,223 @@
+"""
+    Computes the similarity of every pair of documents tile by tile, so that the (documents x
+    documents) similarity matrix is never held in memory.
+
+    The upper triangle of the matrix is split into square tiles of rows x columns whose side is
+    chosen from a memory budget (--memory-limit). Each tile is computed with one matrix product
+    of the rows and columns of the document matrices, the pairs (i, j), i < j, at or above the
+    minimum similarity are written to the result sink, and the tile is dropped. The rows are
+    written tile by tile, so they are in a different order than the nested loop of the scripts.
+
+    With csv output the number of completed tiles is checkpointed next to the output file, as
+    <name>.tiles.json, after the rows of each tile are flushed to disk. Running the same command
+    again after an interruption truncates the csv file to the last checkpoint and continues with
+    the next tile. The checkpoint is removed once every tile is done.
+"""
+
+from typing import Any, Callable, Dict, List, Tuple
+import hashlib
+import json
+import os
+import re
+import numpy as np
+import stage_profiler
+from result_sink import ResultSink
+
+# memory used for each entry of a tile: the dense product (8 bytes), the sparse product it is
+# converted from (12), the percentages (8) and the indices of the kept pairs (16), rounded up
+BYTES_PER_ENTRY = 48
+
+# smallest side of a tile, below which the matrix products are dominated by overhead
+MIN_TILE = 16
+
+MEMORY_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+# Function to read a memory size such as "512M" or "2G"
+def parse_memory(text: str) -> int:
+    """
+    Converts a memory size with an optional K, M, G or T suffix into bytes. Used as the type
+    of the --memory-limit arguments
+
+    Args:
+        text (str): memory size, e.g. "2G", "512MB" or "1000000"
+
+    Returns:
+        size (int): the size in bytes
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmgt]?)b?\s*", text.lower())
+    if match is None:
+        raise ValueError(f"not a memory size: {text}")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+# Function to choose the side of the tiles
+def tile_size(memory_limit: int, n_docs: int) -> int:
+    """
+    Chooses the largest square tile that fits in the memory budget
+
+    Args:
+        memory_limit (int): bytes available to a tile
+        n_docs (int): number of documents
+
+    Returns:
+        tile (int): number of rows and columns of a tile
+    """
+    tile = int((memory_limit / BYTES_PER_ENTRY) ** 0.5)
+    return max(1, min(max(tile, MIN_TILE), n_docs))
+
+# Function to list the tiles of the upper triangle
+def upper_tiles(n_docs: int, tile: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Lists the tiles on and above the diagonal of a (documents x documents) matrix, row by row
+
+    Args:
+        n_docs (int): number of documents
+        tile (int): number of rows and columns of a tile
+
+    Returns:
+        tiles (list): (row start, row stop, column start, column stop) of each tile
+    """
+    return [(row, min(row + tile, n_docs), column, min(column + tile, n_docs))
+            for row in range(0, n_docs, tile) for column in range(row, n_docs, tile)]
+
+# Function to find the kept pairs of a tile
+def tile_pairs(percentages: np.ndarray, row_start: int, column_start: int, threshold: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Selects the pairs (i, j), i < j, of a tile at or above the threshold
+
+    Args:
+        percentages (numpy.ndarray): (rows x columns) similarities of the tile
+        row_start (int): index of the document of the first row
+        column_start (int): index of the document of the first column
+        threshold (int): least similarity of the kept pairs. Every pair is kept if None
+
+    Returns:
+        first, second, similarities (tuple): the document indices and similarity of each kept pair
+    """
+    rows = np.arange(row_start, row_start + percentages.shape[0])[:, None]
+    columns = np.arange(column_start, column_start + percentages.shape[1])[None, :]
+    keep = columns > rows
+    if threshold is not None:
+        keep &= percentages >= threshold
+
+    first, second = np.nonzero(keep)
+    return first + row_start, second + column_start, percentages[first, second]
+
+# Function to describe the run a checkpoint belongs to
+def run_settings(name: str, files: List[str], tile: int, threshold: int = None) -> Dict[str, Any]:
+    """
+    Returns:
+        settings (dict): what must not change for a checkpoint to be resumed: the scorer, the
+                         files, the tile size and the threshold
+    """
+    digest = hashlib.sha256("\n".join(files).encode("utf-8")).hexdigest()
+    return {"scorer": name, "documents": len(files), "files_sha256": digest, "tile": tile, "threshold": threshold}
+
+# Function to read the checkpoint of an interrupted run
+def resume(output_path: str, settings: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Reads the checkpoint of an output file and truncates the file to the rows of the completed
+    tiles. A checkpoint of a run with different settings is ignored
+
+    Args:
+        output_path (str): path to the csv output file
+        settings (dict): settings of this run, as returned by run_settings()
+
+    Returns:
+        state (dict): "tiles" (number of completed tiles), "rows" (rows written by them) and
+                      "bytes" (size of the output file after them). All 0 if there is nothing to resume
+    """
+    checkpoint_path = f"{output_path}.tiles.json"
+    if os.path.exists(checkpoint_path) and os.path.exists(output_path):
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint["settings"] == settings:
+            os.truncate(output_path, checkpoint["bytes"])
+            print(f"Resuming {output_path} after tile {checkpoint['tiles']} ({checkpoint['rows']} rows)")
+            return {"tiles": checkpoint["tiles"], "rows": checkpoint["rows"], "bytes": checkpoint["bytes"]}
+        print(f"Ignoring {checkpoint_path}, it was written by a run with other settings")
+
+    return {"tiles": 0, "rows": 0, "bytes": 0}
+
+# Function to record the completed tiles
+def save_checkpoint(output_path: str, settings: Dict[str, Any], state: Dict[str, int]) -> None:
+    """
+    Writes the checkpoint of an output file. The checkpoint is written to a temporary file and
+    renamed, so an interruption never leaves half a checkpoint
+
+    Args:
+        output_path (str): path to the csv output file
+        settings (dict): settings of this run, as returned by run_settings()
+        state (dict): completed tiles, rows and bytes, see resume()
+    """
+    checkpoint_path = f"{output_path}.tiles.json"
+    with open(f"{checkpoint_path}.tmp", "w") as checkpoint_file:
+        json.dump({"settings": settings, **state}, checkpoint_file)
+    os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+# Function to open the result sink of a tiled run
+def tiled_sink(name: str, filename: str, files: List[str], output_format: str = "csv", min_similarity: int = None,
+               memory_limit: int = 1024 ** 3):
+    """
+    Chooses the tile size and opens the result sink of a tiled run, resuming the csv output
+    of an interrupted run with the same settings
+
+    Args:
+        name (str): name of the scorer, recorded in the checkpoint
+        filename (str): name of the output file without extension
+        files (list): full paths to the files
+        output_format (str): 'csv', 'parquet' or 'npz'. Only csv output is checkpointed
+        min_similarity (int): pairs with a lower similarity are not written. All pairs are written if None
+        memory_limit (int): bytes available to a tile
+
+    Returns:
+        sink, tile, checkpoint (tuple): the result sink, the side of the tiles and the checkpoint
+                                        to pass to run_tiles() (None unless the output is csv)
+    """
+    tile = tile_size(memory_limit, len(files))
+    if output_format != "csv":
+        return ResultSink(filename, files, output_format, min_similarity), tile, None
+
+    settings = run_settings(name, files, tile, min_similarity)
+    state = resume(f"{filename}.csv", settings)
+    sink = ResultSink(filename, files, output_format, min_similarity, append=state["tiles"] > 0, first_row=state["rows"])
+
+    return sink, tile, (settings, state)
+
+# Function to score every pair tile by tile
+def run_tiles(score_tile: Callable[[Any, slice, slice], np.ndarray], data: Any, n_docs: int, tile: int, sink,
+              threshold: int = None, checkpoint: Tuple[Dict[str, Any], Dict[str, int]] = None) -> None:
+    """
+    Scores every pair of documents tile by tile and writes the kept pairs to a result sink
+
+    Args:
+        score_tile (callable): function (data, rows, columns) -> (rows x columns) array of
+                               similarities as percentages, where rows and columns are slices
+                               of document indices
+        data: data the scorer needs, e.g. a document-term matrix
+        n_docs (int): number of documents
+        tile (int): number of rows and columns of a tile, see tile_size()
+        sink (result_sink.ResultSink): where the kept pairs are written
+        threshold (int): least similarity of the written pairs. Every pair is written if None
+        checkpoint (tuple): (settings, state) returned by run_settings() and resume(), to resume
+                            the run and checkpoint each tile. Needs a csv sink. Not checkpointed if None
+    """
+    tiles = upper_tiles(n_docs, tile)
+    settings, state = checkpoint if checkpoint is not None else (None, {"tiles": 0, "rows": 0, "bytes": 0})
+    output_path = f"{sink.filename}.{sink.output_format}"
+
+    for number in range(state["tiles"], len(tiles)):
+        row_start, row_stop, column_start, column_stop = tiles[number]
+
+        with stage_profiler.stage("tile"):
+            percentages = score_tile(data, slice(row_start, row_stop), slice(column_start, column_stop))
+            first, second, similarities = tile_pairs(percentages, row_start, column_start, threshold)
+        stage_profiler.count("tiles")
+
+        sink.write(first, second, similarities)
+
+        if checkpoint is not None:
+            state = {"tiles": number + 1, "rows": sink.first_row + sink.rows, "bytes": sink.flush()}
+            save_checkpoint(output_path, settings, state)
+
+    if checkpoint is not None and os.path.exists(f"{output_path}.tiles.json"):
+        os.remove(f"{output_path}.tiles.json")
@@ -0,0 +1,189 @@
+"""
+    A vocabulary shared by all the documents of a run, so that documents are kept as compact
+    NumPy int32 arrays of token IDs instead of lists of strings.
+
+    Every distinct token is interned once, when the documents are first read. What the scorers
+    need to know about a token (whether it is a stop word, the ID of its lower case form, its
+    crc32 hash for MinHash, its place in string order) is computed once per distinct token and
+    kept in arrays indexed by ID, so the hot loops that compare documents look tokens up by ID
+    instead of hashing and comparing strings.
+
+    LocalDictionary gives the tokens of a few documents consecutive IDs in the same order as
+    gensim.corpora.Dictionary gives them to the strings, so the gensim models built from token ID
+    arrays are exactly the ones built from the strings.
+"""
+
+from typing import Iterable, List, Sequence, Tuple
+from collections import Counter
+import zlib
+import numpy as np
+
+class Vocabulary:
+    """
+    Interns tokens into consecutive integer IDs
+
+    Args:
+        stop_words (iterable): tokens flagged as stop words. The flag is case sensitive, as the
+                               stop word checks of the scripts are
+    """
+
+    def __init__(self, stop_words: Iterable[str] = ()):
+        self.stop_words = frozenset(stop_words)
+        self.token_ids = {}
+        self.tokens = []
+        # ID of the lower case form, and stop word flag, of each token
+        self.lower_ids = []
+        self.stop_flags = []
+        # arrays built from the lists above, rebuilt when the vocabulary has grown
+        self.cached = {}
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def add(self, token: str) -> int:
+        """
+        Interns a token
+
+        Args:
+            token (str): the token
+
+        Returns:
+            token_id (int): the ID of the token
+        """
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            token_id = len(self.tokens)
+            self.token_ids[token] = token_id
+            self.tokens.append(token)
+            self.stop_flags.append(token in self.stop_words)
+            self.lower_ids.append(token_id)
+            lowered = token.lower()
+            if lowered != token:
+                self.lower_ids[token_id] = self.add(lowered)
+        return token_id
+
+    def intern(self, tokens: Sequence[str]) -> np.ndarray:
+        """
+        Interns the tokens of a document or sentence
+
+        Args:
+            tokens (list): the tokens
+
+        Returns:
+            ids (numpy.ndarray): int32 array of the ID of each token
+        """
+        return np.fromiter((self.add(token) for token in tokens), dtype=np.int32, count=len(tokens))
+
+    def intern_sentences(self, sentences: Sequence[Sequence[str]]) -> List[np.ndarray]:
+        """
+        Interns the tokens of each sentence of a document
+
+        Returns:
+            sentences (list): int32 array of token IDs for each sentence
+        """
+        return [self.intern(words) for words in sentences]
+
+    def words(self, ids: Iterable[int]) -> List[str]:
+        """
+        Returns:
+            tokens (list): the token of each ID
+        """
+        return [self.tokens[token_id] for token_id in np.asarray(ids).tolist()]
+
+    def lookup(self, name: str, build) -> np.ndarray:
+        """
+        Returns an array with one entry per token, rebuilt once the vocabulary has grown
+        """
+        length, array = self.cached.get(name, (-1, None))
+        if length != len(self.tokens):
+            array = build()
+            self.cached[name] = (len(self.tokens), array)
+        return array
+
+    def stop_mask(self) -> np.ndarray:
+        """
+        Returns:
+            mask (numpy.ndarray): True for the IDs of stop words
+        """
+        return self.lookup("stop", lambda: np.array(self.stop_flags, dtype=bool))
+
+    def lower_map(self) -> np.ndarray:
+        """
+        Returns:
+            lower_ids (numpy.ndarray): the ID of the lower case form of each token
+        """
+        return self.lookup("lower", lambda: np.array(self.lower_ids, dtype=np.int32))
+
+    def hashes(self) -> np.ndarray:
+        """
+        Returns:
+            hashes (numpy.ndarray): crc32 of the UTF-8 encoding of each token, as used by minhash_lsh.py
+        """
+        return self.lookup("hashes", lambda: np.array([zlib.crc32(token.encode("utf-8")) for token in self.tokens],
+                                                      dtype=np.int64))
+
+    def ranks(self) -> List[int]:
+        """
+        Returns:
+            ranks (list): the position of each token when all tokens are sorted as strings
+        """
+        def build():
+            ranks = [0] * len(self.tokens)
+            for rank, token_id in enumerate(sorted(range(len(self.tokens)), key=self.tokens.__getitem__)):
+                ranks[token_id] = rank
+            return ranks
+        return self.lookup("ranks", build)
+
+    def normalize(self, ids: np.ndarray, drop_stop_words: bool = True) -> np.ndarray:
+        """
+        Removes the stop words from a sentence and lower cases the other tokens, i.e. the token
+        array of [w.lower() for w in words if w not in stop_words]
+
+        Args:
+            ids (numpy.ndarray): token IDs of the sentence
+            drop_stop_words (bool): remove the stop words. Only lower cases the tokens if False
+
+        Returns:
+            ids (numpy.ndarray): token IDs of the normalized sentence
+        """
+        if drop_stop_words:
+            ids = ids[~self.stop_mask()[ids]]
+        return self.lower_map()[ids]
+
+class LocalDictionary:
+    """
+    Gives the tokens of a few documents consecutive IDs, in the order gensim.corpora.Dictionary
+    would give them to the strings of the tokens: the new tokens of each document in string
+    order, document after document
+
+    Args:
+        ranks (list): ranks of the tokens in string order, from Vocabulary.ranks()
+        documents (list): token ID arrays of the documents to add
+    """
+
+    def __init__(self, ranks: List[int], documents: Iterable[np.ndarray] = ()):
+        self.ranks = ranks
+        self.token2id = {}
+        for document in documents:
+            self.doc2bow(document, allow_update=True)
+
+    def __len__(self) -> int:
+        return len(self.token2id)
+
+    def doc2bow(self, document: np.ndarray, allow_update: bool = False) -> List[Tuple[int, int]]:
+        """
+        Converts a document into a Bag of Words, like gensim.corpora.Dictionary.doc2bow()
+
+        Args:
+            document (numpy.ndarray): token IDs of the document
+            allow_update (bool): give IDs to the tokens that have none yet. Otherwise they are left out
+
+        Returns:
+            bow (list): (ID, count) of each token, in ascending ID order
+        """
+        counter = Counter(document.tolist())
+        token2id = self.token2id
+        if allow_update:
+            for token in sorted((token for token in counter if token not in token2id), key=self.ranks.__getitem__):
+                token2id[token] = len(token2id)
+        return sorted((token2id[token], count) for token, count in counter.items() if token in token2id)